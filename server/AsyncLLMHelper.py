@@ -0,0 +1,320 @@
+import asyncio
+import contextvars
+import threading
+import os
+
+import httpx
+import openai
+import anthropic
+from google import genai
+from ollama import AsyncClient as OllamaAsyncClient
+
+from LLMHelper import LLMHelper
+from admission import alimit
+from settings import get_settings
+
+# A single event loop (in its own daemon thread) per process drives all async clients,
+# so the sync wrappers can be called from any Flask worker thread.
+_loop = None
+_loop_lock = threading.Lock()
+
+# Clients and the HTTP connection pool are long-lived and shared across reload_llm calls.
+_http_client = None
+_clients = {}
+
+def get_event_loop():
+    """Return the shared background event loop, starting it on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _loop
+
+async def _in_context(coroutine, context):
+    # A task runs in a copy of the context it is created in
+    return await context.run(asyncio.ensure_future, coroutine)
+
+def _submit(coroutine, loop):
+    """
+    Schedule a coroutine on the shared event loop in a copy of the caller's context, so it
+    sees the settings snapshot and trace of the request that is waiting for it.
+    """
+    return asyncio.run_coroutine_threadsafe(_in_context(coroutine, contextvars.copy_context()), loop)
+
+def run_sync(coroutine):
+    """Run a coroutine on the shared event loop and block until it completes."""
+    return _submit(coroutine, get_event_loop()).result()
+
+def iterate_sync(async_generator):
+    """Expose an async generator running on the shared event loop as a regular generator."""
+    loop = get_event_loop()
+    try:
+        while True:
+            try:
+                yield _submit(async_generator.__anext__(), loop).result()
+            except StopAsyncIteration:
+                break
+    finally:
+        _submit(async_generator.aclose(), loop).result()
+
+def _reset_after_fork():
+    # The event loop thread does not exist in a forked child and the clients' pools are
+    # bound to that loop, start over with fresh ones on first use
+    global _loop, _loop_lock, _http_client, _clients
+    _loop = None
+    _loop_lock = threading.Lock()
+    _http_client = None
+    _clients = {}
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+async def iterate_async(async_generator):
+    """
+    Expose an async generator running on the shared event loop to another event loop (e.g. the
+    ASGI server's), awaiting every item without blocking either loop.
+    """
+    loop = get_event_loop()
+    try:
+        while True:
+            try:
+                yield await asyncio.wrap_future(_submit(async_generator.__anext__(), loop))
+            except StopAsyncIteration:
+                break
+    finally:
+        await asyncio.wrap_future(_submit(async_generator.aclose(), loop))
+
+def http_limits():
+    settings = get_settings()
+    return httpx.Limits(
+        max_connections=settings.llm_max_connections,
+        max_keepalive_connections=settings.llm_max_keepalive_connections,
+        keepalive_expiry=settings.llm_keepalive_expiry,
+    )
+
+def get_http_client():
+    """Return the keep-alive HTTP connection pool shared by the OpenAI, Azure and Anthropic clients."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=http_limits(),
+            timeout=httpx.Timeout(get_settings().llm_timeout, connect=10.0),
+        )
+    return _http_client
+
+class AsyncLLMHelper(LLMHelper):
+    """
+    asyncio-based variant of LLMHelper. All backends use their async clients on top of
+    a long-lived, keep-alive HTTP connection pool, so waiting on the network does not
+    block a thread. agenerate_response and agenerate_response_stream are the native
+    async API, generate_response and generate_response_stream remain available as sync
+    wrappers for existing callers.
+    """
+
+    def initialize_client(self):
+        """Return the cached async client for the selected backend, creating it if needed."""
+        settings = get_settings()
+        if self.backend == "openai":
+            key = (self.backend, settings.get("OPENAI_API_KEY"))
+        elif self.backend == "gemini":
+            key = (self.backend, settings.get("GOOGLE_API_KEY"))
+        elif self.backend == "azure":
+            key = (
+                self.backend,
+                settings.get("AZURE_OPENAI_API_KEY"),
+                settings.get("AZURE_OPENAI_ENDPOINT"),
+                settings.get("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"),
+                settings.get("AZURE_OPENAI_API_VERSION"),
+            )
+        elif self.backend == "anthropic":
+            key = (self.backend, settings.get("ANTHROPIC_API_KEY"))
+        else:
+            key = (self.backend, settings.get("OLLAMA_HOST"))
+
+        if key not in _clients:
+            client = run_sync(self._create_client())
+            if client is None:
+                return None
+            _clients[key] = client
+        else:
+            self.logger.info(f"Reusing async {self.backend} client.")
+        return _clients[key]
+
+    async def _create_client(self):
+        # Clients are created on the event loop so their pools are bound to it
+        settings = get_settings()
+        if self.backend == "openai":
+            self.logger.info("Initializing async OpenAI conversation.")
+            api_key = settings.get("OPENAI_API_KEY")
+            if not api_key:
+                print("Error: OPENAI_API_KEY not found in .env file.")
+                return None
+            return openai.AsyncOpenAI(api_key=api_key, http_client=get_http_client())
+        if self.backend == "gemini":
+            self.logger.info("Initializing async Gemini conversation.")
+            api_key = settings.get("GOOGLE_API_KEY")
+            if not api_key:
+                print("Error: GOOGLE_API_KEY not found in .env file.")
+                return None
+            return genai.Client(api_key=api_key).aio
+        if self.backend == "azure":
+            self.logger.info("Initializing async Azure OpenAI conversation.")
+            api_key = settings.get("AZURE_OPENAI_API_KEY")
+            api_endpoint = settings.get("AZURE_OPENAI_ENDPOINT")
+            deployment_name = settings.get("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME")
+            api_version = settings.get("AZURE_OPENAI_API_VERSION")
+            if not all([api_key, api_endpoint, deployment_name, api_version]):
+                print("Error: AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, or AZURE_OPENAI_DEPLOYMENT_NAME not found in .env file.")
+                return None
+            return openai.AsyncAzureOpenAI(
+                api_key=api_key,
+                api_version=api_version,
+                azure_endpoint=api_endpoint,
+                azure_deployment=deployment_name,
+                http_client=get_http_client(),
+            )
+        if self.backend == "anthropic":
+            self.logger.info("Initializing async Anthropic conversation.")
+            api_key = settings.get("ANTHROPIC_API_KEY")
+            if not api_key:
+                print("Error: ANTHROPIC_API_KEY not found in .env file.")
+                return None
+            return anthropic.AsyncAnthropic(api_key=api_key, http_client=get_http_client())
+        if self.backend == "ollama":
+            self.logger.info("Initializing async Ollama conversation.")
+            # The ollama client owns its httpx pool, configured with the same limits
+            return OllamaAsyncClient(limits=http_limits())
+
+    ############################
+    ### Async response functions
+    ############################
+    async def agenerate_response(self, system_prompt, prompt, history, call_type="answer"):
+        """
+        Generate a response from the LLM without blocking the event loop.
+        """
+        (history_to_use, thread) = self.build_thread(system_prompt, prompt, history)
+
+        (cache_key, response) = self.cache_lookup(call_type, thread)
+        if response is not None:
+            self.logger.debug(f"[AsyncLLMHelper] Cache hit for {call_type} call.")
+            return (response, thread)
+
+        async with alimit(f"llm_{self.backend}"):
+            response = await self._acomplete(system_prompt, history_to_use, thread)
+        if cache_key is not None:
+            self.cache.put(cache_key, response)
+
+        self.logger.debug(f"[AsyncLLMHelper] Thread: {thread}")
+        self.logger.debug(f"[AsyncLLMHelper] Response: {response}")
+
+        return (response, thread)
+
+    async def _acomplete(self, system_prompt, history_to_use, thread):
+        if self.backend in ["openai", "azure"]:
+            response = await self.client.chat.completions.create(
+                model=self.model_name,
+                messages=thread,
+                temperature=self.temperature,
+            )
+            self.log_usage(response.usage)
+            return response.choices[0].message.content
+        if self.backend == "gemini":
+            response = await self.client.models.generate_content(
+                **self._gemini_request(thread)
+            )
+            self.log_usage(response.usage_metadata)
+            return response.text
+        if self.backend == "anthropic":
+            response = await self.client.messages.create(
+                **self._anthropic_request(thread)
+            )
+            self.log_usage(response.usage)
+            return response.content[0].text
+        if self.backend == "ollama":
+            response = await self.client.chat(
+                model=self.model_name,
+                messages=thread,
+            )
+            return response.message.content
+
+    def agenerate_response_stream(self, system_prompt, prompt, history, call_type="answer"):
+        """
+        Generate a streaming response from the LLM.
+        Returns (async_generator, thread) where the async generator yields text chunks.
+        """
+        (history_to_use, thread) = self.build_thread(system_prompt, prompt, history)
+
+        self.logger.debug(f"[AsyncLLMHelper] Streaming thread: {thread}")
+
+        (cache_key, response) = self.cache_lookup(call_type, thread)
+        if response is not None:
+            self.logger.debug(f"[AsyncLLMHelper] Cache hit for streamed {call_type} call.")
+            return (self._areplay(response), thread)
+
+        stream = self._alimited_stream(self._astream(system_prompt, history_to_use, thread))
+        if cache_key is not None:
+            stream = self._acache_stream(stream, cache_key)
+        return (stream, thread)
+
+    async def _alimited_stream(self, stream):
+        async with alimit(f"llm_{self.backend}"):
+            async for chunk in stream:
+                yield chunk
+
+    async def _areplay(self, response):
+        yield response
+
+    async def _acache_stream(self, stream, cache_key):
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        self.cache.put(cache_key, "".join(chunks))
+
+    async def _astream(self, system_prompt, history_to_use, thread):
+        if self.backend in ["openai", "azure"]:
+            stream = await self.client.chat.completions.create(
+                model=self.model_name,
+                messages=thread,
+                temperature=self.temperature,
+                stream=True,
+                **self._openai_stream_options(),
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None) is not None:
+                    self.log_usage(chunk.usage)
+        elif self.backend == "gemini":
+            stream = await self.client.models.generate_content_stream(
+                **self._gemini_request(thread)
+            )
+            usage = None
+            async for chunk in stream:
+                usage = chunk.usage_metadata or usage
+                if chunk.text:
+                    yield chunk.text
+            self.log_usage(usage)
+        elif self.backend == "anthropic":
+            async with self.client.messages.stream(**self._anthropic_request(thread)) as stream:
+                async for text in stream.text_stream:
+                    yield text
+                self.log_usage((await stream.get_final_message()).usage)
+        elif self.backend == "ollama":
+            stream = await self.client.chat(
+                model=self.model_name,
+                messages=thread,
+                stream=True,
+            )
+            async for chunk in stream:
+                if chunk.message and chunk.message.content:
+                    yield chunk.message.content
+
+    #####################
+    ### Sync wrappers
+    #####################
+    def _complete(self, system_prompt, history_to_use, thread):
+        return run_sync(self._acomplete(system_prompt, history_to_use, thread))
+
+    def _stream(self, system_prompt, history_to_use, thread):
+        return iterate_sync(self._astream(system_prompt, history_to_use, thread))
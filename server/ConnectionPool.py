@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import PoolError
+
+from metrics import (
+    DB_POOL_CONNECTIONS, DB_POOL_IN_USE, DB_POOL_WAITING, DB_POOL_ACQUIRE_SECONDS,
+    DB_POOL_TIMEOUTS, DB_POOL_REPLACED
+)
+
+class ConnectionPool:
+    """
+    Thread-safe Postgres connection pool, a drop-in replacement for psycopg2's pools
+    (getconn, putconn, closeall).
+
+    - Keeps at least minconn and at most maxconn connections open.
+    - getconn waits up to timeout seconds for a free connection, then raises PoolError.
+    - Connections are validated on checkout. Closed or broken connections, and idle ones
+      that no longer answer a ping, are replaced transparently.
+    - Connections are rolled back when they are returned in the middle of a transaction.
+    - Open, in-use and waiting counts and the acquisition latency are exported to /metrics.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=30.0, validate_idle_seconds=30.0):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.validate_idle_seconds = validate_idle_seconds
+
+        self.condition = threading.Condition()
+        self.idle = deque()  # (connection, time it was returned)
+        self.size = 0
+        self.in_use = 0
+        self.closed = False
+
+        for _ in range(minconn):
+            self.idle.append((self._connect(), time.monotonic()))
+            self.size += 1
+        self._update_gauges()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("postgres_uri"),
+            minconn=int(os.getenv("db_pool_min", "1")),
+            maxconn=int(os.getenv("db_pool_max", "10")),
+            timeout=float(os.getenv("db_pool_timeout", "30")),
+            validate_idle_seconds=float(os.getenv("db_pool_validate_idle_seconds", "30")),
+        )
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn)
+
+    def _update_gauges(self):
+        DB_POOL_CONNECTIONS.set(self.size)
+        DB_POOL_IN_USE.set(self.in_use)
+
+    def _is_usable(self, conn, idle_seconds):
+        if conn.closed or conn.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if idle_seconds < self.validate_idle_seconds:
+            return True
+        # Idle for a while, the server or a proxy may have dropped it
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self, timeout=None):
+        """Check out a validated connection, waiting up to timeout (default: the pool's) seconds for one."""
+        start = time.monotonic()
+        deadline = start + (self.timeout if timeout is None else timeout)
+        conn = None
+        waiting = False
+        with self.condition:
+            try:
+                while True:
+                    if self.closed:
+                        raise PoolError("connection pool is closed")
+                    if len(self.idle) > 0:
+                        (conn, returned_at) = self.idle.pop()
+                        break
+                    if self.size < self.maxconn:
+                        # Reserve the slot, the connection is opened outside of the lock
+                        self.size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        DB_POOL_TIMEOUTS.inc()
+                        raise PoolError(
+                            f"timed out after {time.monotonic() - start:.1f} s waiting for a connection "
+                            f"({self.maxconn} in use, raise db_pool_max or db_pool_timeout)"
+                        )
+                    if not waiting:
+                        # Only callers that actually block count as waiting
+                        waiting = True
+                        DB_POOL_WAITING.inc()
+                    self.condition.wait(remaining)
+                self.in_use += 1
+            finally:
+                if waiting:
+                    DB_POOL_WAITING.dec()
+
+        try:
+            if conn is not None and not self._is_usable(conn, time.monotonic() - returned_at):
+                self._discard(conn)
+                DB_POOL_REPLACED.inc()
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            # Give the slot back so other callers are not starved
+            with self.condition:
+                self.size -= 1
+                self.in_use -= 1
+                self._update_gauges()
+                self.condition.notify()
+            raise
+
+        with self.condition:
+            self._update_gauges()
+        DB_POOL_ACQUIRE_SECONDS.observe(time.monotonic() - start)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool, closing it if asked to, broken or surplus."""
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                # Do not hand out a connection in the middle of someone else's transaction
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+
+        with self.condition:
+            self.in_use -= 1
+            if close or conn.closed or self.closed:
+                self._discard(conn)
+                self.size -= 1
+            else:
+                self.idle.append((conn, time.monotonic()))
+            self._update_gauges()
+            self.condition.notify()
+
+    def closeall(self):
+        """Close all idle connections and refuse new checkouts. In-use connections are closed when returned."""
+        with self.condition:
+            self.closed = True
+            while len(self.idle) > 0:
+                (conn, _) = self.idle.pop()
+                self._discard(conn)
+                self.size -= 1
+            self._update_gauges()
+            self.condition.notify_all()
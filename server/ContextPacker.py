@@ -0,0 +1,176 @@
+import json
+import os
+
+import tiktoken
+
+class ContextPacker:
+    """
+    Packs retrieved documents into the prompt within a token budget.
+
+    Documents are taken greedily in order of score. Chunks from the same source that are
+    (nearly) contained in an already packed chunk are dropped, and the overlap that the
+    splitter leaves between neighbouring chunks is stripped. A document that does not fit
+    is truncated if enough budget remains, and dropped otherwise.
+    """
+
+    def __init__(self, logger, formatter, encoder_name="gpt-4o", budget=8000, model_budgets=None,
+                 dedupe_threshold=0.8, min_tokens=64):
+        """
+        Args:
+            formatter: Function that renders a single document as it appears in the prompt
+            encoder_name: Model name whose tiktoken encoding approximates the LLM's tokenizer
+            budget: Default token budget for the documents
+            model_budgets: Optional dict of model name -> token budget, overriding the default
+            dedupe_threshold: Fraction of a chunk's words covered by a packed chunk from the same source above which it is dropped
+            min_tokens: Minimum remaining budget worth filling with a truncated document
+        """
+        self.logger = logger
+        self.formatter = formatter
+        self.encoder = tiktoken.encoding_for_model(encoder_name)
+        self.budget = budget
+        self.model_budgets = model_budgets or {}
+        self.dedupe_threshold = dedupe_threshold
+        self.min_tokens = min_tokens
+
+    @classmethod
+    def from_env(cls, logger, formatter):
+        """Create the packer from the environment settings, or return None if it is disabled."""
+        if os.getenv("use_context_packing") != "True":
+            return None
+        return cls(
+            logger,
+            formatter,
+            encoder_name=os.getenv("context_packing_encoder", "gpt-4o"),
+            budget=int(os.getenv("context_token_budget", "8000")),
+            model_budgets=json.loads(os.getenv("context_token_budgets") or "{}"),
+            dedupe_threshold=float(os.getenv("context_dedupe_threshold", "0.8")),
+            min_tokens=int(os.getenv("context_min_tokens", "64")),
+        )
+
+    def budget_for(self, model_name):
+        return int(self.model_budgets.get(model_name, self.budget))
+
+    def count_tokens(self, text):
+        return len(self.encoder.encode(text))
+
+    ###################
+    ### Deduplication
+    ###################
+    def _word_overlap(self, content, packed_content):
+        """Fraction of the words in content that also occur in packed_content."""
+        words = content.split()
+        if len(words) == 0:
+            return 1.0
+        packed_words = set(packed_content.split())
+        return sum(1 for word in words if word in packed_words) / len(words)
+
+    def _boundary_overlap(self, first, second, probe_size=32, max_overlap=2048):
+        """Length of the longest suffix of first that is also a prefix of second."""
+        if len(second) < probe_size:
+            return 0
+        tail = first[-max_overlap:]
+        probe = second[:probe_size]
+        index = tail.find(probe)
+        while index != -1:
+            if second.startswith(tail[index:]):
+                return len(tail) - index
+            index = tail.find(probe, index + 1)
+        return 0
+
+    def _deduplicate(self, doc, packed):
+        """
+        Compare a document against the packed documents from the same source.
+
+        Returns:
+            The document, with any overlap at its boundaries stripped, or None if it is
+            covered by a packed document.
+        """
+        source = doc['metadata'].get('source')
+        content = doc['content']
+        for other in packed:
+            if other['metadata'].get('source') != source:
+                continue
+            other_content = other['content']
+            if content in other_content or self._word_overlap(content, other_content) >= self.dedupe_threshold:
+                return None
+            # Strip the overlap the splitter left between neighbouring chunks
+            overlap = self._boundary_overlap(other_content, content)
+            if overlap > 0:
+                content = content[overlap:]
+            overlap = self._boundary_overlap(content, other_content)
+            if overlap > 0:
+                content = content[:-overlap]
+
+        if content == doc['content']:
+            return doc
+        return {**doc, 'content': content}
+
+    #############
+    ### Packing
+    #############
+    def _truncate(self, doc, tokens_available):
+        """
+        Truncate a document's content so that its formatted form fits the available tokens.
+
+        Returns:
+            (truncated_doc, tokens) or None if not even a single content token fits.
+        """
+        overhead = self.count_tokens(self.formatter({**doc, 'content': ""}))
+        content_tokens = self.encoder.encode(doc['content'])
+        keep = tokens_available - overhead - 1
+        while keep > 0:
+            truncated = {**doc, 'content': self.encoder.decode(content_tokens[:keep]) + "…"}
+            # Decoding a prefix and appending the ellipsis can merge into different tokens, so count again
+            tokens = self.count_tokens(self.formatter(truncated))
+            if tokens <= tokens_available:
+                return (truncated, tokens)
+            keep -= tokens - tokens_available
+        return None
+
+    def pack(self, docs, model_name):
+        """
+        Select and trim documents so that their formatted form fits the model's budget.
+
+        Returns:
+            (packed_docs, stats) where stats holds the budget and the number of packed,
+            deduplicated, truncated and dropped documents and tokens.
+        """
+        budget = self.budget_for(model_name)
+        stats = {
+            "budget": budget,
+            "packed_documents": 0,
+            "packed_tokens": 0,
+            "deduplicated_documents": 0,
+            "truncated_documents": 0,
+            "dropped_documents": 0,
+            "dropped_tokens": 0,
+        }
+
+        ranked = sorted(docs, key=lambda doc: doc.get('score', doc['metadata'].get('distance', 0)), reverse=True)
+        packed = []
+        remaining = budget
+        for doc in ranked:
+            original_tokens = self.count_tokens(self.formatter(doc))
+            deduplicated = self._deduplicate(doc, packed)
+            if deduplicated is None:
+                stats["deduplicated_documents"] += 1
+                stats["dropped_tokens"] += original_tokens
+                continue
+
+            tokens = self.count_tokens(self.formatter(deduplicated))
+            if tokens > remaining:
+                truncated = self._truncate(deduplicated, remaining) if remaining >= self.min_tokens else None
+                if truncated is None:
+                    stats["dropped_documents"] += 1
+                    stats["dropped_tokens"] += original_tokens
+                    continue
+                (deduplicated, tokens) = truncated
+                stats["truncated_documents"] += 1
+
+            packed.append(deduplicated)
+            remaining -= tokens
+            stats["packed_documents"] += 1
+            stats["packed_tokens"] += tokens
+            stats["dropped_tokens"] += max(0, original_tokens - tokens)
+
+        return (packed, stats)
@@ -0,0 +1,82 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import EMBEDDING_QUEUE_DEPTH, EMBEDDING_BATCH_SIZE
+from admission import limit
+
+class EmbeddingBatcher:
+    """
+    Dynamic micro-batching of query embeddings. Concurrent request threads hand their
+    query to encode(); a single worker thread collects the queued queries until it has
+    max_batch_size of them or the first one has waited max_wait_ms, runs them through the
+    model as one batched encode call and hands every caller its own vector. The batch
+    takes a single embedding admission slot, waiting callers do not hold one.
+    """
+
+    def __init__(self, logger, model, max_batch_size=32, max_wait_ms=5.0):
+        self.logger = logger
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, logger, model):
+        """Create the batcher from the environment settings, or return None if it is disabled."""
+        if os.getenv("use_embedding_batching") != "True":
+            return None
+        logger.info("Initializing embedding micro-batching.")
+        return cls(
+            logger,
+            model,
+            max_batch_size=int(os.getenv("embedding_batch_size", "32")),
+            max_wait_ms=float(os.getenv("embedding_batch_max_wait_ms", "5")),
+        )
+
+    def _ensure_worker(self):
+        # Started lazily so the thread lives in the process that serves the requests
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self.worker.start()
+
+    def encode(self, text):
+        """Encode a single query, batched together with the queries of concurrent callers."""
+        self._ensure_worker()
+        future = Future()
+        EMBEDDING_QUEUE_DEPTH.observe(self.queue.qsize())
+        self.queue.put((text, future))
+        return future.result()
+
+    def _collect_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            EMBEDDING_BATCH_SIZE.observe(len(batch))
+            try:
+                with limit("embedding"):
+                    embeddings = self.model.encode([text for (text, _) in batch], batch_size=len(batch))
+            except Exception as e:
+                self.logger.error(f"Error while encoding a batch of {len(batch)} queries: {e}")
+                for (_, future) in batch:
+                    future.set_exception(e)
+                continue
+            for ((_, future), embedding) in zip(batch, embeddings):
+                future.set_result(embedding)
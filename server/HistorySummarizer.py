@@ -0,0 +1,190 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import tiktoken
+
+from settings import get_settings
+
+class HistorySummarizer:
+    """
+    Keeps the conversation history in check by folding turns into a rolling summary.
+
+    Token counts are cached per message, so a new turn only tokenizes the messages that were
+    added since the previous one. Once the history exceeds the threshold, only the turns that
+    came after the previous summary are folded into it, rather than summarizing everything
+    from scratch. Summaries can also be computed in the background after a reply has been
+    sent; they are kept server side, keyed by the messages they cover, and substituted into
+    the history on the next turn.
+    """
+
+    def __init__(self, logger, encoder_name, cache_size=10000):
+        self.logger = logger
+        self.encoder = tiktoken.encoding_for_model(encoder_name)
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+        # Message digest -> token count
+        self.token_counts = OrderedDict()
+        # Digests of summary messages we produced, so we can recognize them in a history
+        self.summary_digests = OrderedDict()
+        # Chain digest of the messages a background summary covers -> summary text
+        self.background_summaries = OrderedDict()
+        # Chain digest -> future of a background summarization still running (claimed before it is submitted)
+        self.in_flight = {}
+
+    ####################
+    ### Helper functions
+    ####################
+    def _message_digest(self, message):
+        return hashlib.sha1(f"{message['role']}\0{message['content']}".encode("utf-8")).hexdigest()
+
+    def _chain_digests(self, messages):
+        """Digest of every prefix of the messages: entry i identifies messages[:i + 1]."""
+        digests = []
+        digest = ""
+        for message in messages:
+            digest = hashlib.sha1(f"{digest}{self._message_digest(message)}".encode("utf-8")).hexdigest()
+            digests.append(digest)
+        return digests
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _split(self, history):
+        """Split the history into the system message (if any) and the rest."""
+        head = history[:1] if len(history) > 0 and history[0]["role"] == "system" else []
+        return (head, history[len(head):])
+
+    def _is_summary(self, message):
+        with self.lock:
+            return self._message_digest(message) in self.summary_digests
+
+    def _summary_message(self, summary):
+        message = {"role": "assistant", "content": summary}
+        with self.lock:
+            self._remember(self.summary_digests, self._message_digest(message), True)
+        return message
+
+    def count_tokens(self, message):
+        """Count the tokens of a message, using the cached count if we have seen it before."""
+        digest = self._message_digest(message)
+        with self.lock:
+            count = self.token_counts.get(digest)
+        if count is None:
+            count = len(self.encoder.encode(f"{message['role']}: {message['content']}"))
+            with self.lock:
+                self._remember(self.token_counts, digest, count)
+        return count
+
+    #########################
+    ### Summarization functions
+    #########################
+    def prepare(self, history):
+        """
+        Substitute the longest prefix of the history that was already summarized in the
+        background and count the tokens of the result.
+
+        Returns:
+            (history, size): the (possibly compacted) history and its size in tokens.
+        """
+        (head, rest) = self._split(history)
+        chain = self._chain_digests(rest)
+        for i in reversed(range(len(chain))):
+            with self.lock:
+                summary = self.background_summaries.get(chain[i])
+                future = self.in_flight.get(chain[i])
+            if summary is None and future is not None:
+                # Already being summarized, waiting is cheaper than starting over
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    self.logger.warning(f"Background summarization failed: {e}")
+            if summary is not None:
+                self.logger.info(f"Using background summary covering {i + 1} messages.")
+                rest = [self._summary_message(summary)] + rest[i + 1:]
+                break
+
+        history = head + rest
+        return (history, sum(self.count_tokens(message) for message in history))
+
+    def summarize(self, history, llm):
+        """
+        Fold the history into a summary. If the history already starts with a summary we
+        produced, only the turns after it are folded in.
+
+        Returns:
+            The compacted history: the system message (if any) followed by the summary.
+        """
+        settings = get_settings()
+        (head, rest) = self._split(history)
+        if len(rest) > 0 and self._is_summary(rest[0]):
+            turns = rest[1:]
+            turns_string = "\n\n".join([f"{message['role']}: {message['content']}" for message in turns])
+            self.logger.info(f"Folding {len(turns)} new messages into the rolling summary.")
+            (summary, _) = llm.generate_response(
+                None,
+                settings.get("summarization_incremental_query").format(summary=rest[0]["content"], history=turns_string),
+                [],
+                call_type="summarization"
+            )
+        else:
+            history_string = "\n\n".join([f"{message['role']}: {message['content']}" for message in history])
+            self.logger.info(f"Summarizing {len(history)} messages.")
+            (summary, _) = llm.generate_response(
+                None,
+                settings.get("summarization_query").format(history=history_string),
+                [],
+                call_type="summarization"
+            )
+
+        return head + [self._summary_message(summary)]
+
+    def summarize_in_background(self, history, llm, executor, threshold):
+        """
+        Start summarizing the history on the executor if it exceeds the threshold, so that
+        the next turn finds a ready-made summary instead of waiting for one.
+        """
+        (compacted, size) = self.prepare(history)
+        if size <= threshold:
+            return
+
+        (_, rest) = self._split(history)
+        chain = self._chain_digests(rest)
+        if len(chain) == 0:
+            return
+        digest = chain[-1]
+        # Claim the digest before submitting, so concurrent turns do not summarize it twice
+        future = Future()
+        with self.lock:
+            if digest in self.in_flight or digest in self.background_summaries:
+                return
+            self.in_flight[digest] = future
+
+        def release():
+            with self.lock:
+                if self.in_flight.get(digest) is future:
+                    del self.in_flight[digest]
+
+        def run():
+            try:
+                summarized = self.summarize(compacted, llm)
+                with self.lock:
+                    self._remember(self.background_summaries, digest, summarized[-1]["content"])
+                future.set_result(summarized[-1]["content"])
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                release()
+
+        self.logger.info(f"Summarizing the history of {size} tokens in the background.")
+        try:
+            executor.submit(run)
+        except Exception as e:
+            future.set_exception(e)
+            release()
+            raise
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from metrics import LLM_CACHE_REQUESTS
+
+class LLMCache:
+    """
+    Prompt/response cache for LLM calls that are a pure function of their input, so only
+    calls at temperature 0 are looked up or stored (see LLMHelper.cache_lookup). Entries are keyed by backend, model, temperature and the full message
+    thread. A bounded in-memory LRU tier sits in front of an optional on-disk SQLite tier.
+    Only the call types listed in llm_cache_types are cached.
+    """
+
+    def __init__(self, logger, max_size=1024, path=None, call_types=()):
+        self.logger = logger
+        self.max_size = max_size
+        self.call_types = set(call_types)
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.disk = None
+        if path:
+            self.disk = sqlite3.connect(path, check_same_thread=False)
+            self.disk.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+            self.disk.commit()
+
+        self.logger.info(f"Caching LLM calls of type(s) {', '.join(sorted(self.call_types))}{f' (on disk at {path})' if path else ''}.")
+
+    @classmethod
+    def from_env(cls, logger):
+        """Create the cache from the environment settings, or return None if it is disabled."""
+        if os.getenv("use_llm_cache") != "True":
+            return None
+        call_types = [call_type.strip() for call_type in os.getenv("llm_cache_types", "").split(",") if call_type.strip()]
+        return cls(
+            logger,
+            max_size=int(os.getenv("llm_cache_size", "1024")),
+            path=os.getenv("llm_cache_path") or None,
+            call_types=call_types,
+        )
+
+    def enabled_for(self, call_type):
+        return call_type in self.call_types
+
+    def make_key(self, backend, model, temperature, thread):
+        payload = json.dumps([backend, model, temperature, thread], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, call_type, key):
+        """Look up a response, promoting disk hits into memory. Returns None on a miss."""
+        with self.lock:
+            response = self.memory.get(key)
+            if response is not None:
+                self.memory.move_to_end(key)
+            elif self.disk is not None:
+                row = self.disk.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    response = row[0]
+                    self._remember(key, response)
+
+        LLM_CACHE_REQUESTS.labels(call_type=call_type, result="miss" if response is None else "hit").inc()
+        return response
+
+    def put(self, key, response):
+        if response is None:
+            return
+        with self.lock:
+            self._remember(key, response)
+            if self.disk is not None:
+                self.disk.execute("INSERT OR REPLACE INTO llm_cache (key, response) VALUES (?, ?)", (key, response))
+                self.disk.commit()
+
+    def _remember(self, key, response):
+        self.memory[key] = response
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
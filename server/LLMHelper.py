@@ -5,6 +5,10 @@ from google.genai import types
 from ollama import chat as ollama_chat
 import os
 
+from metrics import LLM_PROMPT_TOKENS
+from settings import get_settings
+from admission import limit
+
 class OllamaClient():
     def __init__(self, logger, model):
         self.logger = logger
@@ -28,28 +32,47 @@ class OllamaClient():
                 yield chunk.message.content
 
 class LLMHelper:
-    def __init__(self, logger):
+    def __init__(self, logger, cache=None, backend=None):
         self.logger = logger
+        self.cache = cache
         self.temperature = float(os.getenv("temperature", 0.0))
+        if self.cache is not None and self.temperature != 0:
+            self.logger.warning(f"The LLM cache only caches calls at temperature 0, it is unused at temperature {self.temperature}.")
+        self.backend = backend or self.select_backend()
+        self.model_name = self.get_model_name()
         self.client = self.initialize_client()
+
+    def select_backend(self):
+        """Determine which LLM backend is configured, in order of precedence."""
+        for backend in ["openai", "gemini", "azure", "anthropic", "ollama"]:
+            if os.getenv(f"use_{backend}") == "True":
+                return backend
+
+        raise ValueError("No LLM backend selected.")
+
+    def get_model_name(self):
+        """Return the model (or Azure deployment) name used by the selected backend."""
+        if self.backend == "azure":
+            return os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME")
+        return os.getenv(f"{self.backend}_model_name")
     
     def initialize_client(self):
         """Initialize the Language Model based on environment configurations."""
-        if os.getenv("use_openai") == "True":
+        if self.backend == "openai":
             self.logger.info("Initializing OpenAI conversation.")
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key:
                 print("Error: OPENAI_API_KEY not found in .env file.")
                 return None
             return openai.OpenAI(api_key=api_key)
-        if os.getenv("use_gemini") == "True":
+        if self.backend == "gemini":
             self.logger.info("Initializing Gemini conversation.")
             api_key = os.getenv("GOOGLE_API_KEY")
             if not api_key:
                 print("Error: GOOGLE_API_KEY not found in .env file.")
                 return None
             return genai.Client(api_key=api_key)
-        if os.getenv("use_azure") == "True":
+        if self.backend == "azure":
             self.logger.info("Initializing Azure OpenAI conversation.")
             api_key = os.getenv("AZURE_OPENAI_API_KEY")
             api_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -64,18 +87,16 @@ class LLMHelper:
                 azure_endpoint=api_endpoint,
                 azure_deployment=deployment_name,
             )
-        if os.getenv("use_anthropic") == "True":
+        if self.backend == "anthropic":
             self.logger.info("Initializing Anthropic conversation.")
             api_key = os.getenv("ANTHROPIC_API_KEY")
             if not api_key:
                 print("Error: ANTHROPIC_API_KEY not found in .env file.")
                 return None
             return anthropic.Anthropic(api_key=api_key)
-        if os.getenv("use_ollama") == "True":
+        if self.backend == "ollama":
             self.logger.info("Initializing Ollama conversation.")
             return OllamaClient(self.logger,os.getenv("ollama_model_name"))
-        
-        raise ValueError("No LLM backend selected.")
 
     def clean_reply(self, reply):
         # Remove the code decorators and backticks that ChatGPT returns
@@ -87,9 +108,16 @@ class LLMHelper:
         
         return reply
 
-    def generate_response(self, system_prompt, prompt, history):
+    ##########################
+    ### Thread building helpers
+    ##########################
+    def build_thread(self, system_prompt, prompt, history):
         """
-        Generate a response from the LLM.
+        Combine the system prompt, history and user prompt into a message thread.
+
+        Returns:
+            (history_to_use, thread): the history with the system prompt applied and
+            the full thread including the new user message.
         """
         history_to_use = history.copy()
         if system_prompt is not None:
@@ -98,79 +126,168 @@ class LLMHelper:
             elif len(history) == 0:
                 history_to_use = [{"role": "system", "content": system_prompt}]
             elif history[0]["role"] == "system":
-                history_to_use[0]["content"] = system_prompt
+                history_to_use[0] = {"role": "system", "content": system_prompt}
         
         # Make the thread
         thread = history_to_use + [{"role": "user", "content": prompt}]
+        return (history_to_use, thread)
 
-        # Generate the response
-        if os.getenv("use_openai") == "True" or os.getenv("use_azure") == "True":
-            model = os.getenv("openai_model_name")
-            if os.getenv("use_azure") == "True":
-                model = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME")
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=thread,
+    def _system_instruction(self, thread):
+        """
+        Return the system message of the thread, if any. This also covers follow-up turns
+        that keep the system prompt (and its documents) from the history.
+        """
+        if len(thread) > 0 and thread[0]["role"] == "system":
+            return thread[0]["content"]
+        return None
+
+    def _gemini_request(self, thread):
+        """Gemini requires us to remodel the history."""
+        gemini_thread = []
+        for message in thread:
+            if message["role"] == "user":
+                gemini_thread.append(types.UserContent(message["content"]))
+            elif message["role"] == "assistant":
+                gemini_thread.append(types.ModelContent(message["content"]))
+
+        system_instruction = self._system_instruction(thread)
+        if system_instruction is not None:
+            config = types.GenerateContentConfig(
+                system_instruction=system_instruction,
                 temperature=self.temperature,
             )
-            response = response.choices[0].message.content
-        if os.getenv("use_gemini") == "True":
-            # Gemini requires us to remodel the history
-            gemini_thread = []
-            for message in thread:
-                if message["role"] == "user":
-                    gemini_thread.append(types.UserContent(message["content"]))
-                elif message["role"] == "assistant":
-                    gemini_thread.append(types.ModelContent(message["content"]))
-
-            if system_prompt is not None:
-                config = types.GenerateContentConfig(
-                    system_instruction=history_to_use[0]["content"],
-                    temperature=self.temperature,
-                )
-            else:
-                config = types.GenerateContentConfig(
-                    temperature=self.temperature,
-                )
-            
-            response = self.client.models.generate_content(
-                model=os.getenv("gemini_model_name"),
-                contents=gemini_thread,
-                config=config,
+        else:
+            config = types.GenerateContentConfig(
+                temperature=self.temperature,
             )
-            response = response.text
-        if os.getenv("use_anthropic") == "True":
-            # Anthropic requires us to remodel the history
-            anthropic_thread = []
-            for message in thread:
-                if message["role"] != "system":
-                    new_message = {
-                        "role": message["role"],
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": message["content"]
-                            }
-                        ]
-                    }
-                    anthropic_thread.append(new_message)
-            
-            if system_prompt is not None:
-                response = self.client.messages.create(
-                    model=os.getenv("anthropic_model_name"),
-                    system=history_to_use[0]["content"],
-                    temperature=self.temperature,
-                    messages=anthropic_thread,
-                )
+
+        return {
+            "model": self.model_name,
+            "contents": gemini_thread,
+            "config": config,
+        }
+
+    def _anthropic_request(self, thread):
+        """
+        Anthropic requires us to remodel the history. With prompt caching enabled, cache
+        breakpoints are set on the system prompt (instruction and documents) and on the last
+        message of the history, so follow-up turns only pay for the new user message.
+        """
+        settings = get_settings()
+        use_prompt_caching = settings.use_prompt_caching
+        anthropic_thread = []
+        for message in thread:
+            if message["role"] != "system":
+                new_message = {
+                    "role": message["role"],
+                    "content": [{"type": "text", "text": message["content"]}]
+                }
+                anthropic_thread.append(new_message)
+        if use_prompt_caching and len(anthropic_thread) > 1:
+            anthropic_thread[-2]["content"][-1]["cache_control"] = {"type": "ephemeral"}
+
+        kwargs = {
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "messages": anthropic_thread,
+            "max_tokens": settings.anthropic_max_tokens,
+        }
+        system_instruction = self._system_instruction(thread)
+        if system_instruction is not None:
+            if use_prompt_caching:
+                kwargs["system"] = [{"type": "text", "text": system_instruction, "cache_control": {"type": "ephemeral"}}]
             else:
-                response = self.client.messages.create(
-                    model=os.getenv("anthropic_model_name"),
-                    temperature=self.temperature,
-                    messages=anthropic_thread,
-                )
-            response = response.content
-        if os.getenv("use_ollama") == "True":
-            response = self.client.chat(thread)
+                kwargs["system"] = system_instruction
+        return kwargs
+
+    def _openai_stream_options(self):
+        """Ask OpenAI to report token usage (including cached tokens) at the end of a stream."""
+        if self.backend == "openai":
+            return {"stream_options": {"include_usage": True}}
+        return {}
+
+    ###################
+    ### Usage logging
+    ###################
+    def log_usage(self, usage):
+        """
+        Log the prompt token usage reported by the provider, including how many prompt
+        tokens were served from the provider's prefix cache.
+        """
+        if usage is None:
+            return
+        if self.backend in ["openai", "azure"]:
+            prompt_tokens = usage.prompt_tokens
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached_tokens = (details.cached_tokens if details is not None else 0) or 0
+            cache_write_tokens = 0
+        elif self.backend == "anthropic":
+            cached_tokens = getattr(usage, "cache_read_input_tokens", 0) or 0
+            cache_write_tokens = getattr(usage, "cache_creation_input_tokens", 0) or 0
+            prompt_tokens = usage.input_tokens + cached_tokens + cache_write_tokens
+        elif self.backend == "gemini":
+            prompt_tokens = usage.prompt_token_count or 0
+            cached_tokens = usage.cached_content_token_count or 0
+            cache_write_tokens = 0
+        else:
+            return
+
+        LLM_PROMPT_TOKENS.labels(backend=self.backend, kind="total").inc(prompt_tokens)
+        LLM_PROMPT_TOKENS.labels(backend=self.backend, kind="cached").inc(cached_tokens)
+        LLM_PROMPT_TOKENS.labels(backend=self.backend, kind="cache_write").inc(cache_write_tokens)
+        self.logger.info(
+            f"[LLMHelper] {self.backend} prompt tokens: {prompt_tokens}, cached: {cached_tokens}"
+            f"{f', written to cache: {cache_write_tokens}' if cache_write_tokens else ''}."
+        )
+
+    ###################
+    ### Cache functions
+    ###################
+    def cache_lookup(self, call_type, thread):
+        """
+        Look up a cached response for this call type and thread.
+
+        Only calls at temperature 0 are cached, at any other temperature a response
+        is sampled and replaying an earlier one would change the behaviour.
+
+        Returns:
+            (cache_key, response): cache_key is None if the call is not cached,
+            response is None on a cache miss.
+        """
+        if self.cache is None or self.temperature != 0 or not self.cache.enabled_for(call_type):
+            return (None, None)
+        cache_key = self.cache.make_key(self.backend, self.model_name, self.temperature, thread)
+        return (cache_key, self.cache.get(call_type, cache_key))
+
+    def _cache_stream(self, stream, cache_key):
+        """Pass a stream through, caching the full response once it has completed."""
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        self.cache.put(cache_key, "".join(chunks))
+
+    ######################
+    ### Response functions
+    ######################
+    def generate_response(self, system_prompt, prompt, history, call_type="answer"):
+        """
+        Generate a response from the LLM. The call type identifies the pipeline step
+        (e.g. answer, title, hyde) and decides whether the response may be cached.
+        """
+        (history_to_use, thread) = self.build_thread(system_prompt, prompt, history)
+
+        # Serve from the cache if we can
+        (cache_key, response) = self.cache_lookup(call_type, thread)
+        if response is not None:
+            self.logger.debug(f"[LLMHelper] Cache hit for {call_type} call.")
+            return (response, thread)
+
+        # Generate the response
+        with limit(f"llm_{self.backend}"):
+            response = self._complete(system_prompt, history_to_use, thread)
+        if cache_key is not None:
+            self.cache.put(cache_key, response)
         
         # Debug print the thread and response
         self.logger.debug(f"[LLMHelper] Thread: {thread}")
@@ -178,100 +295,85 @@ class LLMHelper:
 
         return (response, thread)
 
-    def generate_response_stream(self, system_prompt, prompt, history):
+    def _complete(self, system_prompt, history_to_use, thread):
+        """Run a single (non-streaming) completion against the selected backend."""
+        if self.backend in ["openai", "azure"]:
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=thread,
+                temperature=self.temperature,
+            )
+            self.log_usage(response.usage)
+            return response.choices[0].message.content
+        if self.backend == "gemini":
+            response = self.client.models.generate_content(
+                **self._gemini_request(thread)
+            )
+            self.log_usage(response.usage_metadata)
+            return response.text
+        if self.backend == "anthropic":
+            response = self.client.messages.create(
+                **self._anthropic_request(thread)
+            )
+            self.log_usage(response.usage)
+            return response.content[0].text
+        if self.backend == "ollama":
+            return self.client.chat(thread)
+
+    def generate_response_stream(self, system_prompt, prompt, history, call_type="answer"):
         """
         Generate a streaming response from the LLM.
         Returns (generator, thread) where generator yields text chunks.
         """
-        history_to_use = history.copy()
-        if system_prompt is not None:
-            if len(history) > 0 and history[0]["role"] != "system":
-                history_to_use = [{"role": "system", "content": system_prompt}] + history
-            elif len(history) == 0:
-                history_to_use = [{"role": "system", "content": system_prompt}]
-            elif history[0]["role"] == "system":
-                history_to_use[0]["content"] = system_prompt
-
-        # Make the thread
-        thread = history_to_use + [{"role": "user", "content": prompt}]
+        (history_to_use, thread) = self.build_thread(system_prompt, prompt, history)
 
         self.logger.debug(f"[LLMHelper] Streaming thread: {thread}")
 
-        def _stream_openai(model):
+        (cache_key, response) = self.cache_lookup(call_type, thread)
+        if response is not None:
+            self.logger.debug(f"[LLMHelper] Cache hit for streamed {call_type} call.")
+            return (iter([response]), thread)
+
+        stream = self._limited_stream(self._stream(system_prompt, history_to_use, thread))
+        if cache_key is not None:
+            stream = self._cache_stream(stream, cache_key)
+        return (stream, thread)
+
+    def _limited_stream(self, stream):
+        # The slot is taken when the stream is first read and held until it is exhausted or closed
+        with limit(f"llm_{self.backend}"):
+            yield from stream
+
+    def _stream(self, system_prompt, history_to_use, thread):
+        """Yield text chunks of a streaming completion against the selected backend."""
+        if self.backend in ["openai", "azure"]:
             stream = self.client.chat.completions.create(
-                model=model,
+                model=self.model_name,
                 messages=thread,
                 temperature=self.temperature,
                 stream=True,
+                **self._openai_stream_options(),
             )
             for chunk in stream:
                 if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
                     yield chunk.choices[0].delta.content
-
-        def _stream_gemini():
-            gemini_thread = []
-            for message in thread:
-                if message["role"] == "user":
-                    gemini_thread.append(types.UserContent(message["content"]))
-                elif message["role"] == "assistant":
-                    gemini_thread.append(types.ModelContent(message["content"]))
-
-            if system_prompt is not None:
-                config = types.GenerateContentConfig(
-                    system_instruction=history_to_use[0]["content"],
-                    temperature=self.temperature,
-                )
-            else:
-                config = types.GenerateContentConfig(
-                    temperature=self.temperature,
-                )
-
+                if getattr(chunk, "usage", None) is not None:
+                    self.log_usage(chunk.usage)
+        elif self.backend == "gemini":
             stream = self.client.models.generate_content_stream(
-                model=os.getenv("gemini_model_name"),
-                contents=gemini_thread,
-                config=config,
+                **self._gemini_request(thread)
             )
+            usage = None
             for chunk in stream:
+                usage = chunk.usage_metadata or usage
                 if chunk.text:
                     yield chunk.text
-
-        def _stream_anthropic():
-            anthropic_thread = []
-            for message in thread:
-                if message["role"] != "system":
-                    new_message = {
-                        "role": message["role"],
-                        "content": [{"type": "text", "text": message["content"]}]
-                    }
-                    anthropic_thread.append(new_message)
-
-            kwargs = {
-                "model": os.getenv("anthropic_model_name"),
-                "temperature": self.temperature,
-                "messages": anthropic_thread,
-                "max_tokens": int(os.getenv("anthropic_max_tokens", "4096")),
-            }
-            if system_prompt is not None:
-                kwargs["system"] = history_to_use[0]["content"]
-
-            with self.client.messages.stream(**kwargs) as stream:
+            self.log_usage(usage)
+        elif self.backend == "anthropic":
+            with self.client.messages.stream(**self._anthropic_request(thread)) as stream:
                 for text in stream.text_stream:
                     yield text
-
-        def _stream_ollama():
+                self.log_usage(stream.get_final_message().usage)
+        elif self.backend == "ollama":
             for text in self.client.chat_stream(thread):
                 yield text
-
-        if os.getenv("use_openai") == "True" or os.getenv("use_azure") == "True":
-            model = os.getenv("openai_model_name")
-            if os.getenv("use_azure") == "True":
-                model = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME")
-            return (_stream_openai(model), thread)
-        elif os.getenv("use_gemini") == "True":
-            return (_stream_gemini(), thread)
-        elif os.getenv("use_anthropic") == "True":
-            return (_stream_anthropic(), thread)
-        elif os.getenv("use_ollama") == "True":
-            return (_stream_ollama(), thread)
-        else:
-            raise ValueError("No LLM backend selected.")
\ No newline at end of file
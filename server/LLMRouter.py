@@ -0,0 +1,272 @@
+import contextvars
+import os
+import queue
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from metrics import LLM_ROUTED_CALLS, LLM_HEDGED_CALLS, LLM_FALLBACKS
+
+class LLMRouter:
+    """
+    Routes LLM calls over several configured backends at once (llm_backends).
+
+    Main answers go to llm_main_backend and auxiliary calls (titles, fetch decisions,
+    HyDE, rewrites, summaries, ...) to llm_aux_backend, e.g. a local Ollama model. When
+    the chosen backend has not produced its first token (or, for short non-streamed
+    auxiliary calls, its response) within llm_hedge_deadline_ms, the same request is sent
+    to the next backend as well and whichever answers first wins. A backend that fails falls
+    back to the next one. Rolling latencies per backend and call type decide the order: a
+    preferred backend that has recently been slower than the deadline is tried after a
+    faster one.
+
+    Non-streamed answers are never hedged, as their latency is that of the full answer
+    rather than its first token, and they are ordered on the first-token latency of
+    streamed answers only.
+
+    Exposes the same generate_response/generate_response_stream interface as LLMHelper.
+    """
+
+    def __init__(self, logger, helper_class, cache=None):
+        self.logger = logger
+        backends = [backend.strip() for backend in os.getenv("llm_backends").split(",") if backend.strip()]
+        self.helpers = {backend: helper_class(logger, cache=cache, backend=backend) for backend in backends}
+        self.main_backend = os.getenv("llm_main_backend") or backends[0]
+        self.aux_backend = os.getenv("llm_aux_backend") or self.main_backend
+        self.hedge_deadline = float(os.getenv("llm_hedge_deadline_ms", "0")) / 1000
+        self.latency_window = float(os.getenv("llm_latency_window_seconds", "300"))
+
+        # Rolling (timestamp, seconds) samples per (backend, kind, call type), kind being
+        # "ttft" for streamed first tokens or "response" for full responses
+        self.latencies = defaultdict(lambda: deque(maxlen=100))
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("llm_router_workers", "32")),
+            thread_name_prefix="llm-router"
+        )
+        self.logger.info(
+            f"Routing LLM calls over {', '.join(backends)}: main answers to {self.main_backend}, "
+            f"auxiliary calls to {self.aux_backend}, hedging after {self.hedge_deadline * 1000:.0f} ms."
+        )
+
+    @property
+    def backend(self):
+        return self.main_backend
+
+    @property
+    def model_name(self):
+        """The model of the backend the next answer goes to first (barring hedging and fallbacks)."""
+        return self.helpers[self.backend_order("answer", "ttft", log=False)[0]].model_name
+
+    def build_thread(self, system_prompt, prompt, history):
+        return self.helpers[self.main_backend].build_thread(system_prompt, prompt, history)
+
+    #####################
+    ### Latency tracking
+    #####################
+    def record_latency(self, backend, kind, call_type, seconds):
+        with self.lock:
+            self.latencies[(backend, kind, call_type)].append((time.monotonic(), seconds))
+
+    def rolling_latency(self, backend, kind, call_type):
+        """Median latency of the backend for the call type within the rolling window, or None without recent samples."""
+        cutoff = time.monotonic() - self.latency_window
+        with self.lock:
+            samples = [seconds for (timestamp, seconds) in self.latencies.get((backend, kind, call_type), ()) if timestamp >= cutoff]
+        if len(samples) == 0:
+            return None
+        return statistics.median(samples)
+
+    def backend_order(self, call_type, kind, log=True):
+        """
+        Order in which to try the backends for a call: the preferred backend for the call type
+        first, unless it has recently been slower than the hedge deadline for this call type
+        and another backend is faster, followed by the others from fastest to slowest.
+        """
+        preferred = self.main_backend if call_type == "answer" else self.aux_backend
+        # Backends without recent samples count as meeting the deadline, so they get probed again
+        def latency(backend):
+            rolling = self.rolling_latency(backend, kind, call_type)
+            return self.hedge_deadline if rolling is None else rolling
+
+        others = sorted([backend for backend in self.helpers if backend != preferred], key=latency)
+        if self.hedge_deadline > 0 and len(others) > 0 and latency(preferred) > self.hedge_deadline and latency(others[0]) < latency(preferred):
+            if log:
+                self.logger.info(f"Backend {preferred} is degraded, preferring {others[0]} for {call_type} call.")
+            return [others[0], preferred] + others[1:]
+        return [preferred] + others
+
+    def close(self):
+        """Let the calls in flight finish and release the worker threads once they are done."""
+        self.executor.shutdown(wait=False)
+
+    def _submit(self, function, *args):
+        # Every task runs in a copy of the caller's context, so the pinned settings and the trace go along
+        return self.executor.submit(contextvars.copy_context().run, function, *args)
+
+    ######################
+    ### Response functions
+    ######################
+    def _timed_response(self, backend, args, call_type):
+        start = time.perf_counter()
+        result = self.helpers[backend].generate_response(*args, call_type=call_type)
+        self.record_latency(backend, "response", call_type, time.perf_counter() - start)
+        return result
+
+    def generate_response(self, system_prompt, prompt, history, call_type="answer"):
+        """
+        Generate a response, hedging to the next backend if the first one has not answered
+        within the deadline and falling back to the next one on errors. Answers are only
+        fallen back on: a full answer taking longer than the deadline is no reason to
+        generate it twice.
+        """
+        args = (system_prompt, prompt, history)
+        if call_type == "answer":
+            order = self.backend_order(call_type, "ttft")
+        else:
+            order = self.backend_order(call_type, "response")
+        hedging = self.hedge_deadline > 0 and call_type != "answer"
+        primary = order[0]
+        remaining = order[1:]
+        futures = {self._submit(self._timed_response, primary, args, call_type): primary}
+        LLM_ROUTED_CALLS.labels(backend=primary, call_type=call_type).inc()
+        hedged = False
+        error = None
+
+        while len(futures) > 0:
+            timeout = self.hedge_deadline if (hedging and not hedged and len(remaining) > 0) else None
+            (done, _) = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if len(done) == 0:
+                # Deadline passed without an answer, send the request to the next backend as well
+                hedged = True
+                backend = remaining.pop(0)
+                self.logger.info(f"No response from {primary} within the deadline, hedging {call_type} call to {backend}.")
+                futures[self._submit(self._timed_response, backend, args, call_type)] = backend
+                continue
+
+            for future in done:
+                backend = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    self.logger.warning(f"LLM backend {backend} failed for {call_type} call: {e}")
+                    continue
+                if hedged:
+                    LLM_HEDGED_CALLS.labels(primary=primary, winner=backend).inc()
+                # Losers that have not started yet are dropped, a running request cannot be
+                # interrupted and only records its latency
+                for loser in futures:
+                    loser.cancel()
+                return result
+
+            # Everything in flight failed, fall back to the next backend
+            if len(futures) == 0 and len(remaining) > 0:
+                backend = remaining.pop(0)
+                LLM_FALLBACKS.labels(backend=backend).inc()
+                self.logger.info(f"Falling back to {backend} for {call_type} call.")
+                futures[self._submit(self._timed_response, backend, args, call_type)] = backend
+
+        raise error
+
+    def _pump_stream(self, backend, args, call_type, output, stop):
+        """Run a backend's stream, pushing (backend, kind, payload) items onto the output queue."""
+        start = time.perf_counter()
+        stream = None
+        if stop.is_set():
+            # Another backend won before this one got a worker
+            return
+        try:
+            (stream, _) = self.helpers[backend].generate_response_stream(*args, call_type=call_type)
+            first = True
+            for chunk in stream:
+                if first:
+                    self.record_latency(backend, "ttft", call_type, time.perf_counter() - start)
+                    first = False
+                if stop.is_set():
+                    break
+                output.put((backend, "token", chunk))
+            output.put((backend, "done", None))
+        except Exception as e:
+            output.put((backend, "error", e))
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+
+    def _hedged_stream(self, order, args, call_type):
+        output = queue.Queue()
+        stops = {}
+        futures = []
+        active = set()
+        remaining = list(order)
+        primary = order[0]
+
+        def start(backend):
+            stops[backend] = threading.Event()
+            active.add(backend)
+            futures.append(self._submit(self._pump_stream, backend, args, call_type, output, stops[backend]))
+
+        start(remaining.pop(0))
+        LLM_ROUTED_CALLS.labels(backend=primary, call_type=call_type).inc()
+        winner = None
+        hedged = False
+        try:
+            while True:
+                timeout = None
+                if winner is None and not hedged and self.hedge_deadline > 0 and len(remaining) > 0:
+                    timeout = self.hedge_deadline
+                try:
+                    (backend, kind, payload) = output.get(timeout=timeout)
+                except queue.Empty:
+                    # No first token within the deadline, send the request to the next backend as well
+                    hedged = True
+                    backend = remaining.pop(0)
+                    self.logger.info(f"No first token from {primary} within the deadline, hedging stream to {backend}.")
+                    start(backend)
+                    continue
+
+                if winner is not None and backend != winner:
+                    continue
+                if kind == "error":
+                    active.discard(backend)
+                    self.logger.warning(f"LLM backend {backend} failed while streaming: {payload}")
+                    if winner is not None:
+                        raise payload
+                    if len(active) == 0:
+                        if len(remaining) == 0:
+                            raise payload
+                        backend = remaining.pop(0)
+                        LLM_FALLBACKS.labels(backend=backend).inc()
+                        self.logger.info(f"Falling back to {backend} for streamed call.")
+                        start(backend)
+                    continue
+
+                if winner is None:
+                    # First backend to produce output wins, the others are stopped
+                    winner = backend
+                    for (other, stop) in stops.items():
+                        if other != winner:
+                            stop.set()
+                    if hedged:
+                        LLM_HEDGED_CALLS.labels(primary=primary, winner=winner).inc()
+                if kind == "done":
+                    return
+                yield payload
+        finally:
+            for stop in stops.values():
+                stop.set()
+            for future in futures:
+                future.cancel()
+
+    def generate_response_stream(self, system_prompt, prompt, history, call_type="answer"):
+        """
+        Generate a streaming response, hedging to the next backend if the first one has not
+        produced a token within the deadline.
+        Returns (generator, thread) where generator yields text chunks.
+        """
+        args = (system_prompt, prompt, history)
+        (_, thread) = self.build_thread(*args)
+        order = self.backend_order(call_type, "ttft")
+        return (self._hedged_stream(order, args, call_type), thread)
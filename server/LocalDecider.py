@@ -0,0 +1,111 @@
+import os
+import random
+
+import numpy as np
+
+from metrics import LOCAL_DECISIONS, LOCAL_DECISION_AGREEMENT, LOCAL_DECISION_SIMILARITY
+
+class LocalDecider:
+    """
+    Answers the yes/no fetch-new-documents and rewrite decisions from embedding similarity
+    instead of an LLM round trip, when the similarity is clearly high or low.
+
+    - Fetch: the new prompt is compared with the previous question and the previously
+      retrieved chunks. Similarity at or above fetch_high means a follow-up (no fetch), at
+      or below fetch_low a new topic (fetch). In between the LLM decides.
+    - Rewrite: the prompt is compared with the retrieved chunks. At or above rewrite_high
+      the documents contain the answer, at or below rewrite_low they do not.
+
+    A fraction (audit_rate) of the local decisions is still sent to the LLM, and every LLM
+    answer is recorded with the similarity it was made at, so the thresholds can be
+    calibrated from the logs and the /metrics histograms.
+    """
+
+    def __init__(self, logger, embeddings, retriever, fetch_low, fetch_high, rewrite_low, rewrite_high, audit_rate=0.0):
+        self.logger = logger
+        self.embeddings = embeddings
+        self.retriever = retriever
+        self.thresholds = {
+            "fetch": (fetch_low, fetch_high),
+            "rewrite": (rewrite_low, rewrite_high),
+        }
+        self.audit_rate = audit_rate
+
+    @classmethod
+    def from_env(cls, logger, embeddings, retriever):
+        """Create the decider from the environment settings, or return None if it is disabled."""
+        if os.getenv("use_local_decisions") != "True":
+            return None
+        logger.info("Initializing local embedding-based fetch and rewrite decisions.")
+        return cls(
+            logger,
+            embeddings,
+            retriever,
+            fetch_low=float(os.getenv("local_fetch_low", "0.2")),
+            fetch_high=float(os.getenv("local_fetch_high", "0.75")),
+            rewrite_low=float(os.getenv("local_rewrite_low", "0.2")),
+            rewrite_high=float(os.getenv("local_rewrite_high", "0.6")),
+            audit_rate=float(os.getenv("local_decision_audit_rate", "0.05")),
+        )
+
+    def document_embeddings(self, documents):
+        """Stored embeddings of the documents, encoding the ones without a known chunk id."""
+        ids = [document.get("id") for document in documents if document.get("id") is not None]
+        stored = self.retriever.get_embeddings(ids)
+        missing = [document["content"] for document in documents if document.get("id") not in stored]
+        embeddings = list(stored.values())
+        if len(missing) > 0:
+            embeddings.extend(self.embeddings.encode(missing, batch_size=len(missing)))
+        return embeddings
+
+    def max_similarity(self, prompt_embedding, embeddings):
+        if len(embeddings) == 0:
+            return None
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        query = np.asarray(prompt_embedding, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        return float(np.max(matrix @ query / np.maximum(norms, 1e-12)))
+
+    def _decide(self, decision, similarity, above, below):
+        if similarity is None:
+            return None
+        (low, high) = self.thresholds[decision]
+        if similarity >= high:
+            return above
+        if similarity <= low:
+            return below
+        return None
+
+    def fetch_decision(self, prompt_embedding, previous_question, previous_documents):
+        """
+        Returns:
+            ("yes" | "no" | None, similarity) where "yes" means new documents should be fetched
+            and None means the similarity is in the uncertain band.
+        """
+        embeddings = self.document_embeddings(previous_documents or [])
+        if previous_question:
+            embeddings.append(self.embeddings.encode(previous_question))
+        similarity = self.max_similarity(prompt_embedding, embeddings)
+        return (self._decide("fetch", similarity, "no", "yes"), similarity)
+
+    def rewrite_decision(self, prompt_embedding, documents):
+        """
+        Returns:
+            ("yes" | "no" | None, similarity) where "yes" means the documents contain the answer
+            and None means the similarity is in the uncertain band.
+        """
+        similarity = self.max_similarity(prompt_embedding, self.document_embeddings(documents or []))
+        return (self._decide("rewrite", similarity, "yes", "no"), similarity)
+
+    def should_audit(self):
+        return random.random() < self.audit_rate
+
+    def record(self, decision, similarity, local, llm):
+        """Log a decision so the thresholds can be calibrated. local or llm is None if not made."""
+        LOCAL_DECISIONS.labels(decision=decision, decided_by="local" if local is not None else "llm").inc()
+        if llm is not None and similarity is not None:
+            LOCAL_DECISION_SIMILARITY.labels(decision=decision, llm_answer=llm).observe(similarity)
+        if local is not None and llm is not None:
+            LOCAL_DECISION_AGREEMENT.labels(decision=decision, agreed=str(local == llm).lower()).inc()
+        similarity = "n/a" if similarity is None else f"{similarity:.3f}"
+        self.logger.info(f"Local {decision} decision: similarity={similarity} local={local} llm={llm}")
@@ -1,60 +1,147 @@
-from typing import List, Optional
+from typing import Callable, Iterator, List, NamedTuple, Optional
 import re
 
+class Chunk(NamedTuple):
+    """A chunk of text and the character offsets it spans in the text it was split from."""
+    text: str
+    start: int
+    end: int
+
 class ParagraphChunker:
     """
-    A text splitter that respects paragraph boundaries and combines paragraphs until 
+    A text splitter that respects paragraph boundaries and combines paragraphs until
     reaching a maximum size without breaking any paragraph.
+
+    Sizes are measured in characters, or with any length function such as the embedding
+    model's tokenizer (see for_tokenizer). With split_oversized, a paragraph larger than the
+    maximum size is split at sentence ends (and at spaces, if a sentence is still too large),
+    so no chunk exceeds what the embedding model can take.
     """
-    
-    def __init__(self, 
+
+    # Split points inside an oversized paragraph, tried in order
+    sentence_end = re.compile(r"(?<=[.!?])\s+")
+    whitespace = re.compile(r"\s+")
+
+    def __init__(self,
                  max_chunk_size: int = 512,
-                 paragraph_separator: str = "\n\s*\n"
+                 paragraph_separator: str = r"\n\s*\n",
+                 length_function: Optional[Callable[[str], int]] = None,
+                 split_oversized: bool = False
                  ):
         """
         Initialize the ParagraphChunker.
-        
+
         Args:
-            max_chunk_size: The target maximum size for each chunk (can be exceeded for large paragraphs)
+            max_chunk_size: The target maximum size for each chunk (can be exceeded for large paragraphs unless split_oversized is set)
             paragraph_separator: Regex pattern to identify paragraph breaks (default: two or more newlines)
+            length_function: Measures the size of a text, len (characters) by default
+            split_oversized: Split paragraphs larger than max_chunk_size instead of keeping them whole
         """
         self.max_chunk_size = max_chunk_size
         self.paragraph_separator = paragraph_separator
-        
-    def split_text(self, text: str) -> List[str]:
+        self.separator = re.compile(paragraph_separator)
+        self.length_function = length_function or len
+        self.split_oversized = split_oversized
+        # The paragraph joiner is not counted in characters, as it never has been
+        self.joiner_size = 0 if length_function is None else self.length_function("\n\n")
+
+    @classmethod
+    def for_tokenizer(cls, tokenizer, max_tokens: int, paragraph_separator: str = r"\n\s*\n"):
+        """A chunker measuring in tokens of a (Hugging Face) tokenizer, splitting paragraphs that do not fit."""
+        def count_tokens(text):
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        return cls(max_tokens, paragraph_separator, length_function=count_tokens, split_oversized=True)
+
+    def _spans(self, text, start, end, pattern):
+        """The (start, end, text) of the stripped, non-empty parts between the matches of pattern within text[start:end]."""
+        position = start
+        for match in pattern.finditer(text, start, end):
+            part = text[position:match.start()]
+            stripped = part.strip()
+            if stripped:
+                offset = position + len(part) - len(part.lstrip())
+                yield (offset, offset + len(stripped), stripped)
+            position = match.end()
+        part = text[position:end]
+        stripped = part.strip()
+        if stripped:
+            offset = position + len(part) - len(part.lstrip())
+            yield (offset, offset + len(stripped), stripped)
+
+    def _pieces(self, text, start, end):
+        """Split an oversized paragraph into (start, end, text, size) pieces that fit, where possible."""
+        for (sentence_start, sentence_end, sentence) in self._spans(text, start, end, self.sentence_end):
+            size = self.length_function(sentence)
+            if size <= self.max_chunk_size:
+                yield (sentence_start, sentence_end, sentence, size)
+                continue
+            for (word_start, word_end, word) in self._spans(text, sentence_start, sentence_end, self.whitespace):
+                yield (word_start, word_end, word, self.length_function(word))
+
+    def _units(self, text):
+        """Yield the (paragraph index, start, end, text, size) units to combine into chunks."""
+        length_function = self.length_function
+        for (index, (start, end, paragraph)) in enumerate(self._spans(text, 0, len(text), self.separator)):
+            size = length_function(paragraph)
+            if size > self.max_chunk_size and self.split_oversized:
+                for (piece_start, piece_end, piece, piece_size) in self._pieces(text, start, end):
+                    yield (index, piece_start, piece_end, piece, piece_size)
+            else:
+                yield (index, start, end, paragraph, size)
+
+    def _chunk(self, text, units):
+        # Pieces of the same paragraph keep their original spacing, paragraphs are joined by a blank line
+        parts = []
+        previous = None
+        for (index, start, end, part) in units:
+            if index == previous:
+                parts[-1] = text[parts_start:end]
+            else:
+                parts.append(part)
+                parts_start = start
+            previous = index
+        return Chunk("\n\n".join(parts), units[0][1], units[-1][2])
+
+    def iter_chunks(self, text: str) -> Iterator[Chunk]:
         """
-        Split text into chunks, respecting paragraph boundaries.
-        
+        Lazily split text into chunks, respecting paragraph boundaries.
+
         Args:
             text: The text to split
-            
-        Returns:
-            A list of text chunks
+
+        Yields:
+            Chunks with the character offsets of their first and last paragraph in text
         """
-        # Split the text into paragraphs
-        paragraphs = re.split(self.paragraph_separator, text)
-        paragraphs = [p.strip() for p in paragraphs if p.strip()]
-        
-        chunks = []
         current_chunk = []
         current_size = 0
-        
-        for paragraph in paragraphs:
-            paragraph_size = len(paragraph)
-            
+
+        for (index, start, end, paragraph, size) in self._units(text):
+            added_size = size + (self.joiner_size if current_chunk else 0)
+
             # If adding this paragraph would exceed the max size and we already have content,
             # finalize the current chunk
-            if current_size > 0 and current_size + paragraph_size > self.max_chunk_size:
-                chunks.append("\n\n".join(current_chunk))
+            if current_chunk and current_size + added_size > self.max_chunk_size:
+                yield self._chunk(text, current_chunk)
                 current_chunk = []
                 current_size = 0
-            
+                added_size = size
+
             # Add the paragraph to the current chunk
-            current_chunk.append(paragraph)
-            current_size += paragraph_size
-        
+            current_chunk.append((index, start, end, paragraph))
+            current_size += added_size
+
         # Add the final chunk if it has content
         if current_chunk:
-            chunks.append("\n\n".join(current_chunk))
-        
-        return chunks
\ No newline at end of file
+            yield self._chunk(text, current_chunk)
+
+    def split_text(self, text: str) -> List[str]:
+        """
+        Split text into chunks, respecting paragraph boundaries.
+
+        Args:
+            text: The text to split
+
+        Returns:
+            A list of text chunks
+        """
+        return [chunk.text for chunk in self.iter_chunks(text)]
@@ -3,10 +3,68 @@ import psycopg2.extras
 from typing import List, Dict
 from collections import defaultdict
 import regex
+import json
+import numpy as np
 import nltk
 import os
+import time
 from tqdm import tqdm
 
+from tracing import stage
+from settings import get_settings
+
+def reciprocal_rank_fusion(bm25_rows, vector_rows, k, rrf_k=60):
+    """
+    Fuse BM25 rows (id, content, metadata) and vector rows (id, content, metadata, distance),
+    both ordered best first, by Reciprocal Rank Fusion and return the top k documents.
+    """
+    # ── Build per-document RRF scores in Python ───────────────
+    # Dict keyed by document id → accumulated data
+    doc_map: Dict[str, dict] = {}
+
+    # Process BM25 results
+    for rank, row in enumerate(bm25_rows):
+        doc_id, content, metadata = row
+        rrf_score = 1.0 / (rrf_k + rank + 1)
+        if doc_id not in doc_map:
+            doc_map[doc_id] = {
+                "id": doc_id,
+                "content": content,
+                "metadata": metadata,
+                "rrf_score": 0.0,
+                "sources": [],
+            }
+        doc_map[doc_id]["rrf_score"] += rrf_score
+        doc_map[doc_id]["sources"].append("bm25")
+
+    # Process vector results
+    for rank, row in enumerate(vector_rows):
+        doc_id, content, metadata, distance = row
+        rrf_score = 1.0 / (rrf_k + rank + 1)
+        if doc_id not in doc_map:
+            doc_map[doc_id] = {
+                "id": doc_id,
+                "content": content,
+                "metadata": metadata,
+                "rrf_score": 0.0,
+                "sources": [],
+            }
+        doc_map[doc_id]["rrf_score"] += rrf_score
+        doc_map[doc_id]["sources"].append("vector")
+
+    # Sort by combined RRF score descending, take top_k
+    ranked = sorted(doc_map.values(), key=lambda d: d["rrf_score"], reverse=True)[:k]
+
+    return [{
+        "id": doc["id"],
+        "content": doc["content"],
+        "metadata": {
+            **doc["metadata"],
+            "distance": doc["rrf_score"],
+            "sources": ",".join(doc["sources"]),
+        },
+    } for doc in ranked]
+
 class PostgresHybridRetriever():
     def __init__(self, connection_pool):
         self.connection_pool = connection_pool
@@ -48,6 +106,32 @@ class PostgresHybridRetriever():
                     END IF;
                 END $$;
             """)
+            # Deletion looks chunks up by source
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_metadata_sparse_source ON ragmeup_sparse_embeddings ((metadata->>'source'));
+                CREATE INDEX IF NOT EXISTS idx_metadata_dense_source ON ragmeup_dense_embeddings ((metadata->>'source'));""")
+            # Catalog of the ingested documents, so listings do not have to scan all chunks
+            cursor.execute("SELECT to_regclass('ragmeup_documents') IS NULL;")
+            new_catalog = cursor.fetchone()[0]
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS ragmeup_documents (
+                    source TEXT PRIMARY KEY,
+                    dataset TEXT,
+                    chunks INTEGER NOT NULL DEFAULT 0,
+                    bytes BIGINT NOT NULL DEFAULT 0,
+                    ingested_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                CREATE INDEX IF NOT EXISTS ragmeup_documents_dataset ON ragmeup_documents (dataset);""")
+            if new_catalog:
+                # Existing databases get their catalog built once from the chunks
+                cursor.execute("""
+                    INSERT INTO ragmeup_documents (source, dataset, chunks, bytes)
+                    SELECT metadata->>'source', metadata->>'dataset', COUNT(*), SUM(octet_length(content))
+                    FROM ragmeup_sparse_embeddings
+                    WHERE metadata->>'source' IS NOT NULL
+                    GROUP BY 1, 2
+                    ON CONFLICT (source) DO NOTHING;""")
             conn.commit()
         
         self.connection_pool.putconn(conn)
@@ -63,21 +147,22 @@ class PostgresHybridRetriever():
                 try:
                     conn = self.connection_pool.getconn()
                     with conn.cursor() as cursor:
-                        # Add to the BM25 index
+                        # Add to the BM25 index, the inserted chunks are counted in the catalog
                         records = [
                             (doc['id'], doc['content'], doc['metadata'])
                             for doc in chunk
                         ]
-                        psycopg2.extras.execute_batch(
+                        inserted = psycopg2.extras.execute_values(
                             cursor,
                             f"""
                                 INSERT INTO ragmeup_sparse_embeddings (id, content, metadata)
-                                VALUES (%s, %s, %s)
+                                VALUES %s
                                 ON CONFLICT (id) DO NOTHING
+                                RETURNING metadata->>'source', metadata->>'dataset', octet_length(content)
                             """,
-                            records
+                            records,
+                            fetch=True
                         )
-                        conn.commit()
                     
                         # Now the dense embeddings
                         records = [
@@ -93,14 +178,41 @@ class PostgresHybridRetriever():
                             """,
                             records
                         )
+
+                        self._update_catalog(cursor, inserted)
+                        # Chunks and catalog are committed together
                         conn.commit()
                     pbar.update(len(chunk))
                 except Exception as e:
                     print(f"Error executing Postgres query while inserting documents: {e}")
+                    if conn:
+                        conn.rollback()
                 finally:
                     if conn:
                         self.connection_pool.putconn(conn)
     
+    def _update_catalog(self, cursor, inserted):
+        """Add the inserted (source, dataset, bytes) chunks to the document catalog."""
+        documents = defaultdict(lambda: [0, 0])
+        for (source, dataset, size) in inserted:
+            documents[(source, dataset)][0] += 1
+            documents[(source, dataset)][1] += size or 0
+        if len(documents) == 0:
+            return
+        psycopg2.extras.execute_values(
+            cursor,
+            """
+                INSERT INTO ragmeup_documents (source, dataset, chunks, bytes)
+                VALUES %s
+                ON CONFLICT (source) DO UPDATE SET
+                    dataset = EXCLUDED.dataset,
+                    chunks = ragmeup_documents.chunks + EXCLUDED.chunks,
+                    bytes = ragmeup_documents.bytes + EXCLUDED.bytes,
+                    updated_at = now()
+            """,
+            [(source, dataset, chunks, size) for ((source, dataset), (chunks, size)) in documents.items()]
+        )
+
     def has_data(self):
         conn = None
         try:
@@ -125,20 +237,20 @@ class PostgresHybridRetriever():
         return sanitized_query
 
     def get_relevant_documents(self, query, query_embedding, datasets):
-        if os.getenv("use_rrf") == "True":
+        if get_settings().use_rrf:
             return self._get_relevant_documents_rrf(query, query_embedding, datasets)
         return self._get_relevant_documents_minmax(query, query_embedding, datasets)
 
     # ─── Min-max normalization ranking (original) ─────────────────────
     def _get_relevant_documents_minmax(self, query, query_embedding, datasets):
+        settings = get_settings()
         conn = None
         try:
             conn = self.connection_pool.getconn()
             with conn.cursor() as cursor:
                 # Remove the re2 prompt if it exists
-                if os.getenv("use_re2") == "True":
-                    os.getenv("re2_prompt")
-                    index = query.find(f"\n{os.getenv('re2_prompt')}")
+                if settings.use_re2:
+                    index = query.find(f"\n{settings.re2_prompt}")
                     query = query[:index]
                 
                 # Build the dataset filter
@@ -209,17 +321,19 @@ class PostgresHybridRetriever():
                     ORDER BY hybrid_score DESC
                     LIMIT %s;
                 """
-                cursor.execute(search_command, (
-                    self.escape_query(query),
-                    int(os.getenv("vector_store_k")),
-                    query_embedding.tolist(),
-                    int(os.getenv("vector_store_k")),
-                    int(os.getenv("vector_store_k")),
-                ))
-                
-                results = cursor.fetchall()
+                # BM25 and vector search run as a single query here, so they are timed together
+                with stage("hybrid_search"):
+                    cursor.execute(search_command, (
+                        self.escape_query(query),
+                        settings.vector_store_k,
+                        query_embedding.tolist(),
+                        settings.vector_store_k,
+                        settings.vector_store_k,
+                    ))
+                    results = cursor.fetchall()
 
                 results = [{
+                    "id": row[0],
                     "content": row[1],
                     "metadata": {**row[2], "distance": float(row[6])}
                 } for row in results]
@@ -247,14 +361,14 @@ class PostgresHybridRetriever():
     # Enable with use_rrf=True and optionally set rrf_k (default 60).
     # ──────────────────────────────────────────────────────────────────
     def _get_relevant_documents_rrf(self, query, query_embedding, datasets):
+        settings = get_settings()
         conn = None
         try:
             conn = self.connection_pool.getconn()
             with conn.cursor() as cursor:
                 # Remove the re2 prompt if it exists
-                if os.getenv("use_re2") == "True":
-                    os.getenv("re2_prompt")
-                    index = query.find(f"\n{os.getenv('re2_prompt')}")
+                if settings.use_re2:
+                    index = query.find(f"\n{settings.re2_prompt}")
                     query = query[:index]
 
                 # Build the dataset filter
@@ -264,8 +378,8 @@ class PostgresHybridRetriever():
                 else:
                     dataset_filter = "TRUE"
 
-                k = int(os.getenv("vector_store_k"))
-                rrf_k = int(os.getenv("rrf_k", "60"))
+                k = settings.vector_store_k
+                rrf_k = settings.rrf_k
                 # Fetch a wider window so RRF has enough candidates
                 fetch_k = max(k * 4, 20)
 
@@ -277,11 +391,12 @@ class PostgresHybridRetriever():
                     ORDER BY paradedb.score(id) DESC
                     LIMIT %s;
                 """
-                cursor.execute(bm25_query, (
-                    self.escape_query(query),
-                    fetch_k,
-                ))
-                bm25_rows = cursor.fetchall()
+                with stage("bm25"):
+                    cursor.execute(bm25_query, (
+                        self.escape_query(query),
+                        fetch_k,
+                    ))
+                    bm25_rows = cursor.fetchall()
 
                 # ── Vector results (ordered by cosine distance asc) ───
                 vector_query = f"""
@@ -292,55 +407,15 @@ class PostgresHybridRetriever():
                     ORDER BY distance
                     LIMIT %s;
                 """
-                cursor.execute(vector_query, (
-                    query_embedding.tolist(),
-                    fetch_k,
-                ))
-                vector_rows = cursor.fetchall()
-
-            # ── Build per-document RRF scores in Python ───────────────
-            # Dict keyed by document id → accumulated data
-            doc_map: Dict[str, dict] = {}
-
-            # Process BM25 results
-            for rank, row in enumerate(bm25_rows):
-                doc_id, content, metadata = row
-                rrf_score = 1.0 / (rrf_k + rank + 1)
-                if doc_id not in doc_map:
-                    doc_map[doc_id] = {
-                        "content": content,
-                        "metadata": metadata,
-                        "rrf_score": 0.0,
-                        "sources": [],
-                    }
-                doc_map[doc_id]["rrf_score"] += rrf_score
-                doc_map[doc_id]["sources"].append("bm25")
-
-            # Process vector results
-            for rank, row in enumerate(vector_rows):
-                doc_id, content, metadata, distance = row
-                rrf_score = 1.0 / (rrf_k + rank + 1)
-                if doc_id not in doc_map:
-                    doc_map[doc_id] = {
-                        "content": content,
-                        "metadata": metadata,
-                        "rrf_score": 0.0,
-                        "sources": [],
-                    }
-                doc_map[doc_id]["rrf_score"] += rrf_score
-                doc_map[doc_id]["sources"].append("vector")
-
-            # Sort by combined RRF score descending, take top_k
-            ranked = sorted(doc_map.values(), key=lambda d: d["rrf_score"], reverse=True)[:k]
-
-            results = [{
-                "content": doc["content"],
-                "metadata": {
-                    **doc["metadata"],
-                    "distance": doc["rrf_score"],
-                    "sources": ",".join(doc["sources"]),
-                },
-            } for doc in ranked]
+                with stage("vector"):
+                    cursor.execute(vector_query, (
+                        query_embedding.tolist(),
+                        fetch_k,
+                    ))
+                    vector_rows = cursor.fetchall()
+
+            with stage("fusion"):
+                results = reciprocal_rank_fusion(bm25_rows, vector_rows, k, rrf_k)
 
             return results
 
@@ -350,39 +425,141 @@ class PostgresHybridRetriever():
             if conn:
                 self.connection_pool.putconn(conn)
 
-    def delete(self, filenames: List[str]) -> None:
+    def get_embeddings(self, ids):
+        """Return the stored dense embeddings for the given chunk ids, as a dict of id to vector."""
+        if len(ids) == 0:
+            return {}
         conn = None
         try:
             conn = self.connection_pool.getconn()
             with conn.cursor() as cursor:
-                placeholders = ','.join(['%s'] * len(filenames))
-                cursor.execute(f"DELETE FROM ragmeup_sparse_embeddings WHERE metadata->>'source' IN ({placeholders});", tuple(filenames))
-                conn.commit()
-                delete_count = cursor.rowcount
-                cursor.execute(f"DELETE FROM ragmeup_dense_embeddings WHERE metadata->>'source' IN ({placeholders});", tuple(filenames))
+                cursor.execute("SELECT id, embedding::text FROM ragmeup_dense_embeddings WHERE id = ANY(%s);", (list(ids),))
+                return {row[0]: np.array(json.loads(row[1]), dtype=np.float32) for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"Error while getting embeddings from Postgres: {e}")
+            return {}
+        finally:
+            if conn:
+                self.connection_pool.putconn(conn)
+
+    def delete(self, filenames: List[str]) -> int:
+        """
+        Delete all chunks of the given source files, returns the number of chunks deleted.
+
+        Chunks are deleted in batches of delete_batch_size, every batch from both stores and
+        the catalog in one transaction, pausing delete_batch_pause_ms between batches so
+        deleting a huge number of chunks does not hold up concurrent searches.
+        """
+        settings = get_settings()
+        batch_size = settings.delete_batch_size
+        pause = settings.delete_batch_pause_ms / 1000
+        filenames = list(filenames)
+        delete_count = 0
+        conn = None
+        try:
+            conn = self.connection_pool.getconn()
+            while True:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        DELETE FROM ragmeup_sparse_embeddings
+                        WHERE id IN (
+                            SELECT id FROM ragmeup_sparse_embeddings
+                            WHERE metadata->>'source' = ANY(%s)
+                            LIMIT %s
+                        )
+                        RETURNING id, metadata->>'source', octet_length(content);
+                    """, (filenames, batch_size))
+                    deleted = cursor.fetchall()
+                    ids = [row[0] for row in deleted]
+                    cursor.execute("DELETE FROM ragmeup_dense_embeddings WHERE id = ANY(%s);", (ids,))
+                    self._remove_from_catalog(cursor, deleted)
+                    conn.commit()
+                delete_count += len(deleted)
+                if len(deleted) < batch_size:
+                    break
+                time.sleep(pause)
+
+            # Dense chunks without a sparse counterpart (e.g. after an interrupted insert)
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM ragmeup_dense_embeddings WHERE metadata->>'source' = ANY(%s);", (filenames,))
+                cursor.execute("DELETE FROM ragmeup_documents WHERE source = ANY(%s);", (filenames,))
                 conn.commit()
-                
-                # Close the current transaction before running VACUUM
-                conn.close()
-                return delete_count
+            return delete_count
         except Exception as e:
             print(f"Error while deleting documents from Postgres: {e}")
             if conn:
                 conn.rollback()
+            return delete_count
         finally:
             # Return the connection to the pool
             if conn:
                 self.connection_pool.putconn(conn)
+
+    def _remove_from_catalog(self, cursor, deleted):
+        """Subtract the deleted (id, source, bytes) chunks from the document catalog."""
+        documents = defaultdict(lambda: [0, 0])
+        for (_, source, size) in deleted:
+            documents[source][0] += 1
+            documents[source][1] += size or 0
+        if len(documents) == 0:
+            return
+        psycopg2.extras.execute_values(
+            cursor,
+            """
+                UPDATE ragmeup_documents AS documents SET
+                    chunks = documents.chunks - deleted.chunks,
+                    bytes = documents.bytes - deleted.bytes,
+                    updated_at = now()
+                FROM (VALUES %s) AS deleted (source, chunks, bytes)
+                WHERE documents.source = deleted.source
+            """,
+            [(source, chunks, size) for (source, (chunks, size)) in documents.items()]
+        )
+        cursor.execute("DELETE FROM ragmeup_documents WHERE source = ANY(%s) AND chunks <= 0;", (list(documents),))
+
+    def get_sources(self, dataset):
+        """The source files of a dataset, from the catalog."""
+        conn = None
+        try:
+            conn = self.connection_pool.getconn()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT source FROM ragmeup_documents WHERE dataset = %s;", (dataset,))
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error while getting the sources of dataset {dataset} from Postgres: {e}")
+            return []
+        finally:
+            if conn:
+                self.connection_pool.putconn(conn)
     
-    def get_all_document_names(self):
+    def get_all_document_names(self, offset=0, limit=None, dataset=None):
+        """
+        List the ingested documents from the catalog, ordered by filename. Pass limit (and
+        offset) to page through them and dataset to list a single dataset.
+        """
         conn = None
         try:
             conn = self.connection_pool.getconn()
             with conn.cursor() as cursor:
-                cursor.execute("select distinct metadata->>'source', metadata->>'dataset' from ragmeup_sparse_embeddings;")
+                cursor.execute(
+                    """
+                        SELECT source, dataset, chunks, bytes, ingested_at, updated_at
+                        FROM ragmeup_documents
+                        WHERE %(dataset)s::text IS NULL OR dataset = %(dataset)s
+                        ORDER BY source
+                        LIMIT %(limit)s OFFSET %(offset)s;
+                    """,
+                    {"dataset": dataset, "limit": limit, "offset": offset}
+                )
                 results = cursor.fetchall()
-                return [{"filename": row[0].replace(f'{os.getenv("data_directory")}/', ""), "dataset": row[1]} for row in results]
-                conn.commit()
+                return [{
+                    "filename": row[0].replace(f'{os.getenv("data_directory")}/', ""),
+                    "dataset": row[1],
+                    "chunks": row[2],
+                    "bytes": row[3],
+                    "ingested_at": row[4].isoformat(),
+                    "updated_at": row[5].isoformat(),
+                } for row in results]
         except Exception as e:
             print(f"Error while getting all document names from Postgres: {e}")
             if conn:
@@ -397,7 +574,7 @@ class PostgresHybridRetriever():
         try:
             conn = self.connection_pool.getconn()
             with conn.cursor() as cursor:
-                cursor.execute("select distinct metadata->>'dataset' from ragmeup_sparse_embeddings;")
+                cursor.execute("SELECT DISTINCT dataset FROM ragmeup_documents ORDER BY dataset;")
                 results = cursor.fetchall()
                 return [row[0] for row in results]
         except Exception as e:
@@ -409,6 +586,24 @@ class PostgresHybridRetriever():
             if conn:
                 self.connection_pool.putconn(conn)
 
+    def count_documents(self, dataset=None):
+        """Number of ingested documents (in a dataset), from the catalog."""
+        conn = None
+        try:
+            conn = self.connection_pool.getconn()
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT COUNT(*) FROM ragmeup_documents WHERE %(dataset)s::text IS NULL OR dataset = %(dataset)s;",
+                    {"dataset": dataset}
+                )
+                return cursor.fetchone()[0]
+        except Exception as e:
+            print(f"Error while counting documents in Postgres: {e}")
+            return None
+        finally:
+            if conn:
+                self.connection_pool.putconn(conn)
+
     def close(self):
         try:
             self.connection_pool.closeall()
@@ -1,14 +1,21 @@
+import asyncio
+import gc
 import hashlib
 import os
 import glob
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import json
 import jq
 from pptx import Presentation
 
-import tiktoken
-
 from LLMHelper import LLMHelper
+from AsyncLLMHelper import AsyncLLMHelper, iterate_async
+from LLMCache import LLMCache
+from LLMRouter import LLMRouter
 
 from sentence_transformers import SentenceTransformer
 from PostgresHybridRetriever import PostgresHybridRetriever
@@ -16,54 +23,129 @@ from PostgresHybridRetriever import PostgresHybridRetriever
 from docling.document_converter import DocumentConverter
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_experimental.text_splitter import SemanticChunker
 from ParagraphChunker import ParagraphChunker
+from SemanticChunker import SemanticChunker
 
 from Reranker import Reranker
+from ContextPacker import ContextPacker
+from EmbeddingBatcher import EmbeddingBatcher
+from HistorySummarizer import HistorySummarizer
+from LocalDecider import LocalDecider
 
+from startup import StartupTracker
 from provenance import compute_llm_provenance, compute_rerank_provenance, DocumentSimilarityAttribution
 
+from metrics import SPECULATIVE_RETRIEVALS, SPECULATIVE_SAVED_SECONDS
+from tracing import start_trace, stage
+from settings import get_settings, snapshot
+from admission import limit
+
+def _next_event(generator):
+    """Advance a generator, returning (finished, event) or (finished, return value) once it is exhausted."""
+    try:
+        return (False, next(generator))
+    except StopIteration as e:
+        return (True, e.value)
+
+async def _iterate_in_executor(generator, executor, context):
+    """Consume a blocking generator from async code, one item at a time in the executor."""
+    loop = asyncio.get_running_loop()
+    while True:
+        (finished, event) = await loop.run_in_executor(executor, context.run, _next_event, generator)
+        if finished:
+            return
+        yield event
+
 class RAGHelper:
     """
     A helper class to manage retrieval-augmented generation (RAG) processes,
     including data loading, chunking, vector storage, and retrieval.
     """
 
-    def __init__(self, logger, db_pool):
+    def __init__(self, logger, db_pool, startup=None):
         """
-        Initializes the RAGHelper class and loads environment variables.
+        Initializes the RAGHelper class and loads environment variables. The duration of every
+        startup phase is logged and reported to the startup tracker.
         """
         self.logger = logger
         self.db_pool = db_pool
+        self.startup = startup if startup is not None else StartupTracker(logger)
+
+        # Worker threads for work that runs alongside a request (e.g. speculative retrieval)
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("background_workers", "4")),
+            thread_name_prefix="raghelper"
+        )
+
+        # Docling is only needed for ingestion, it is set up on first use
+        self._converter = None
+        self._converter_lock = threading.Lock()
 
-        # Set up docling
-        self.converter = DocumentConverter()
+        # Initialize the LLM (with its response cache) and embeddings
+        with self.startup.phase("llm"):
+            self.llm_cache = LLMCache.from_env(self.logger)
+            self.llm = self.initialize_llm()
+        with self.startup.phase("embeddings"):
+            self.embeddings = self.initialize_embeddings()
+            self.embedding_batcher = EmbeddingBatcher.from_env(self.logger, self.embeddings)
 
-        # Initialize the LLM and embeddings
-        self.llm = LLMHelper(logger)
-        self.embeddings = self.initialize_embeddings()
+        # Token-budgeted packing of the documents into the prompt
+        self.context_packer = ContextPacker.from_env(self.logger, self.format_document)
 
         # Set up the PostgresHybridRetriever
-        self.retriever = PostgresHybridRetriever(self.db_pool)
-        self.retriever.setup_database(self.embeddings.get_sentence_embedding_dimension())
+        with self.startup.phase("database"):
+            self.retriever = PostgresHybridRetriever(self.db_pool)
+            self.retriever.setup_database(self.embeddings.get_sentence_embedding_dimension())
+
+        # Embedding-based fetch and rewrite decisions, falling back to the LLM when uncertain
+        self.local_decider = LocalDecider.from_env(self.logger, self.embeddings, self.retriever)
 
         # Initialize the reranker
         if os.getenv("rerank") == "True":
-            self.logger.info("Initializing reranker.")
-            self.reranker = Reranker()
+            with self.startup.phase("reranker"):
+                self.logger.info("Initializing reranker.")
+                self.reranker = Reranker()
 
         # Load the data into the vector store
         self.splitter = self._initialize_text_splitter()
         if not self.retriever.has_data():
-            self.load_data()
+            with self.startup.phase("ingestion"):
+                self.load_data()
         
         # Provenance
         if os.getenv("provenance_method") == "similarity":
-            self.similarity_attribution = DocumentSimilarityAttribution()
+            with self.startup.phase("provenance"):
+                self.similarity_attribution = DocumentSimilarityAttribution()
         
         # Summarization
         if os.getenv("use_summarization") == "True":
-            self.tiktoken_encoder = tiktoken.encoding_for_model(os.getenv("summarization_encoder"))
+            self.summarizer = HistorySummarizer(self.logger, os.getenv("summarization_encoder"))
+
+        # Run the models once so the first request does not pay for lazy initialization. A
+        # preloading master leaves this to the workers, see gunicorn.conf.py
+        if os.getenv("RAGMEUP_PRELOAD"):
+            self.logger.info("Leaving the model warm-up to the worker processes.")
+        else:
+            with self.startup.phase("warm-up"):
+                self.warm_up()
+
+    @property
+    def converter(self):
+        with self._converter_lock:
+            if self._converter is None:
+                self.logger.info("Initializing docling document converter.")
+                self._converter = DocumentConverter()
+            return self._converter
+
+    def warm_up(self):
+        """Run a query through the embedding model and reranker(s)."""
+        text = "What is this document about?"
+        self.embeddings.encode(text)
+        if os.getenv("rerank") == "True":
+            document = {"content": "This document is about warming up the models.", "metadata": {"distance": 1.0}}
+            self.reranker.rerank_documents([document], text)
+            if self.reranker.first_stage is not None:
+                self.reranker._rerank(self.reranker.first_stage, [document], text)
 
     ############################
     ### Initialization functions
@@ -73,7 +155,9 @@ class RAGHelper:
         environment variables have been refreshed.  This is called from
         the /config PUT endpoint when ``reinitialize`` is requested."""
         self.logger.info("Reloading LLM client.")
-        self.llm = LLMHelper(self.logger)
+        self.close_llm()
+        self.llm = self.initialize_llm()
+        self.context_packer = ContextPacker.from_env(self.logger, self.format_document)
 
         # Reinitialise reranker if configured
         if os.getenv("rerank") == "True":
@@ -86,8 +170,53 @@ class RAGHelper:
 
         # Summarization encoder
         if os.getenv("use_summarization") == "True":
-            import tiktoken
-            self.tiktoken_encoder = tiktoken.encoding_for_model(os.getenv("summarization_encoder"))
+            self.summarizer = HistorySummarizer(self.logger, os.getenv("summarization_encoder"))
+
+    def before_fork(self):
+        """
+        Release what must not be inherited by forked workers (see gunicorn.conf.py): the
+        flashrank reranker's ONNX Runtime sessions own thread pools, they are recreated in
+        every worker by after_fork. The model files stay in the flashrank cache.
+        """
+        if hasattr(self, "reranker"):
+            del self.reranker
+            gc.collect()
+
+    def after_fork(self, db_pool):
+        """
+        Prepare a worker process forked from the process that loaded the models (see
+        gunicorn.conf.py). The model weights are shared copy-on-write, but database
+        connections, LLM clients, the response cache's SQLite handle, the reranker's ONNX
+        Runtime sessions and threads do not survive a fork and are recreated for this
+        process, after which the models are warmed up.
+        """
+        self.db_pool = db_pool
+        self.retriever.connection_pool = db_pool
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("background_workers", "4")),
+            thread_name_prefix="raghelper"
+        )
+        self.llm_cache = LLMCache.from_env(self.logger)
+        self.close_llm()
+        self.llm = self.initialize_llm()
+        if os.getenv("rerank") == "True":
+            self.reranker = Reranker()
+        self.warm_up()
+
+    def close_llm(self):
+        """Release the worker threads of the LLM router that is about to be replaced."""
+        if isinstance(getattr(self, "llm", None), LLMRouter):
+            self.llm.close()
+
+    def initialize_llm(self):
+        """
+        Initialize the LLM helper, using the async client layer if configured. With
+        several llm_backends configured, a router over all of them is used instead.
+        """
+        helper_class = AsyncLLMHelper if os.getenv("use_async_llm") == "True" else LLMHelper
+        if os.getenv("llm_backends"):
+            return LLMRouter(self.logger, helper_class, cache=self.llm_cache)
+        return helper_class(self.logger, cache=self.llm_cache)
 
     def initialize_embeddings(self):
         """Initialize the embeddings based on the CPU/GPU configuration."""
@@ -128,13 +257,20 @@ class RAGHelper:
             ],
         )
         elif splitter_type == "SemanticChunker":
-            return SemanticChunker(
-                self.embeddings,
-                breakpoint_threshold_type=os.getenv("semantic_chunker_breakpoint_threshold_type"),
-                breakpoint_threshold_amount=os.getenv("semantic_chunker_breakpoint_threshold_amount"),
-                number_of_chunks=os.getenv("semantic_chunker_number_of_chunks"),
-            )
+            return SemanticChunker.from_env(self.embeddings)
         elif splitter_type == "ParagraphChunker":
+            if os.getenv("paragraph_chunker_unit", "characters") == "tokens":
+                # The embedding model truncates everything past its maximum sequence length
+                # (which includes two special tokens), so chunks must fit within it
+                max_tokens = min(
+                    int(os.getenv("paragraph_chunker_max_chunk_size")),
+                    self.embeddings.max_seq_length - 2
+                )
+                return ParagraphChunker.for_tokenizer(
+                    self.embeddings.tokenizer,
+                    max_tokens,
+                    paragraph_separator=os.getenv("paragraph_chunker_paragraph_separator")
+                )
             return ParagraphChunker(
                 max_chunk_size=int(os.getenv("paragraph_chunker_max_chunk_size")),
                 paragraph_separator=os.getenv("paragraph_chunker_paragraph_separator")
@@ -193,20 +329,19 @@ class RAGHelper:
                     # Get the subfolder name of this document
                     subfolder = os.path.basename(os.path.dirname(file)).replace(os.getenv("data_directory"), "")
                     if not(file_type == "csv"):
-                        # Chunk the document
-                        chunks = self.splitter.split_text(doc)
+                        # Chunk and embed the document
+                        (chunks, embeddings, offsets) = self._chunk_and_embed(doc)
                     else:
                         chunks = doc
+                        embeddings = self._embed_chunks(chunks)
+                        offsets = [None] * len(chunks)
                     
                     chunks = [{
                         "id": hashlib.md5(chunk.encode()).hexdigest(),
-                        "embedding": self.embeddings.encode(chunk),
+                        "embedding": embedding,
                         "content": chunk,
-                        "metadata": json.dumps({
-                            "source": file,
-                            "dataset": subfolder
-                        })
-                    } for chunk in chunks]
+                        "metadata": self._chunk_metadata(file, subfolder, offset)
+                    } for (chunk, embedding, offset) in zip(chunks, embeddings, offsets)]
 
                     # Insert the chunks into the vector store
                     documents.extend(chunks)
@@ -247,19 +382,18 @@ class RAGHelper:
                     full_text.append("\n".join(slide_text))
                 doc = "\n\n".join(full_text)
             else:
-                doc = self.converter.convert(file_path).document.export_to_text()
+                with limit("conversion"):
+                    doc = self.converter.convert(file_path).document.export_to_text()
             
-            # Chunk the document
-            chunks = self.splitter.split_text(doc)
+            # Chunk and embed the document (the semantic chunker embeds while chunking)
+            with limit("embedding"):
+                (chunks, embeddings, offsets) = self._chunk_and_embed(doc)
             chunks = [{
                 "id": hashlib.md5(chunk.encode()).hexdigest(),
-                "embedding": self.embeddings.encode(chunk),
+                "embedding": embedding,
                 "content": chunk,
-                "metadata": json.dumps({
-                    "source": file_path,
-                    "dataset": dataset
-                })
-            } for chunk in chunks]
+                "metadata": self._chunk_metadata(file_path, dataset, offset)
+            } for (chunk, embedding, offset) in zip(chunks, embeddings, offsets)]
 
             # Insert the chunks into the vector store
             documents.extend(chunks)
@@ -268,15 +402,59 @@ class RAGHelper:
         documents = self._deduplicate_chunks(documents)
         self.retriever.add_documents(documents)
 
+    def _embed_chunks(self, chunks):
+        """Embed the chunks of a document in batches rather than one at a time."""
+        if len(chunks) == 0:
+            return []
+        return self.embeddings.encode(list(chunks), batch_size=int(os.getenv("embedding_batch_size", "32")))
+
+    def _chunk_and_embed(self, doc):
+        """
+        Split a document into chunks and embed them. The semantic chunker has embedded every
+        sentence to find its breakpoints, so it provides the chunk embeddings itself.
+
+        Returns:
+            (chunks, embeddings, offsets) where offsets holds the (start, end) character
+            offsets of every chunk in doc, or None for splitters that do not track them.
+        """
+        if isinstance(self.splitter, SemanticChunker):
+            (chunks, embeddings) = self.splitter.split_text_with_embeddings(doc)
+            return (chunks, embeddings, [None] * len(chunks))
+        if isinstance(self.splitter, ParagraphChunker):
+            spans = list(self.splitter.iter_chunks(doc))
+            chunks = [span.text for span in spans]
+            return (chunks, self._embed_chunks(chunks), [(span.start, span.end) for span in spans])
+        chunks = self.splitter.split_text(doc)
+        return (chunks, self._embed_chunks(chunks), [None] * len(chunks))
+
+    def _chunk_metadata(self, source, dataset, offset):
+        """The metadata JSON of a chunk, with its character offsets in the document if known."""
+        metadata = {"source": source, "dataset": dataset}
+        if offset is not None:
+            (metadata["start"], metadata["end"]) = offset
+        return json.dumps(metadata)
+
     def _deduplicate_chunks(self, documents):
         return list({doc['id']: doc for doc in documents}.values())
 
     ##################
     ### Chat functions
     ##################
+    def format_document(self, doc):
+        """
+        Formats a single document as it appears in the prompt. Retrieval bookkeeping
+        (distance, sources, chunk offsets) is left out as it is of no use to the model.
+        """
+        metadata_string = ", ".join(
+            [f"{md}: {doc['metadata'][md]}" for md in doc['metadata'].keys() if md not in ["distance", "sources", "start", "end"]]
+        )
+        filename = doc['metadata']['source']
+        return f"[Document] *Filename* `{filename}`\n*Content*: {doc['content']}\n*Metadata* {metadata_string} [/Document]"
+
     def format_documents(self, docs):
         """
-        Formats the documents for better readability.
+        Formats the documents for better readability. With context packing enabled, the
+        documents are first packed into the token budget of the current model.
 
         Args:
             docs (list): List of Document objects.
@@ -284,154 +462,451 @@ class RAGHelper:
         Returns:
             str: Formatted string representation of documents.
         """
-        doc_strings = []
-        for i, doc in enumerate(docs):
-            metadata_string = ", ".join(
-                [f"{md}: {doc['metadata'][md]}" for md in doc['metadata'].keys()]
+        if self.context_packer is not None:
+            (docs, stats) = self.context_packer.pack(docs, self.llm.model_name)
+            self.logger.info(
+                f"Packed {stats['packed_documents']} documents ({stats['packed_tokens']} of {stats['budget']} tokens), "
+                f"truncated {stats['truncated_documents']}, deduplicated {stats['deduplicated_documents']}, "
+                f"dropped {stats['dropped_documents']} ({stats['dropped_tokens']} tokens left out)."
             )
-            filename = doc['metadata']['source']
-            doc_strings.append(
-                f"[Document] *Filename* `{filename}`\n*Content*: {doc['content']}\n*Metadata* {metadata_string} [/Document]"
-            )
-        return "\n\n".join(doc_strings)
+        return "\n\n".join([self.format_document(doc) for doc in docs])
 
-    def handle_documents(self, prompt, prompt_embedding, datasets, step_callback=None):
+    def handle_documents(self, prompt, prompt_embedding, datasets, step_callback=None, rerank=None):
+        """Fetch the relevant documents and rerank them, if rerank (by default the rerank setting) is on."""
+        settings = get_settings()
         # Reobtain documents with new question
         documents = self.retriever.get_relevant_documents(prompt, prompt_embedding, datasets)
 
         # Check if we need to apply the reranker and run it
-        if os.getenv("rerank") == "True":
+        if settings.rerank if rerank is None else rerank:
             if step_callback:
-                step_callback(f"Reranking top {os.getenv('rerank_k')} documents...")
+                step_callback(f"Reranking top {settings.rerank_k} documents...")
             self.logger.info("Reranking documents.")
-            documents = self.reranker.rerank_documents(documents, prompt)[:int(os.getenv("rerank_k"))]
+            if settings.rerank_cascade:
+                with stage("rerank"):
+                    (documents, stats) = self.reranker.cascade_rerank_documents(documents, prompt, settings.rerank_k)
+                self.logger.info(
+                    f"Cascaded rerank: {stats['candidates']} candidates, {stats['survivors']} survived the "
+                    f"{stats['first_stage']} stage (k={stats['cascade_k']}, threshold={stats['threshold']}) in "
+                    f"{stats['first_stage_ms']:.1f} ms, second stage took {stats['second_stage_ms']:.1f} ms"
+                    f"{' (early exit)' if stats['early_exit'] else ''}."
+                )
+            else:
+                with stage("rerank"):
+                    documents = self.reranker.rerank_documents(documents, prompt)[:settings.rerank_k]
         else:
-            documents = [{**document, "score": document['metadata']['distance']} for document in documents]
+            documents = [{**document, "score": document['metadata']['distance'], "score_source": "retrieval"} for document in documents]
         
         return documents
 
+    def encode_query(self, prompt):
+        """Embed a query, batched with concurrent requests if micro-batching is enabled."""
+        with stage("embedding"):
+            if self.embedding_batcher is not None:
+                # The batcher is admitted once per batch, so concurrent queries can share it
+                return self.embedding_batcher.encode(prompt)
+            with limit("embedding"):
+                return self.embeddings.encode(prompt)
+
+    def retrieve(self, prompt, datasets, step_callback=None, prompt_embedding=None):
+        """
+        Embed the prompt (unless its embedding is given) and fetch (and possibly rerank) the relevant documents.
+
+        Returns:
+            (prompt_embedding, documents)
+        """
+        if prompt_embedding is None:
+            prompt_embedding = self.encode_query(prompt)
+        documents = self.handle_documents(prompt, prompt_embedding, datasets, step_callback=step_callback)
+        return (prompt_embedding, documents)
+
+    def retrieve_batch(self, queries, datasets=None, rerank=None, top_k=None):
+        """
+        Retrieve (and optionally rerank) the documents for many queries without calling the LLM.
+        The queries are embedded in batches of retrieve_batch_chunk_size, each batch is
+        retrieved by retrieve_batch_workers threads in parallel while the next one is embedded.
+
+        Args:
+            queries (list): Query strings, or dicts with a query and optionally its own datasets.
+            datasets (list): Datasets to search for queries that do not specify their own.
+            rerank (bool): Whether to rerank, by default the rerank setting.
+            top_k (int): Number of documents to return per query, by default all of them.
+
+        Yields:
+            {"index", "query", "documents"} per query, in the order given, or
+            {"index", "query", "error"} for a query that failed.
+        """
+        settings = get_settings()
+        chunk_size = settings.retrieve_batch_chunk_size
+        items = []
+        for (index, query) in enumerate(queries):
+            if isinstance(query, dict):
+                items.append((index, query.get("query", ""), query.get("datasets", datasets or [])))
+            else:
+                items.append((index, query, datasets or []))
+
+        with ThreadPoolExecutor(
+            max_workers=settings.retrieve_batch_workers,
+            thread_name_prefix="retrieve-batch"
+        ) as pool:
+            pending = []
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start + chunk_size]
+                with limit("embedding"):
+                    embeddings = self.embeddings.encode([query for (_, query, _) in chunk], batch_size=len(chunk))
+                submitted = [
+                    pool.submit(contextvars.copy_context().run, self._retrieve_batch_query, index, query, embedding, query_datasets, rerank, top_k)
+                    for ((index, query, query_datasets), embedding) in zip(chunk, embeddings)
+                ]
+                # Hand out the previous batch while this one is retrieved
+                for future in pending:
+                    yield future.result()
+                pending = submitted
+            for future in pending:
+                yield future.result()
+
+    def _retrieve_batch_query(self, index, query, embedding, datasets, rerank, top_k):
+        try:
+            documents = self.handle_documents(query, embedding, datasets, rerank=rerank)
+        except Exception as e:
+            self.logger.warning(f"Batch retrieval failed for query {index}: {e}")
+            return {"index": index, "query": query, "error": str(e)}
+        if top_k is not None:
+            documents = documents[:top_k]
+        return {"index": index, "query": query, "documents": documents}
+
+    def start_speculative_retrieval(self, prompt, datasets, step_callback=None):
+        """
+        Start retrieval in the background while the fetch-new-documents decision is pending.
+        Returns None when speculation is disabled or not applicable: with HyDE the retrieval
+        query depends on another LLM call, so there is nothing to speculate on.
+        """
+        settings = get_settings()
+        if not settings.use_speculative_retrieval or settings.use_hyde:
+            return None
+
+        def timed_retrieve():
+            start = time.perf_counter()
+            result = self.retrieve(prompt, datasets, step_callback=step_callback)
+            return (result, time.perf_counter() - start)
+
+        self.logger.info("Speculatively fetching new documents while deciding whether to fetch.")
+        return self.executor.submit(contextvars.copy_context().run, timed_retrieve)
+
+    def resolve_speculative_retrieval(self, speculation, fetch_new_documents, decision_seconds):
+        """
+        Use or discard a speculative retrieval depending on the fetch decision.
+
+        Returns:
+            (prompt_embedding, documents) if the speculation was used, None otherwise.
+        """
+        if speculation is None:
+            return None
+
+        if not fetch_new_documents:
+            # Nobody waits for a discarded speculation, just drop it
+            speculation.cancel()
+            SPECULATIVE_RETRIEVALS.labels(outcome="discarded").inc()
+            self.logger.info("Discarding speculative retrieval, no new documents needed.")
+            return None
+
+        (result, retrieval_seconds) = speculation.result()
+        # The retrieval overlapped with the decision call for at most the duration of either
+        saved_seconds = min(decision_seconds, retrieval_seconds)
+        SPECULATIVE_RETRIEVALS.labels(outcome="used").inc()
+        SPECULATIVE_SAVED_SECONDS.observe(saved_seconds)
+        self.logger.info(f"Using speculative retrieval, saved {saved_seconds * 1000:.1f} ms.")
+        return result
+
+    def previous_question(self, history):
+        """The last user question in the history, stripped of the question template and RE2 repetition."""
+        settings = get_settings()
+        questions = [message["content"] for message in history if message["role"] == "user"]
+        if len(questions) == 0:
+            return None
+        question = questions[-1]
+        for template in [settings.get("rag_question_followup"), settings.get("rag_question_initial")]:
+            if template and "{question}" in template:
+                (prefix, suffix) = template.split("{question}", 1)
+                if question.startswith(prefix) and question.endswith(suffix):
+                    question = question[len(prefix):len(question) - len(suffix)]
+                    break
+        if settings.use_re2:
+            question = question.split(f"\n{settings.re2_prompt}\n")[0]
+        return question
+
+    def _llm_decision(self, system_prompt, question, history, call_type):
+        """Ask the LLM a yes/no question, returns ("yes" | "no", full response)."""
+        (response, _) = self.llm.generate_response(system_prompt, question, history, call_type=call_type)
+        return ("no" if response.lower().strip().startswith("no") else "yes", response)
+
+    def _audit_local_decision(self, decision, similarity, local, system_prompt, question, history, call_type):
+        try:
+            (llm, _) = self._llm_decision(system_prompt, question, history, call_type)
+        except Exception as e:
+            self.logger.warning(f"Error while auditing local {decision} decision: {e}")
+            llm = None
+        self.local_decider.record(decision, similarity, local, llm)
+
+    def _decide(self, decision, local, similarity, system_prompt, question, history, call_type):
+        """
+        Use the local decision if there is one, auditing a sample of them against the LLM in the
+        background, and ask the LLM otherwise. Returns ("yes" | "no", motivation).
+        """
+        if local is not None:
+            if self.local_decider.should_audit():
+                self.executor.submit(
+                    self._audit_local_decision, decision, similarity, local, system_prompt, question, history, call_type
+                )
+            else:
+                self.local_decider.record(decision, similarity, local, None)
+            return (local, f"{local} (embedding similarity {similarity:.2f})")
+
+        (llm, response) = self._llm_decision(system_prompt, question, history, call_type)
+        if self.local_decider is not None:
+            self.local_decider.record(decision, similarity, None, llm)
+        return (llm, response)
+
+    def decide_fetch_new_documents(self, prompt, history, docs=None):
+        """
+        Decide whether a follow-up question needs new documents. With local decisions enabled the
+        prompt is compared with the previous question and documents first, the LLM is only asked
+        when the similarity is in the uncertain band.
+
+        Returns:
+            (fetch_new_documents, prompt_embedding) where prompt_embedding is None if the prompt was not embedded.
+        """
+        settings = get_settings()
+        local = None
+        similarity = None
+        prompt_embedding = None
+        with stage("fetch_decision"):
+            if self.local_decider is not None:
+                prompt_embedding = self.encode_query(prompt)
+                (local, similarity) = self.local_decider.fetch_decision(prompt_embedding, self.previous_question(history), docs)
+
+            (decision, _) = self._decide(
+                "fetch",
+                local,
+                similarity,
+                None,
+                settings.get("rag_fetch_new_question").format(question=prompt),
+                history,
+                "fetch_decision"
+            )
+        return (decision == "yes", prompt_embedding)
+
+    def documents_contain_answer(self, prompt, prompt_embedding, documents):
+        """
+        Decide whether the retrieved documents contain the answer to the prompt, locally from
+        embedding similarity when confident and with the LLM otherwise.
+
+        Returns:
+            (contains_answer, motivation)
+        """
+        settings = get_settings()
+        local = None
+        similarity = None
+        with stage("rewrite"):
+            if self.local_decider is not None:
+                (local, similarity) = self.local_decider.rewrite_decision(prompt_embedding, documents)
+
+            (decision, motivation) = self._decide(
+                "rewrite",
+                local,
+                similarity,
+                settings.get("rewrite_query_instruction").format(context=self.format_documents(documents)),
+                settings.get("rewrite_query_question").format(question=prompt),
+                [],
+                "rewrite_judge"
+            )
+        return (decision == "yes", motivation)
+
+    def summarize_history_in_background(self, history):
+        """Prepare the summary for the next turn in the background, if configured."""
+        settings = get_settings()
+        if settings.use_summarization and settings.summarization_background:
+            self.summarizer.summarize_in_background(
+                history, self.llm, self.executor, settings.summarization_threshold
+            )
+
     def compute_provenance_scores(self, prompt, documents, response):
+        settings = get_settings()
         # Compute the provenance score
         provenance_scores = None
-        if os.getenv("provenance_method") in ["rerank", "llm", "similarity"]:
-            if os.getenv("provenance_method") == "rerank":
-                provenance_scores = compute_rerank_provenance(self.reranker, prompt, documents, response)
-            elif os.getenv("provenance_method") == "llm":
-                provenance_scores = compute_llm_provenance(self.llm, prompt, documents, response)
-            elif os.getenv("provenance_method") == "similarity":
-                provenance_scores = self.similarity_attribution.compute_similarity(prompt, documents, response)
+        if settings.provenance_method in ["rerank", "llm", "similarity"]:
+            with stage("provenance"):
+                if settings.provenance_method == "rerank":
+                    provenance_scores = compute_rerank_provenance(self.reranker, prompt, documents, response)
+                elif settings.provenance_method == "llm":
+                    provenance_scores = compute_llm_provenance(self.llm, prompt, documents, response)
+                elif settings.provenance_method == "similarity":
+                    provenance_scores = self.similarity_attribution.compute_similarity(prompt, documents, response)
 
         return provenance_scores
 
-    def handle_user_interaction(self, prompt, history, datasets):
+    def fetch_documents(self, prompt, datasets, prompt_embedding=None, speculative_result=None):
+        """
+        The retrieval part of a turn: HyDE, retrieval (unless a speculative retrieval already
+        fetched the documents) and the rewrite loop, as configured.
+
+        Returns:
+            (prompt, prompt_embedding, documents, rewritten) where prompt is the HyDE answer
+            with HyDE enabled and rewritten the rewritten query, if the query was rewritten.
+        """
+        steps = self.fetch_documents_stream(prompt, datasets, prompt_embedding, speculative_result)
+        while True:
+            (finished, event) = _next_event(steps)
+            if finished:
+                return event
+
+    def fetch_documents_stream(self, prompt, datasets, prompt_embedding=None, speculative_result=None, speculative_steps=()):
+        """
+        fetch_documents, yielding ("step", text) events for the streaming endpoints as it goes.
+        speculative_steps are the steps of the speculative retrieval, shown if it is used.
+
+        Returns:
+            The same (prompt, prompt_embedding, documents, rewritten) as fetch_documents.
         """
-        Handle user interaction with the RAG system.
+        settings = get_settings()
+        rewritten = None
+        pending_steps = []  # steps from sub-calls that cannot yield directly
+        # Apply hyde if needed
+        if settings.use_hyde:
+            yield ("step", "Generating hypothetical document (HyDE)...")
+            with stage("hyde"):
+                (response, _) = self.llm.generate_response(
+                    None,
+                    settings.get("hyde_query").format(question=prompt),
+                    [],
+                    call_type="hyde"
+                )
+            prompt = response
+            prompt_embedding = None
+
+        yield ("step", "Retrieving relevant documents...")
+        if speculative_result is not None:
+            (prompt_embedding, documents) = speculative_result
+            pending_steps.extend(speculative_steps)
+        else:
+            self.logger.info("Fetching new documents.")
+            (prompt_embedding, documents) = self.retrieve(
+                prompt, datasets, step_callback=pending_steps.append, prompt_embedding=prompt_embedding
+            )
+        for step in pending_steps:
+            yield ("step", step)
+        pending_steps.clear()
+
+        # Check if the answer is in the documents or not
+        if settings.use_rewrite_loop and not settings.use_hyde:
+            yield ("step", "Checking if documents contain the answer...")
+            self.logger.info("Rewrite is enabled - checking if the fetched documents contain the answer.")
+            (contains_answer, response) = self.documents_contain_answer(prompt, prompt_embedding, documents)
+            if not contains_answer:
+                # Rewrite the query
+                yield ("step", "Rewriting query for better results...")
+                self.logger.info("Rewrite is enabled and the answer is not in the documents - rewriting the query.")
+                with stage("rewrite"):
+                    (new_prompt, _) = self.llm.generate_response(
+                        None,
+                        settings.get("rewrite_query_prompt").format(question=prompt, motivation=f"Can I find the answer in the documents: {response}"),
+                        [],
+                        call_type="rewrite"
+                    )
+                self.logger.info(f"Rewrite complete, original query: {prompt}, rewritten query: {new_prompt}")
+                rewritten = new_prompt
+                # Reobtain documents with new question
+                yield ("step", "Re-retrieving documents with improved query...")
+                documents = self.handle_documents(new_prompt, prompt_embedding, datasets, step_callback=pending_steps.append)
+                for step in pending_steps:
+                    yield ("step", step)
+                pending_steps.clear()
+            else:
+                yield ("step", "Documents look relevant, proceeding...")
+                self.logger.info("Rewrite is enabled but the query is adequate.")
+        else:
+            self.logger.info("Rewrite is disabled - using the original query.")
+
+        return (prompt, prompt_embedding, documents, rewritten)
+
+    def handle_user_interaction(self, prompt, history, datasets, docs=None):
+        """
+        Handle user interaction with the RAG system. docs are the documents of the previous turn, if any.
         """
+        settings = snapshot()
+        trace = start_trace(self.llm.backend)
         rewritten = None
+        prompt_embedding = None
         # Check if we need to fetch new documents
         fetch_new_documents = True
+        speculative_result = None
         if len(history) > 0:
             # Summarize the history if needed
-            if os.getenv("use_summarization") == "True":
-                # Convert the history to a string
+            if settings.use_summarization:
                 self.logger.info("Checking if we need to summarize the history.")
-                history_string = "\n\n".join([f"{message['role']}: {message['content']}" for message in history])
-                history_size = len(self.tiktoken_encoder.encode(history_string))
-                if history_size > int(os.getenv("summarization_threshold")):
+                with stage("summarization"):
+                    (history, history_size) = self.summarizer.prepare(history)
+                if history_size > settings.summarization_threshold:
                     self.logger.info(f"Summarizing the history because it contains {history_size} tokens.")
-                    (response, _) = self.llm.generate_response(
-                        None,
-                        os.getenv("summarization_query").format(history=history_string),
-                        []
-                    )
-                    history = history[:1] + [{"role": "assistant", "content": response}]
+                    with stage("summarization"):
+                        history = self.summarizer.summarize(history, self.llm)
             
             # Get the LLM response to see if we need to fetch new documents
             self.logger.info("History is not empty, checking if we need to fetch new documents.")
-            (response, _) = self.llm.generate_response(
-                None,
-                os.getenv("rag_fetch_new_question").format(question=prompt),
-                history
+            speculation = self.start_speculative_retrieval(prompt, datasets)
+            decision_start = time.perf_counter()
+            (fetch_new_documents, prompt_embedding) = self.decide_fetch_new_documents(prompt, history, docs)
+            speculative_result = self.resolve_speculative_retrieval(
+                speculation, fetch_new_documents, time.perf_counter() - decision_start
             )
-            if response.lower().strip().startswith("no"):
-                fetch_new_documents = False
         
         # Fetch new documents if needed
         documents = None
         if fetch_new_documents:
-            # Apply hyde if needed
-            if os.getenv("use_hyde") == "True":
-                (response, _) = self.llm.generate_response(
-                    None,
-                    os.getenv("hyde_query").format(question=prompt),
-                    []
-                )
-                prompt = response
-
-            self.logger.info("Fetching new documents.")
-            prompt_embedding = self.embeddings.encode(prompt)
-            documents = self.handle_documents(prompt, prompt_embedding, datasets)
-
-            # Check if the answer is in the documents or not
-            if os.getenv("use_rewrite_loop") == "True" and not os.getenv("use_hyde") == "True":
-                self.logger.info("Rewrite is enabled - checking if the fetched documents contain the answer.")
-                (response, _) = self.llm.generate_response(
-                    os.getenv("rewrite_query_instruction").format(context=self.format_documents(documents)),
-                    os.getenv("rewrite_query_question").format(question=prompt),
-                    []
-                )
-                if response.lower().strip().startswith("no"):
-                    # Rewrite the query
-                    self.logger.info("Rewrite is enabled and the answer is not in the documents - rewriting the query.")
-                    (new_prompt, _) = self.llm.generate_response(
-                        None,
-                        os.getenv("rewrite_query_prompt").format(question=prompt, motivation=f"Can I find the answer in the documents: {response}"),
-                        []
-                    )
-                    self.logger.info(f"Rewrite complete, original query: {prompt}, rewritten query: {new_prompt}")
-                    rewritten = new_prompt
-                    # Reobtain documents with new question
-                    documents = self.handle_documents(new_prompt, prompt_embedding, datasets)
-                else:
-                    self.logger.info("Rewrite is enabled but the query is adequate.")
-            else:
-                self.logger.info("Rewrite is disabled - using the original query.")
+            (prompt, prompt_embedding, documents, rewritten) = self.fetch_documents(
+                prompt, datasets, prompt_embedding=prompt_embedding, speculative_result=speculative_result
+            )
         
         # Apply RE2 if turend on (but not in conjunction with hyde)
-        if os.getenv("use_re2") == "True" and not os.getenv("use_hyde") == "True":
-            prompt = f"{prompt}\n{os.getenv('re2_prompt')}\n{prompt}"
+        if settings.use_re2 and not settings.use_hyde:
+            prompt = f"{prompt}\n{settings.re2_prompt}\n{prompt}"
         
         provenance_scores = None
 
         # Get the LLM response
-        if len(history) == 0:
-            (response, new_history) = self.llm.generate_response(
-                os.getenv("rag_instruction").format(context=self.format_documents(documents)),
-                os.getenv("rag_question_initial").format(question=prompt),
-                []
-            )
-            provenance_scores = self.compute_provenance_scores(prompt, documents, response)
-        elif fetch_new_documents:
-            # Add the documents to the system prompt and remove the previous system prompt
-            (response, new_history) = self.llm.generate_response(
-                os.getenv("rag_instruction").format(context=self.format_documents(documents)),
-                os.getenv("rag_question_followup").format(question=prompt),
-                [message for message in history if message["role"] != "system"]
-            )
+        with stage("generation"):
+            if len(history) == 0:
+                (response, new_history) = self.llm.generate_response(
+                    settings.get("rag_instruction").format(context=self.format_documents(documents)),
+                    settings.get("rag_question_initial").format(question=prompt),
+                    []
+                )
+            elif fetch_new_documents:
+                # Add the documents to the system prompt and remove the previous system prompt
+                (response, new_history) = self.llm.generate_response(
+                    settings.get("rag_instruction").format(context=self.format_documents(documents)),
+                    settings.get("rag_question_followup").format(question=prompt),
+                    [message for message in history if message["role"] != "system"]
+                )
+            else:
+                # Keep the full history, with system prompt and previous documents
+                (response, new_history) = self.llm.generate_response(
+                    None,
+                    settings.get("rag_question_followup").format(question=prompt),
+                    history
+                )
+
+        # Provenance only applies to freshly fetched documents
+        if fetch_new_documents:
             provenance_scores = self.compute_provenance_scores(prompt, documents, response)
-        else:
-            # Keep the full history, with system prompt and previous documents
-            (response, new_history) = self.llm.generate_response(
-                None,
-                os.getenv("rag_question_followup").format(question=prompt),
-                history
-            )
         
         # Add the response to the history
         new_history.append({"role": "assistant", "content": response})
+        self.summarize_history_in_background(new_history)
+        self.logger.info(f"Request timings: {trace.to_dict()}")
         return (response, documents, fetch_new_documents, rewritten, new_history, provenance_scores)
 
-    def handle_user_interaction_stream(self, prompt, history, datasets):
+    def handle_user_interaction_stream(self, prompt, history, datasets, docs=None):
         """
         Streaming version of handle_user_interaction.
         Yields SSE-formatted events for each pipeline step and then streams the LLM response tokens.
@@ -440,145 +915,163 @@ class RAGHelper:
           - ("token", text)       : LLM response chunk
           - ("done", metadata)    : final metadata dict with history, documents, etc.
         """
-        import json as _json
+        state = yield from self.prepare_interaction_stream(prompt, history, datasets, docs)
+
+        # Stream the LLM response
+        (stream, new_history) = self.llm.generate_response_stream(*state["answer_args"])
+        full_response_chunks = []
+        for chunk in state["trace"].timed_stream(stream):
+            full_response_chunks.append(chunk)
+            yield ("token", chunk)
+
+        yield from self.finish_interaction_stream(state, "".join(full_response_chunks), new_history)
+
+    async def ahandle_user_interaction_stream(self, prompt, history, datasets, docs=None, executor=None):
+        """
+        Async version of handle_user_interaction_stream, yielding the same events. The pipeline
+        stages before and after the answer (embedding, retrieval, rerank, provenance, ...) run in
+        the given executor. The answer is streamed without holding a thread when the LLM helper
+        has a native async API (use_async_llm), otherwise it is read chunk by chunk in the executor.
+        """
+        loop = asyncio.get_running_loop()
+        # All stages run in one context so they report to the same trace
+        context = contextvars.copy_context()
 
+        preparation = self.prepare_interaction_stream(prompt, history, datasets, docs)
+        while True:
+            (finished, event) = await loop.run_in_executor(executor, context.run, _next_event, preparation)
+            if finished:
+                state = event
+                break
+            yield event
+
+        if hasattr(self.llm, "agenerate_response_stream"):
+            (stream, new_history) = self.llm.agenerate_response_stream(*state["answer_args"])
+            stream = iterate_async(stream)
+        else:
+            (stream, new_history) = await loop.run_in_executor(
+                executor, context.run, self.llm.generate_response_stream, *state["answer_args"]
+            )
+            stream = _iterate_in_executor(stream, executor, context)
+
+        full_response_chunks = []
+        async for chunk in state["trace"].atimed_stream(stream):
+            full_response_chunks.append(chunk)
+            yield ("token", chunk)
+
+        finishing = self.finish_interaction_stream(state, "".join(full_response_chunks), new_history)
+        async for event in _iterate_in_executor(finishing, executor, context):
+            yield event
+
+    def prepare_interaction_stream(self, prompt, history, datasets, docs=None):
+        """
+        Run the pipeline up to the answer, yielding its step and documents events.
+
+        Returns:
+            The state needed to generate and finish the answer, with the arguments for the
+            answer's generate_response_stream call in answer_args.
+        """
+        settings = snapshot()
+        trace = start_trace(self.llm.backend)
         rewritten = None
+        prompt_embedding = None
         fetch_new_documents = True
+        speculative_result = None
+        speculative_steps = []  # steps from a speculative retrieval, only shown if it is used
 
         # Summarization check
         if len(history) > 0:
-            if os.getenv("use_summarization") == "True":
+            if settings.use_summarization:
                 yield ("step", "Checking if history needs summarization...")
-                history_string = "\n\n".join([f"{message['role']}: {message['content']}" for message in history])
-                history_size = len(self.tiktoken_encoder.encode(history_string))
-                if history_size > int(os.getenv("summarization_threshold")):
+                with stage("summarization"):
+                    (history, history_size) = self.summarizer.prepare(history)
+                if history_size > settings.summarization_threshold:
                     yield ("step", "Summarizing conversation history...")
                     self.logger.info(f"Summarizing the history because it contains {history_size} tokens.")
-                    (response, _) = self.llm.generate_response(
-                        None,
-                        os.getenv("summarization_query").format(history=history_string),
-                        []
-                    )
-                    history = history[:1] + [{"role": "assistant", "content": response}]
+                    with stage("summarization"):
+                        history = self.summarizer.summarize(history, self.llm)
 
             # Check if we need to fetch new documents
             yield ("step", "Checking if new documents are needed...")
             self.logger.info("History is not empty, checking if we need to fetch new documents.")
-            (response, _) = self.llm.generate_response(
-                None,
-                os.getenv("rag_fetch_new_question").format(question=prompt),
-                history
-            )
-            if response.lower().strip().startswith("no"):
-                fetch_new_documents = False
+            speculation = self.start_speculative_retrieval(prompt, datasets, step_callback=lambda s: speculative_steps.append(s))
+            decision_start = time.perf_counter()
+            (fetch_new_documents, prompt_embedding) = self.decide_fetch_new_documents(prompt, history, docs)
+            if not fetch_new_documents:
                 yield ("step", "Using existing context (no new retrieval needed).")
+            speculative_result = self.resolve_speculative_retrieval(
+                speculation, fetch_new_documents, time.perf_counter() - decision_start
+            )
 
         # Fetch new documents if needed
         documents = None
-        pending_steps = []  # collect steps from sub-calls that can't yield directly
         if fetch_new_documents:
-            # HyDE
-            if os.getenv("use_hyde") == "True":
-                yield ("step", "Generating hypothetical document (HyDE)...")
-                (response, _) = self.llm.generate_response(
-                    None,
-                    os.getenv("hyde_query").format(question=prompt),
-                    []
-                )
-                prompt = response
-
-            yield ("step", "Retrieving relevant documents...")
-            self.logger.info("Fetching new documents.")
-            prompt_embedding = self.embeddings.encode(prompt)
-            documents = self.handle_documents(prompt, prompt_embedding, datasets, step_callback=lambda s: pending_steps.append(s))
-            for s in pending_steps:
-                yield ("step", s)
-            pending_steps.clear()
-
-            # Rewrite loop
-            if os.getenv("use_rewrite_loop") == "True" and not os.getenv("use_hyde") == "True":
-                yield ("step", "Checking if documents contain the answer...")
-                self.logger.info("Rewrite is enabled - checking if the fetched documents contain the answer.")
-                (response, _) = self.llm.generate_response(
-                    os.getenv("rewrite_query_instruction").format(context=self.format_documents(documents)),
-                    os.getenv("rewrite_query_question").format(question=prompt),
-                    []
-                )
-                if response.lower().strip().startswith("no"):
-                    yield ("step", "Rewriting query for better results...")
-                    self.logger.info("Rewrite is enabled and the answer is not in the documents - rewriting the query.")
-                    (new_prompt, _) = self.llm.generate_response(
-                        None,
-                        os.getenv("rewrite_query_prompt").format(question=prompt, motivation=f"Can I find the answer in the documents: {response}"),
-                        []
-                    )
-                    self.logger.info(f"Rewrite complete, original query: {prompt}, rewritten query: {new_prompt}")
-                    rewritten = new_prompt
-                    yield ("step", "Re-retrieving documents with improved query...")
-                    documents = self.handle_documents(new_prompt, prompt_embedding, datasets, step_callback=lambda s: pending_steps.append(s))
-                    for s in pending_steps:
-                        yield ("step", s)
-                    pending_steps.clear()
-                else:
-                    yield ("step", "Documents look relevant, proceeding...")
-                    self.logger.info("Rewrite is enabled but the query is adequate.")
-            else:
-                self.logger.info("Rewrite is disabled - using the original query.")
+            (prompt, prompt_embedding, documents, rewritten) = yield from self.fetch_documents_stream(
+                prompt, datasets, prompt_embedding=prompt_embedding,
+                speculative_result=speculative_result, speculative_steps=speculative_steps
+            )
 
         # RE2
-        if os.getenv("use_re2") == "True" and not os.getenv("use_hyde") == "True":
+        if settings.use_re2 and not settings.use_hyde:
             yield ("step", "Applying RE2 (Re-reading) prompt enhancement...")
-            prompt = f"{prompt}\n{os.getenv('re2_prompt')}\n{prompt}"
+            prompt = f"{prompt}\n{settings.re2_prompt}\n{prompt}"
 
         # Send documents to the client before LLM generation
         if documents:
             yield ("documents", documents)
 
-        # Stream the LLM response
         yield ("step", "Generating answer...")
-        full_response_chunks = []
-
         if len(history) == 0:
-            (stream, new_history) = self.llm.generate_response_stream(
-                os.getenv("rag_instruction").format(context=self.format_documents(documents)),
-                os.getenv("rag_question_initial").format(question=prompt),
+            answer_args = (
+                settings.get("rag_instruction").format(context=self.format_documents(documents)),
+                settings.get("rag_question_initial").format(question=prompt),
                 []
             )
         elif fetch_new_documents:
-            (stream, new_history) = self.llm.generate_response_stream(
-                os.getenv("rag_instruction").format(context=self.format_documents(documents)),
-                os.getenv("rag_question_followup").format(question=prompt),
+            answer_args = (
+                settings.get("rag_instruction").format(context=self.format_documents(documents)),
+                settings.get("rag_question_followup").format(question=prompt),
                 [message for message in history if message["role"] != "system"]
             )
         else:
-            (stream, new_history) = self.llm.generate_response_stream(
+            answer_args = (
                 None,
-                os.getenv("rag_question_followup").format(question=prompt),
+                settings.get("rag_question_followup").format(question=prompt),
                 history
             )
 
-        for chunk in stream:
-            full_response_chunks.append(chunk)
-            yield ("token", chunk)
+        return {
+            "trace": trace,
+            "prompt": prompt,
+            "documents": documents,
+            "rewritten": rewritten,
+            "fetch_new_documents": fetch_new_documents,
+            "answer_args": answer_args,
+        }
 
-        response = "".join(full_response_chunks)
+    def finish_interaction_stream(self, state, response, new_history):
+        """Compute provenance for the streamed answer, update the history and yield the done event."""
+        settings = get_settings()
+        documents = state["documents"]
 
         # Compute provenance
         provenance_scores = None
-        provenance_method = os.getenv("provenance_method", "none")
-        if fetch_new_documents and documents and provenance_method in ["rerank", "llm", "similarity"]:
+        provenance_method = settings.provenance_method
+        if state["fetch_new_documents"] and documents and provenance_method in ["rerank", "llm", "similarity"]:
             yield ("step", f"Computing provenance scores ({provenance_method})...")
-            provenance_scores = self.compute_provenance_scores(prompt, documents, response)
+            provenance_scores = self.compute_provenance_scores(state["prompt"], documents, response)
 
         # Add the response to the history
         new_history.append({"role": "assistant", "content": response})
+        self.summarize_history_in_background(new_history)
 
         # Yield final metadata
         yield ("done", {
             "reply": response,
             "history": new_history,
             "documents": documents,
-            "rewritten": rewritten,
-            "fetched_new_documents": fetch_new_documents,
+            "rewritten": state["rewritten"],
+            "fetched_new_documents": state["fetch_new_documents"],
             "provenance_scores": provenance_scores,
+            "timings": state["trace"].to_dict(),
         })
@@ -1,29 +1,62 @@
 from flashrank import Ranker, RerankRequest
 import os
+import threading
+import time
+
+from metrics import RERANK_STAGE_SECONDS, RERANK_DOCUMENTS, RERANK_EARLY_EXITS
+from settings import get_settings
+from admission import limit
+
 class Reranker:
     def __init__(self):
         self.reranker = Ranker(os.getenv("rerank_model"), cache_dir="flashrank")
 
+        # Optional cheap first stage for cascaded reranking. "score" reuses the
+        # retrieval score, anything else is loaded as a (small) flashrank model,
+        # up front when the cascade is on and otherwise once it is switched on.
+        self.first_stage = None
+        self.first_stage_model = "score"
+        self._first_stage_lock = threading.Lock()
+        if os.getenv("rerank_cascade") == "True":
+            self._first_stage(os.getenv("rerank_cascade_model", "score"))
+
+    def _first_stage(self, model):
+        """The flashrank model of the first stage, or None when it reuses the retrieval score."""
+        if model == "score":
+            return None
+        with self._first_stage_lock:
+            if self.first_stage is None or self.first_stage_model != model:
+                self.first_stage = Ranker(model, cache_dir="flashrank")
+                self.first_stage_model = model
+            return self.first_stage
+
     def rerank_documents(self, documents, prompt):
+        documents = self._rerank(self.reranker, documents, prompt)
+        for document in documents:
+            document['score_source'] = "rerank"
+        return documents
+
+    def _rerank(self, ranker, documents, prompt):
         if len(documents) == 0:
             return []
-        
+
         # Create passages in the format expected by Flashrank
         passages = [
             {
-                "id": i,
+                "id": doc.get("id", i),
                 "text": doc["content"],
                 "metadata": doc["metadata"]
             }
             for (i, doc) in enumerate(documents)
         ]
-        
+
         #Create a RerankRequest
         rerank_request = RerankRequest(query=prompt, passages=passages)
-        
+
         # Rerank using Flashrank
-        rerank_results = self.reranker.rerank(rerank_request)
-        
+        with limit("rerank"):
+            rerank_results = ranker.rerank(rerank_request)
+
         # Sort by score (higher is better)
         rerank_results.sort(key=lambda x: x['score'], reverse=True)
         # Rename the text field back to content
@@ -31,5 +64,75 @@ class Reranker:
             result['content'] = result['text']
             result['score'] = float(result['score'])
             del result['text']
-        
+
         return rerank_results
+
+    def cascade_rerank_documents(self, documents, prompt, top_k):
+        """
+        Two-stage reranking. A cheap first stage (the retrieval score or a small
+        flashrank model) prunes the candidates to at most rerank_cascade_k documents
+        scoring at least rerank_cascade_threshold. Only the survivors go through the
+        expensive rerank_model. When no more than top_k documents survive, the second
+        stage cannot change the selection and is skipped altogether (early exit).
+
+        Every document gets a score_source: "rerank" when the score comes from
+        rerank_model, otherwise the first stage ("score" for the retrieval score or
+        the first-stage model) whose scale differs from the cross-encoder's.
+
+        Returns:
+            (documents, stats) where stats holds the thresholds, candidate counts and
+            per-stage latency in milliseconds.
+        """
+        settings = get_settings()
+        first_stage_model = settings.rerank_cascade_model
+        first_stage = self._first_stage(first_stage_model)
+        cascade_k = top_k * 3 if settings.rerank_cascade_k is None else settings.rerank_cascade_k
+        threshold = settings.rerank_cascade_threshold
+
+        stats = {
+            "first_stage": first_stage_model,
+            "cascade_k": cascade_k,
+            "threshold": threshold,
+            "candidates": len(documents),
+            "first_stage_ms": 0.0,
+            "second_stage_ms": 0.0,
+            "early_exit": False,
+        }
+
+        # First stage: cheap scoring and pruning
+        start = time.perf_counter()
+        if first_stage is None:
+            scored = sorted(
+                [{**document, "score": float(document['metadata']['distance'])} for document in documents],
+                key=lambda x: x['score'],
+                reverse=True
+            )
+        else:
+            scored = self._rerank(first_stage, documents, prompt)
+        if threshold is not None:
+            scored = [document for document in scored if document['score'] >= threshold]
+        survivors = scored[:cascade_k]
+        first_stage_time = time.perf_counter() - start
+        stats["first_stage_ms"] = first_stage_time * 1000
+        stats["survivors"] = len(survivors)
+        RERANK_STAGE_SECONDS.labels(stage="first").observe(first_stage_time)
+        RERANK_DOCUMENTS.labels(stage="first").inc(len(documents))
+
+        # Early exit: the expensive model can only reorder what we already selected
+        if len(survivors) <= top_k:
+            stats["early_exit"] = True
+            RERANK_EARLY_EXITS.inc()
+            return ([{**document, "score_source": first_stage_model} for document in survivors], stats)
+
+        # Second stage: expensive cross-encoder on the survivors only
+        start = time.perf_counter()
+        reranked = self.rerank_documents(
+            [{"id": document.get('id'), "content": document['content'], "metadata": document['metadata']} for document in survivors],
+            prompt
+        )[:top_k]
+        second_stage_time = time.perf_counter() - start
+        stats["second_stage_ms"] = second_stage_time * 1000
+        RERANK_STAGE_SECONDS.labels(stage="second").observe(second_stage_time)
+        RERANK_DOCUMENTS.labels(stage="second").inc(len(survivors))
+
+        return (reranked, stats)
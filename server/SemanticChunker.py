@@ -0,0 +1,182 @@
+from typing import List, Optional, Tuple
+import os
+import re
+
+import numpy as np
+
+class SemanticChunker:
+    """
+    A text splitter that groups consecutive sentences into chunks, breaking where the
+    embeddings of neighbouring sentences drift apart the most (as langchain's SemanticChunker
+    does), directly on a SentenceTransformer.
+
+    With chunk_embeddings="pooled" the chunk embeddings are the length-weighted mean of the
+    embeddings of their sentences. The breakpoints are found on sentences embedded together
+    with buffer_size neighbours, which would pull text of the neighbouring chunks into a
+    chunk's embedding, so with a buffer_size above 0 the bare sentences are embedded for
+    pooling; with buffer_size=0 chunking and embedding cost a single pass over the model.
+    With "batched" the chunks are embedded again, in batches, which gives exactly the
+    embeddings the model would give the chunk text.
+    """
+
+    # Default breakpoint_threshold_amount per breakpoint_threshold_type
+    breakpoint_defaults = {
+        "percentile": 95,
+        "standard_deviation": 3,
+        "interquartile": 1.5,
+        "gradient": 95,
+    }
+
+    def __init__(self,
+                 model,
+                 breakpoint_threshold_type: str = "percentile",
+                 breakpoint_threshold_amount: Optional[float] = None,
+                 number_of_chunks: Optional[int] = None,
+                 buffer_size: int = 1,
+                 sentence_split_regex: str = r"(?<=[.?!])\s+",
+                 chunk_embeddings: str = "batched",
+                 batch_size: int = 32
+                 ):
+        """
+        Initialize the SemanticChunker.
+
+        Args:
+            model: The SentenceTransformer to embed sentences (and chunks) with
+            breakpoint_threshold_type: How distances are turned into breakpoints: percentile, standard_deviation, interquartile or gradient
+            breakpoint_threshold_amount: The threshold for breakpoint_threshold_type, its default when None
+            number_of_chunks: Aim for this many chunks instead of using breakpoint_threshold_amount
+            buffer_size: The number of neighbouring sentences on either side embedded with every sentence
+            sentence_split_regex: Regex pattern to split the text into sentences
+            chunk_embeddings: "pooled" to average the embeddings of the sentences of every chunk, "batched" to embed the chunks again
+            batch_size: Batch size of the embedding model
+        """
+        if breakpoint_threshold_type not in self.breakpoint_defaults:
+            raise ValueError(f"Unknown breakpoint_threshold_type {breakpoint_threshold_type}, use one of {', '.join(self.breakpoint_defaults)}.")
+        if chunk_embeddings not in ("pooled", "batched"):
+            raise ValueError(f"Unknown chunk_embeddings {chunk_embeddings}, use pooled or batched.")
+        self.model = model
+        self.breakpoint_threshold_type = breakpoint_threshold_type
+        self.breakpoint_threshold_amount = (
+            self.breakpoint_defaults[breakpoint_threshold_type]
+            if breakpoint_threshold_amount is None
+            else breakpoint_threshold_amount
+        )
+        self.number_of_chunks = number_of_chunks
+        self.buffer_size = buffer_size
+        self.sentence_split = re.compile(sentence_split_regex)
+        self.chunk_embeddings = chunk_embeddings
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_env(cls, model):
+        """Create the chunker from the semantic_chunker_* environment settings, None leaving a setting at its default."""
+        def optional(key, cast):
+            value = os.getenv(key)
+            return None if value in (None, "", "None") else cast(value)
+        return cls(
+            model,
+            breakpoint_threshold_type=os.getenv("semantic_chunker_breakpoint_threshold_type", "percentile"),
+            breakpoint_threshold_amount=optional("semantic_chunker_breakpoint_threshold_amount", float),
+            number_of_chunks=optional("semantic_chunker_number_of_chunks", int),
+            buffer_size=int(os.getenv("semantic_chunker_buffer_size", "1")),
+            chunk_embeddings=os.getenv("semantic_chunker_chunk_embeddings", "batched"),
+            batch_size=int(os.getenv("embedding_batch_size", "32")),
+        )
+
+    def _sentences(self, text):
+        return [sentence.strip() for sentence in self.sentence_split.split(text) if sentence.strip()]
+
+    def _threshold(self, distances):
+        """The distance (or, for gradient, distance gradient) above which a sentence ends a chunk, and the array to compare."""
+        if self.number_of_chunks is not None:
+            # Interpolate the percentile that leaves number_of_chunks chunks: 100 for one, 0 for one per sentence
+            count = max(min(self.number_of_chunks, len(distances)), 1)
+            percentile = 100.0 if len(distances) == 1 else 100.0 * (len(distances) - count) / (len(distances) - 1)
+            return (np.percentile(distances, min(max(percentile, 0.0), 100.0)), distances)
+
+        amount = float(self.breakpoint_threshold_amount)
+        if self.breakpoint_threshold_type == "percentile":
+            return (np.percentile(distances, amount), distances)
+        if self.breakpoint_threshold_type == "standard_deviation":
+            return (np.mean(distances) + amount * np.std(distances), distances)
+        if self.breakpoint_threshold_type == "interquartile":
+            (q1, q3) = np.percentile(distances, [25, 75])
+            return (np.mean(distances) + amount * (q3 - q1), distances)
+        # gradient
+        gradient = np.gradient(distances) if len(distances) > 1 else distances
+        return (np.percentile(gradient, amount), gradient)
+
+    def _groups(self, sentence_embeddings):
+        """Split the sentence indices into consecutive groups at the breakpoints."""
+        count = len(sentence_embeddings)
+        if count < 2:
+            return [range(count)]
+        norms = np.linalg.norm(sentence_embeddings, axis=1)
+        norms[norms == 0] = 1.0
+        normalized = sentence_embeddings / norms[:, None]
+        distances = 1.0 - np.einsum("ij,ij->i", normalized[:-1], normalized[1:])
+        (threshold, values) = self._threshold(distances)
+
+        groups = []
+        start = 0
+        for index in np.flatnonzero(values > threshold):
+            groups.append(range(start, index + 1))
+            start = index + 1
+        if start < count:
+            groups.append(range(start, count))
+        return groups
+
+    def _split(self, text):
+        """The chunks of text, with the sentences, their embeddings and the sentence indices of every chunk."""
+        sentences = self._sentences(text)
+        if len(sentences) == 0:
+            return ([], [], np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32), [])
+
+        # Every sentence is embedded together with buffer_size sentences on either side
+        windows = [
+            " ".join(sentences[max(0, i - self.buffer_size):i + self.buffer_size + 1])
+            for i in range(len(sentences))
+        ]
+        sentence_embeddings = np.asarray(self.model.encode(windows, batch_size=self.batch_size))
+        groups = self._groups(sentence_embeddings)
+        chunks = [" ".join(sentences[i] for i in group) for group in groups]
+        return (chunks, sentences, sentence_embeddings, groups)
+
+    def split_text_with_embeddings(self, text: str) -> Tuple[List[str], np.ndarray]:
+        """
+        Split text into semantically coherent chunks and embed them.
+
+        Args:
+            text: The text to split
+
+        Returns:
+            The text chunks and an array with the embedding of every chunk
+        """
+        (chunks, sentences, sentence_embeddings, groups) = self._split(text)
+        if len(chunks) == 0:
+            return (chunks, sentence_embeddings)
+        if self.chunk_embeddings == "batched":
+            return (chunks, np.asarray(self.model.encode(chunks, batch_size=self.batch_size)))
+
+        if self.buffer_size > 0:
+            # The embeddings used for the breakpoints include the neighbouring sentences
+            sentence_embeddings = np.asarray(self.model.encode(sentences, batch_size=self.batch_size))
+        # Longer sentences weigh more, as they do in the chunk text
+        weights = np.array([len(sentence) for sentence in sentences], dtype=np.float32)
+        embeddings = np.stack([
+            np.average(sentence_embeddings[group.start:group.stop], axis=0, weights=weights[group.start:group.stop])
+            for group in groups
+        ]).astype(sentence_embeddings.dtype)
+        return (chunks, embeddings)
+
+    def split_text(self, text: str) -> List[str]:
+        """
+        Split text into semantically coherent chunks.
+
+        Args:
+            text: The text to split
+
+        Returns:
+            A list of text chunks
+        """
+        return self._split(text)[0]
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class PostgresSessionBackend:
+    """Persists sessions in the ragmeup_sessions table, shared by all worker processes."""
+
+    def __init__(self, connection_pool, ttl):
+        self.connection_pool = connection_pool
+        self.ttl = ttl
+        self.last_cleanup = 0.0
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS ragmeup_sessions (
+                id TEXT PRIMARY KEY,
+                data JSONB NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+
+    def _execute(self, query, params=(), fetch=False):
+        conn = self.connection_pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                result = cursor.fetchone() if fetch else None
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.connection_pool.putconn(conn)
+
+    def get(self, conversation_id):
+        row = self._execute(
+            "SELECT data FROM ragmeup_sessions WHERE id = %s AND updated_at > now() - %s * interval '1 second';",
+            (conversation_id, self.ttl),
+            fetch=True
+        )
+        return None if row is None else row[0]
+
+    def put(self, conversation_id, session):
+        self._execute(
+            """
+            INSERT INTO ragmeup_sessions (id, data, updated_at) VALUES (%s, %s, now())
+            ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data, updated_at = now();
+            """,
+            (conversation_id, json.dumps(session, default=float))
+        )
+        # Expired sessions are removed at most once a minute
+        if time.monotonic() - self.last_cleanup > 60:
+            self.last_cleanup = time.monotonic()
+            self._execute("DELETE FROM ragmeup_sessions WHERE updated_at < now() - %s * interval '1 second';", (self.ttl,))
+
+    def delete(self, conversation_id):
+        self._execute("DELETE FROM ragmeup_sessions WHERE id = %s;", (conversation_id,))
+
+class SessionStore:
+    """
+    Server-side conversation state (history and current documents) keyed by conversation id,
+    so clients only send the new prompt and receive deltas instead of round-tripping the
+    full history and documents on every turn.
+
+    Sessions are kept in an in-memory LRU of at most max_size conversations that expire
+    after ttl seconds. An optional persistent backend (session_backend=postgres) is written
+    through and is the authority on reads, so sessions survive restarts and are shared
+    between worker processes: another worker may have saved a later turn than the one in
+    this worker's memory. The memory tier then only serves when the backend is unavailable.
+    """
+
+    def __init__(self, logger, backend=None, max_size=1000, ttl=86400):
+        self.logger = logger
+        self.backend = backend
+        self.max_size = max_size
+        self.ttl = ttl
+        self.memory = OrderedDict()  # conversation id -> (last update, session)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, logger, connection_pool):
+        """Create the session store from the environment settings, or return None if it is disabled."""
+        if os.getenv("use_sessions") != "True":
+            return None
+        ttl = float(os.getenv("session_ttl_seconds", "86400"))
+        backend = None
+        if os.getenv("session_backend", "memory") == "postgres":
+            backend = PostgresSessionBackend(connection_pool, ttl)
+        logger.info(f"Initializing server-side sessions ({os.getenv('session_backend', 'memory')}).")
+        return cls(logger, backend=backend, max_size=int(os.getenv("session_max_size", "1000")), ttl=ttl)
+
+    def _remember(self, conversation_id, session):
+        with self.lock:
+            self.memory[conversation_id] = (time.monotonic(), session)
+            self.memory.move_to_end(conversation_id)
+            while len(self.memory) > self.max_size:
+                self.memory.popitem(last=False)
+
+    def _get_from_memory(self, conversation_id):
+        with self.lock:
+            entry = self.memory.get(conversation_id)
+            if entry is None:
+                return None
+            (updated, session) = entry
+            if time.monotonic() - updated <= self.ttl:
+                self.memory.move_to_end(conversation_id)
+                return session
+            del self.memory[conversation_id]
+            return None
+
+    def get(self, conversation_id):
+        """Return the session ({"history": [...], "documents": [...]}) or None if it is unknown or expired."""
+        if self.backend is None:
+            return self._get_from_memory(conversation_id)
+        try:
+            session = self.backend.get(conversation_id)
+        except Exception as e:
+            self.logger.warning(f"Error while reading session {conversation_id}, using this worker's copy: {e}")
+            return self._get_from_memory(conversation_id)
+        if session is None:
+            # Expired, or deleted by another worker
+            with self.lock:
+                self.memory.pop(conversation_id, None)
+            return None
+        self._remember(conversation_id, session)
+        return session
+
+    def save(self, conversation_id, history, documents):
+        session = {"history": history, "documents": documents or []}
+        self._remember(conversation_id, session)
+        if self.backend is not None:
+            try:
+                self.backend.put(conversation_id, session)
+            except Exception as e:
+                self.logger.warning(f"Error while persisting session {conversation_id}: {e}")
+
+    def delete(self, conversation_id):
+        with self.lock:
+            self.memory.pop(conversation_id, None)
+        if self.backend is not None:
+            self.backend.delete(conversation_id)
@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import ADMISSION_ACTIVE, ADMISSION_QUEUED, ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED
+from settings import get_settings
+
+class Overloaded(Exception):
+    """
+    A pipeline stage is saturated. status is 429 when its wait queue was full and the call
+    was refused outright, 503 when it waited the full queue timeout without getting a slot.
+    """
+
+    def __init__(self, stage, status, retry_after):
+        self.stage = stage
+        self.status = status
+        self.retry_after = retry_after
+        reason = "queue is full" if status == 429 else "timed out waiting for a slot"
+        super().__init__(f"The server is overloaded ({stage} {reason}), try again in {retry_after} seconds.")
+
+class StageLimiter:
+    """
+    Limits how many calls run a heavy stage (embedding, rerank, conversion, an LLM backend)
+    at once. At most max_concurrent calls run, at most max_queue wait for a slot (for up to
+    timeout seconds) and any further call is refused immediately.
+    """
+
+    def __init__(self, stage, max_concurrent, max_queue, timeout, retry_after):
+        self.stage = stage
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+
+    def _try_enter(self):
+        with self.condition:
+            if self.active < self.max_concurrent and self.waiting == 0:
+                self.active += 1
+                ADMISSION_ACTIVE.labels(stage=self.stage).inc()
+                return True
+            return False
+
+    def enter(self):
+        """Take a slot, waiting in the queue if needed. Raises Overloaded."""
+        start = time.monotonic()
+        with self.condition:
+            if self.active >= self.max_concurrent or self.waiting > 0:
+                if self.waiting >= self.max_queue:
+                    ADMISSION_REJECTED.labels(stage=self.stage, reason="queue_full").inc()
+                    raise Overloaded(self.stage, 429, self.retry_after)
+                self.waiting += 1
+                ADMISSION_QUEUED.labels(stage=self.stage).inc()
+                try:
+                    admitted = self.condition.wait_for(lambda: self.active < self.max_concurrent, self.timeout)
+                finally:
+                    self.waiting -= 1
+                    ADMISSION_QUEUED.labels(stage=self.stage).dec()
+                if not admitted:
+                    ADMISSION_REJECTED.labels(stage=self.stage, reason="timeout").inc()
+                    raise Overloaded(self.stage, 503, self.retry_after)
+            self.active += 1
+            ADMISSION_ACTIVE.labels(stage=self.stage).inc()
+        ADMISSION_WAIT_SECONDS.labels(stage=self.stage).observe(time.monotonic() - start)
+
+    def reconfigure(self, max_concurrent, max_queue, timeout, retry_after):
+        """Apply new limits, keeping the calls that are running or waiting."""
+        with self.condition:
+            self.max_concurrent = max_concurrent
+            self.max_queue = max_queue
+            self.timeout = timeout
+            self.retry_after = retry_after
+            self.condition.notify_all()
+
+    def exit(self):
+        with self.condition:
+            self.active -= 1
+            ADMISSION_ACTIVE.labels(stage=self.stage).dec()
+            self.condition.notify()
+
+    @contextmanager
+    def slot(self):
+        self.enter()
+        try:
+            yield
+        finally:
+            self.exit()
+
+    @asynccontextmanager
+    async def aslot(self):
+        # Waiting for a slot blocks, so it is done off the event loop unless one is free
+        if not self._try_enter():
+            waiter = asyncio.ensure_future(asyncio.to_thread(self.enter))
+            try:
+                await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                # The waiting thread cannot be interrupted, give its slot back once it gets one
+                waiter.add_done_callback(self._release_abandoned)
+                raise
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def _release_abandoned(self, waiter):
+        if not waiter.cancelled() and waiter.exception() is None:
+            self.exit()
+
+# Limiters are per process, created on first use from the settings and updated by
+# reload_limiters when the configuration changes
+_limiters = {}
+_lock = threading.Lock()
+_unset = object()
+
+def _limit_settings(stage, settings):
+    """The StageLimiter arguments of a stage, or None if it is unlimited."""
+    # LLM backends fall back to the shared LLM limit, e.g. admission_llm_ollama_concurrency
+    # before admission_llm_concurrency
+    max_concurrent = settings.admission_concurrency.get(stage)
+    if max_concurrent is None and stage.startswith("llm_"):
+        max_concurrent = settings.admission_concurrency.get("llm")
+    if not max_concurrent:
+        return None
+    return {
+        "max_concurrent": max_concurrent,
+        "max_queue": settings.admission_queue_size,
+        "timeout": settings.admission_queue_timeout,
+        "retry_after": settings.admission_retry_after,
+    }
+
+def get_limiter(stage):
+    """The limiter of a stage, or None when admission control is disabled or the stage is unlimited."""
+    settings = get_settings()
+    if not settings.use_admission_control:
+        return None
+    # Only creating a limiter takes the lock, looking one up does not
+    limiter = _limiters.get(stage, _unset)
+    if limiter is _unset:
+        with _lock:
+            if stage not in _limiters:
+                limit_settings = _limit_settings(stage, settings)
+                _limiters[stage] = None if limit_settings is None else StageLimiter(stage, **limit_settings)
+            limiter = _limiters[stage]
+    return limiter
+
+def reload_limiters():
+    """
+    Apply changed admission settings (after /config) to the limiters of this process.
+    Existing limiters keep counting the calls running and waiting in them, a stage that
+    became unlimited lets its running calls finish on the old limiter.
+    """
+    settings = get_settings()
+    with _lock:
+        for (stage, limiter) in list(_limiters.items()):
+            limit_settings = _limit_settings(stage, settings)
+            if limit_settings is None:
+                _limiters[stage] = None
+            elif limiter is None:
+                _limiters[stage] = StageLimiter(stage, **limit_settings)
+            else:
+                limiter.reconfigure(**limit_settings)
+
+@contextmanager
+def limit(stage):
+    """Run the enclosed block within the stage's concurrency limit, if there is one."""
+    limiter = get_limiter(stage)
+    if limiter is None:
+        yield
+        return
+    with limiter.slot():
+        yield
+
+@asynccontextmanager
+async def alimit(stage):
+    """Async variant of limit, for code running on an event loop."""
+    limiter = get_limiter(stage)
+    if limiter is None:
+        yield
+        return
+    async with limiter.aslot():
+        yield
@@ -0,0 +1,77 @@
+"""
+ASGI entry point for the RAG Me Up server.
+
+/chat_stream is served natively as an async Server-Sent Events stream: the pipeline
+stages before and after the answer run in a bounded thread pool and the answer itself is
+streamed without holding a thread (with use_async_llm=True), so the number of concurrent
+streams is no longer capped by the number of worker threads. Every other route is the
+Flask application from server.py, mounted as a WSGI app.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import server
+from admission import Overloaded
+from server import app as flask_app, logger, format_stream_event, stream_error_event
+
+# Bounded pool for the blocking pipeline stages (embedding, retrieval, rerank, provenance, ...)
+pipeline_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("asgi_pipeline_workers", "8")),
+    thread_name_prefix="asgi-pipeline"
+)
+
+async def chat_stream(request):
+    """
+    Streaming chat endpoint using Server-Sent Events (SSE), same request and events as the
+    Flask /chat_stream route.
+    """
+    # The RAG helper may still be loading in the background, see server.initialize
+    if not server.startup.is_ready():
+        return JSONResponse(
+            {"error": "The server is starting up, try again shortly.", "startup": server.startup.to_dict()},
+            status_code=503,
+            headers={"Retry-After": "5"}
+        )
+    raghelper = server.raghelper
+
+    json_data = await request.json()
+    prompt = json_data.get('prompt')
+    (conversation_id, history, original_docs) = await run_in_threadpool(server.load_conversation, json_data)
+    datasets = json_data.get('datasets', [])
+
+    async def generate():
+        try:
+            async for (event_type, event_data) in raghelper.ahandle_user_interaction_stream(
+                prompt, history, datasets, docs=original_docs, executor=pipeline_executor
+            ):
+                if event_type == "done" and conversation_id:
+                    # Storing the session may hit the persistent backend
+                    yield await run_in_threadpool(format_stream_event, event_type, event_data, prompt, original_docs, conversation_id)
+                else:
+                    yield format_stream_event(event_type, event_data, prompt, original_docs)
+        except Overloaded as e:
+            logger.warning(f"Streaming request refused: {e}")
+            yield stream_error_event(e)
+        except Exception as e:
+            logger.error(f"Streaming error: {e}", exc_info=True)
+            yield stream_error_event(e)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'Connection': 'keep-alive',
+    })
+
+app = Starlette(routes=[
+    Route("/chat_stream", chat_stream, methods=["POST"]),
+    Mount("/", app=WSGIMiddleware(flask_app, workers=int(os.getenv("asgi_wsgi_workers", "10")))),
+])
@@ -0,0 +1,111 @@
+"""
+Throughput of the ParagraphChunker against its previous implementation.
+
+Splits deterministic synthetic documents of increasing size with the previous
+split_text (the separator recompiled on every call and the full paragraph list built in
+memory), the current one in characters, its lazy iter_chunks and the token-aware mode,
+and reports MB/s, the time to the first chunk and the peak memory of each.
+
+Token sizing uses a whitespace tokenizer so the benchmark runs offline, or the tokenizer
+of an embedding model with --tokenizer. Run from the server directory:
+    python -m benchmarks.chunker_throughput --sizes 1,10,50
+    python -m benchmarks.chunker_throughput --tokenizer sentence-transformers/all-MiniLM-L6-v2
+"""
+import argparse
+import re
+import statistics
+import time
+import tracemalloc
+
+from ParagraphChunker import ParagraphChunker
+from benchmarks.synthetic import SyntheticCorpus
+
+def legacy_split_text(text, max_chunk_size=512, paragraph_separator=r"\n\s*\n"):
+    """ParagraphChunker.split_text as it was before it was precompiled, lazy and token-aware."""
+    paragraphs = re.split(paragraph_separator, text)
+    paragraphs = [p.strip() for p in paragraphs if p.strip()]
+
+    chunks = []
+    current_chunk = []
+    current_size = 0
+
+    for paragraph in paragraphs:
+        paragraph_size = len(paragraph)
+        if current_size > 0 and current_size + paragraph_size > max_chunk_size:
+            chunks.append("\n\n".join(current_chunk))
+            current_chunk = []
+            current_size = 0
+        current_chunk.append(paragraph)
+        current_size += paragraph_size
+
+    if current_chunk:
+        chunks.append("\n\n".join(current_chunk))
+
+    return chunks
+
+class WhitespaceTokenizer:
+    """Offline stand-in for a Hugging Face tokenizer, one token per word."""
+
+    def encode(self, text, add_special_tokens=True):
+        return text.split()
+
+def measure(split, text, repeat):
+    """Median seconds to split text completely, seconds to the first chunk and peak memory in KiB."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in split(text):
+            pass
+        durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    next(iter(split(text)), None)
+    first_chunk = time.perf_counter() - start
+
+    tracemalloc.start()
+    for _ in split(text):
+        pass
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (statistics.median(durations), first_chunk, peak / 1024)
+
+def main():
+    parser = argparse.ArgumentParser(description="ParagraphChunker throughput against its previous implementation.")
+    parser.add_argument("--sizes", default="1,10", help="Comma-separated document sizes in MB.")
+    parser.add_argument("--max-chunk-size", type=int, default=512, help="Maximum chunk size in characters.")
+    parser.add_argument("--max-tokens", type=int, default=128, help="Maximum chunk size in tokens.")
+    parser.add_argument("--tokenizer", default=None, help="Hugging Face tokenizer to measure tokens with.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    else:
+        tokenizer = WhitespaceTokenizer()
+
+    chunker = ParagraphChunker(max_chunk_size=args.max_chunk_size)
+    token_chunker = ParagraphChunker.for_tokenizer(tokenizer, args.max_tokens)
+    variants = [
+        ("legacy split_text", lambda text: legacy_split_text(text, args.max_chunk_size)),
+        ("split_text", chunker.split_text),
+        ("iter_chunks", chunker.iter_chunks),
+        (f"iter_chunks ({args.max_tokens} tokens)", token_chunker.iter_chunks),
+    ]
+
+    corpus = SyntheticCorpus(seed=args.seed)
+    paragraph = corpus.text(0, paragraphs=1000)
+    for size in [float(size) for size in args.sizes.split(",")]:
+        # Repeat a generated document up to the requested size
+        text = "\n\n".join([paragraph] * max(1, int(size * 1024 * 1024 / len(paragraph))))
+        megabytes = len(text.encode()) / (1024 * 1024)
+        print(f"\n{megabytes:.1f} MB document")
+        print(f"{'variant':<32}{'MB/s':>10}{'first chunk ms':>16}{'peak MiB':>11}{'chunks':>9}")
+        for (name, split) in variants:
+            (duration, first_chunk, peak) = measure(split, text, args.repeat)
+            chunks = sum(1 for _ in split(text))
+            print(f"{name:<32}{megabytes / duration:10.1f}{first_chunk * 1000:16.2f}{peak / 1024:11.1f}{chunks:9d}")
+
+if __name__ == "__main__":
+    main()
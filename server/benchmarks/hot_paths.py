@@ -0,0 +1,214 @@
+"""
+Micro-benchmarks of the retrieval and ingestion hot paths.
+
+Times (and measures the peak memory of) ParagraphChunker.split_text, the BM25 query
+escaping, format_documents, Reranker.rerank_documents, Reciprocal Rank Fusion and the
+retriever's Python side in both fusion modes (min-max and RRF), on a deterministic
+synthetic corpus. Runs offline: the embedding model, the LLM, the flashrank model and
+Postgres are replaced by the stand-ins from benchmarks.synthetic.
+
+Run from the server directory, save the results and compare a later run against them:
+    python -m benchmarks.hot_paths --output baseline.json
+    python -m benchmarks.hot_paths --baseline baseline.json --output results.json
+
+Use --filter to run a subset (e.g. --filter fusion) and --fail-above 10 to exit with an
+error when any benchmark got more than 10% slower than the baseline.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from benchmarks.synthetic import SyntheticCorpus, StubEmbedder, StubLLM, StubRanker, StubConnectionPool
+
+# Settings the code under test reads, unless they are set already
+BENCHMARK_ENVIRONMENT = {
+    "vector_store_k": "10",
+    "rrf_k": "60",
+    "use_rrf": "False",
+    "use_re2": "False",
+    "rerank": "False",
+    "rerank_k": "5",
+}
+
+def measure(function, repeat, number):
+    """Time number calls, repeat times, and trace the peak memory of one more call."""
+    function()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) / number)
+    tracemalloc.start()
+    function()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    samples.sort()
+    return {
+        "mean_ms": statistics.mean(samples) * 1000,
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))] * 1000,
+        "min_ms": samples[0] * 1000,
+        "peak_kib": peak / 1024,
+        "repeat": repeat,
+        "number": number,
+    }
+
+def benchmarks(corpus, scale):
+    """Yield (name, params, setup) where setup returns the function to time, or raises to skip it."""
+    chunks = corpus.chunks(200 * scale)
+    queries = corpus.queries(50, chunks)
+    embedder = StubEmbedder()
+    logger = logging.getLogger(__name__)
+
+    def chunker(size):
+        def setup():
+            from ParagraphChunker import ParagraphChunker
+            chunker = ParagraphChunker(max_chunk_size=512)
+            text = corpus.text(0, paragraphs=size)
+            return lambda: chunker.split_text(text)
+        return setup
+
+    for size in [50 * scale, 500 * scale]:
+        yield (f"paragraph_chunker.split_text[{size}p]", {"paragraphs": size}, chunker(size))
+
+    def escape_query():
+        from PostgresHybridRetriever import PostgresHybridRetriever
+        import nltk
+        nltk.word_tokenize("warm up")  # raises LookupError without the punkt data
+        retriever = PostgresHybridRetriever(None)
+        return lambda: [retriever.escape_query(query) for query in queries]
+    yield ("retriever.escape_query[50q]", {"queries": len(queries)}, escape_query)
+
+    def format_documents(packing):
+        def setup():
+            from RAGHelper import RAGHelper
+            from ContextPacker import ContextPacker
+            # Only the attributes format_documents uses, without loading any models
+            helper = RAGHelper.__new__(RAGHelper)
+            helper.logger = logger
+            helper.llm = StubLLM()
+            helper.context_packer = ContextPacker(logger, helper.format_document, budget=4000) if packing else None
+            documents = [{**chunk, "metadata": {**chunk["metadata"], "distance": 0.5}} for chunk in chunks[:20]]
+            return lambda: helper.format_documents(documents)
+        return setup
+
+    yield ("rag_helper.format_documents[20d]", {"documents": 20, "packing": False}, format_documents(False))
+    yield ("rag_helper.format_documents[20d,packed]", {"documents": 20, "packing": True}, format_documents(True))
+
+    def rerank(count):
+        def setup():
+            from Reranker import Reranker
+            reranker = Reranker.__new__(Reranker)
+            reranker.reranker = StubRanker()
+            reranker.first_stage = None
+            documents = [{**chunk, "metadata": {**chunk["metadata"], "distance": 0.5}} for chunk in chunks[:count]]
+            return lambda: reranker.rerank_documents(documents, queries[0])
+        return setup
+
+    for count in [20, 100]:
+        yield (f"reranker.rerank_documents[{count}d,stub]", {"documents": count}, rerank(count))
+
+    def rrf(count):
+        def setup():
+            from PostgresHybridRetriever import reciprocal_rank_fusion
+            pool = StubConnectionPool(chunks[:count])
+            return lambda: reciprocal_rank_fusion(pool.bm25_rows, pool.vector_rows, 10, 60)
+        return setup
+
+    for count in [40, 400]:
+        yield (f"fusion.reciprocal_rank_fusion[{count}c]", {"candidates": count}, rrf(count))
+
+    def retrieval(mode):
+        def setup():
+            from PostgresHybridRetriever import PostgresHybridRetriever
+            retriever = PostgresHybridRetriever(StubConnectionPool(chunks))
+            search = retriever._get_relevant_documents_rrf if mode == "rrf" else retriever._get_relevant_documents_minmax
+            embeddings = embedder.encode(queries)
+            # The retriever logs errors (e.g. missing punkt data) and returns None
+            if search(queries[0], embeddings[0], []) is None:
+                raise RuntimeError(f"{mode} retrieval failed, see the error above")
+            return lambda: [search(query, embedding, ["dataset0", "dataset1"]) for (query, embedding) in zip(queries, embeddings)]
+        return setup
+
+    for mode in ["minmax", "rrf"]:
+        yield (f"fusion.get_relevant_documents[{mode},50q]", {"queries": len(queries), "mode": mode}, retrieval(mode))
+
+def compare(results, baseline, fail_above):
+    """Print the change against the baseline, return whether any benchmark regressed beyond fail_above percent."""
+    previous = {entry["name"]: entry for entry in baseline.get("results", [])}
+    regressed = False
+    print(f"\n{'benchmark':<48} {'baseline':>12} {'current':>12} {'change':>9}")
+    for entry in results:
+        if entry.get("skipped") or entry["name"] not in previous or previous[entry["name"]].get("skipped"):
+            continue
+        before = previous[entry["name"]]["median_ms"]
+        after = entry["median_ms"]
+        change = (after - before) / before * 100 if before > 0 else 0.0
+        flag = ""
+        if fail_above is not None and change > fail_above:
+            regressed = True
+            flag = "  REGRESSION"
+        print(f"{entry['name']:<48} {before:10.3f}ms {after:10.3f}ms {change:+8.1f}%{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the retrieval and ingestion hot paths.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the synthetic corpus.")
+    parser.add_argument("--scale", type=int, default=1, help="Multiplies the corpus and document sizes.")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed repetitions per benchmark.")
+    parser.add_argument("--number", type=int, default=5, help="Calls per repetition.")
+    parser.add_argument("--filter", default=None, help="Only run benchmarks whose name contains this.")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", default=None, help="Compare against the results in this JSON file.")
+    parser.add_argument("--fail-above", type=float, default=None, help="Exit with 1 if any benchmark is this many percent slower than the baseline.")
+    args = parser.parse_args()
+
+    for (key, value) in BENCHMARK_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    logging.basicConfig(level=logging.WARNING)
+
+    corpus = SyntheticCorpus(seed=args.seed)
+    results = []
+    for (name, params, setup) in benchmarks(corpus, args.scale):
+        if args.filter and args.filter not in name:
+            continue
+        try:
+            function = setup()
+        except Exception as e:
+            print(f"{name:<48} skipped: {type(e).__name__}: {e}")
+            results.append({"name": name, "params": params, "skipped": f"{type(e).__name__}: {e}"})
+            continue
+        entry = {"name": name, "params": params, **measure(function, args.repeat, args.number)}
+        results.append(entry)
+        print(
+            f"{name:<48} median {entry['median_ms']:10.3f} ms   p95 {entry['p95_ms']:10.3f} ms   "
+            f"peak {entry['peak_kib']:10.1f} KiB"
+        )
+
+    report = {
+        "seed": args.seed,
+        "scale": args.scale,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {len(results)} results to {args.output}.")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.fail_above):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Throughput comparison of LLMHelper and AsyncLLMHelper against the local mock LLM server.
+
+Start the mock server first, then run from the server directory:
+    python -m benchmarks.mock_llm_server --port 8765
+    python -m benchmarks.llm_throughput --requests 200 --concurrency 50
+
+Both helpers are configured for the OpenAI backend pointing at the mock server. The
+sync helper is driven from a thread pool (like Flask worker threads), the async helper
+both natively via asyncio and through its sync wrappers.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def report(name, latencies, elapsed):
+    print(
+        f"{name:<28} {len(latencies) / elapsed:8.1f} req/s   "
+        f"p50 {statistics.median(latencies) * 1000:8.1f} ms   "
+        f"p95 {percentile(latencies, 95) * 1000:8.1f} ms"
+    )
+
+def timed_call(helper, stream):
+    start = time.perf_counter()
+    if stream:
+        (generator, _) = helper.generate_response_stream(None, "Hello", [])
+        "".join(generator)
+    else:
+        helper.generate_response(None, "Hello", [])
+    return time.perf_counter() - start
+
+def run_threaded(name, helper, requests, concurrency, stream):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(lambda _: timed_call(helper, stream), range(requests)))
+    report(name, latencies, time.perf_counter() - start)
+
+async def run_async(name, helper, requests, concurrency, stream):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            if stream:
+                (generator, _) = helper.agenerate_response_stream(None, "Hello", [])
+                async for _ in generator:
+                    pass
+            else:
+                await helper.agenerate_response(None, "Hello", [])
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[one() for _ in range(requests)])
+    report(name, latencies, time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and async LLM client throughput.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8765/v1")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--stream", action="store_true", help="Use the streaming API.")
+    args = parser.parse_args()
+
+    os.environ.update({
+        "use_openai": "True",
+        "openai_model_name": "mock",
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_BASE_URL": args.base_url,
+        "temperature": "0",
+    })
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger(__name__)
+
+    from LLMHelper import LLMHelper
+    from AsyncLLMHelper import AsyncLLMHelper, get_event_loop
+
+    run_threaded("LLMHelper (threads)", LLMHelper(logger), args.requests, args.concurrency, args.stream)
+    async_helper = AsyncLLMHelper(logger)
+    run_threaded("AsyncLLMHelper (sync wrap)", async_helper, args.requests, args.concurrency, args.stream)
+    asyncio.run_coroutine_threadsafe(
+        run_async("AsyncLLMHelper (asyncio)", async_helper, args.requests, args.concurrency, args.stream),
+        get_event_loop()
+    ).result()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Local mock LLM provider for throughput and integration tests.
+
+Implements the OpenAI chat completions API and the Anthropic messages API (streaming
+and non-streaming) with a configurable time to first token and token rate, over
+keep-alive HTTP/1.1. Point the clients at it with OPENAI_BASE_URL=http://localhost:8765/v1
+and OPENAI_API_KEY=mock, or ANTHROPIC_BASE_URL=http://localhost:8765 and ANTHROPIC_API_KEY=mock.
+
+Prompt prefix caching is simulated (tokens are approximated by words): OpenAI reports
+cached_tokens for the longest previously seen message prefix of at least 1024 tokens, and
+Anthropic reports cache reads and writes for prefixes ending at cache_control breakpoints.
+
+Usage:
+    python -m benchmarks.mock_llm_server --port 8765 --ttft-ms 200 --tokens 50 --token-interval-ms 10
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Set from the command line arguments
+    ttft = 0.2
+    tokens = 50
+    token_interval = 0.01
+
+    # Simulated provider-side prefix cache: prefix digest -> token count
+    prefix_cache = {}
+    prefix_cache_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _answer_tokens(self):
+        return [f"token{i} " for i in range(self.tokens)]
+
+    def _count_tokens(self, text):
+        return len(str(text).split())
+
+    def _cache_prefixes(self, blocks):
+        """
+        Walk the blocks of a prompt in order, yielding (digest, tokens, breakpoint) for every
+        prefix ending at a block. Blocks are (text, is_breakpoint) tuples.
+        """
+        digest = ""
+        tokens = 0
+        for (text, is_breakpoint) in blocks:
+            digest = hashlib.sha1(f"{digest}{text}".encode()).hexdigest()
+            tokens += self._count_tokens(text)
+            yield (digest, tokens, is_breakpoint)
+
+    def do_POST(self):
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            self._openai_chat(self._read_json())
+        elif self.path.rstrip("/").endswith("/messages"):
+            self._anthropic_messages(self._read_json())
+        else:
+            self._send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+    def _openai_chat(self, request):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = request.get("model", "mock")
+        messages = request.get("messages", [])
+        prompt_tokens = sum(self._count_tokens(message.get("content", "")) for message in messages)
+
+        # Automatic caching of every message prefix of at least 1024 tokens
+        cached_tokens = 0
+        with self.prefix_cache_lock:
+            for (digest, tokens, _) in self._cache_prefixes([(json.dumps(message), True) for message in messages[:-1]]):
+                if digest in self.prefix_cache:
+                    cached_tokens = tokens
+                elif tokens >= 1024:
+                    self.prefix_cache[digest] = tokens
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": self.tokens,
+            "total_tokens": prompt_tokens + self.tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+        time.sleep(self.ttft)
+        if not request.get("stream"):
+            # Simulate the full generation time before answering
+            time.sleep(self.token_interval * self.tokens)
+            self._send_json({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(self._answer_tokens())},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+
+        self._start_stream()
+        for token in self._answer_tokens():
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            time.sleep(self.token_interval)
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        if request.get("stream_options", {}).get("include_usage"):
+            final["usage"] = usage
+        self._write_chunk(f"data: {json.dumps(final)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_stream()
+
+    def _anthropic_messages(self, request):
+        message_id = f"msg_{uuid.uuid4().hex}"
+        model = request.get("model", "mock")
+
+        # Flatten the system prompt and messages into blocks, noting the cache breakpoints
+        blocks = []
+        system = request.get("system")
+        if isinstance(system, str):
+            blocks.append((system, False))
+        elif isinstance(system, list):
+            blocks.extend((block.get("text", ""), "cache_control" in block) for block in system)
+        for message in request.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                blocks.append((content, False))
+            else:
+                blocks.extend((block.get("text", ""), "cache_control" in block) for block in content)
+
+        total_tokens = sum(self._count_tokens(text) for (text, _) in blocks)
+        cache_read = 0
+        cache_write_upto = 0
+        with self.prefix_cache_lock:
+            for (digest, tokens, is_breakpoint) in self._cache_prefixes(blocks):
+                if not is_breakpoint:
+                    continue
+                if digest in self.prefix_cache:
+                    cache_read = tokens
+                else:
+                    self.prefix_cache[digest] = tokens
+                    cache_write_upto = tokens
+        cache_write = max(0, cache_write_upto - cache_read)
+        usage = {
+            "input_tokens": total_tokens - cache_read - cache_write,
+            "output_tokens": self.tokens,
+            "cache_read_input_tokens": cache_read,
+            "cache_creation_input_tokens": cache_write,
+        }
+
+        time.sleep(self.ttft)
+        if not request.get("stream"):
+            time.sleep(self.token_interval * self.tokens)
+            self._send_json({
+                "id": message_id,
+                "type": "message",
+                "role": "assistant",
+                "model": model,
+                "content": [{"type": "text", "text": "".join(self._answer_tokens())}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": usage,
+            })
+            return
+
+        def event(name, payload):
+            self._write_chunk(f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode())
+
+        self._start_stream()
+        event("message_start", {"type": "message_start", "message": {
+            "id": message_id,
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": {**usage, "output_tokens": 1},
+        }})
+        event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for token in self._answer_tokens():
+            event("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token}})
+            time.sleep(self.token_interval)
+        event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": self.tokens}})
+        event("message_stop", {"type": "message_stop"})
+        self._end_stream()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock LLM provider.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft-ms", type=float, default=200, help="Delay before the first token.")
+    parser.add_argument("--tokens", type=int, default=50, help="Number of tokens per answer.")
+    parser.add_argument("--token-interval-ms", type=float, default=10, help="Delay between tokens.")
+    args = parser.parse_args()
+
+    MockLLMHandler.ttft = args.ttft_ms / 1000
+    MockLLMHandler.tokens = args.tokens
+    MockLLMHandler.token_interval = args.token_interval_ms / 1000
+
+    server = ThreadingHTTPServer((args.host, args.port), MockLLMHandler)
+    server.daemon_threads = True
+    print(f"Mock LLM server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
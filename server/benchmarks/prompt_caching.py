@@ -0,0 +1,54 @@
+"""
+Multi-turn conversation against the local mock LLM server to check prompt-prefix caching.
+
+Start the mock server first, then run from the server directory:
+    python -m benchmarks.mock_llm_server --port 8765 --ttft-ms 0 --token-interval-ms 0
+    python -m benchmarks.prompt_caching --backend anthropic --turns 4
+
+Every turn follows the pipeline's layout for a follow-up without new documents: the
+system prompt with the documents stays first and the history is resent unchanged, so
+from the second turn on the provider should report cached prompt tokens. LLMHelper logs
+these counts.
+"""
+import argparse
+import logging
+import os
+
+def main():
+    parser = argparse.ArgumentParser(description="Check prompt-prefix caching against the mock LLM server.")
+    parser.add_argument("--backend", choices=["openai", "anthropic"], default="anthropic")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8765")
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--context-words", type=int, default=3000, help="Size of the document context in words.")
+    args = parser.parse_args()
+
+    os.environ.update({
+        f"use_{args.backend}": "True",
+        f"{args.backend}_model_name": "mock",
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_BASE_URL": f"{args.base_url}/v1",
+        "ANTHROPIC_API_KEY": "mock",
+        "ANTHROPIC_BASE_URL": args.base_url,
+        "use_prompt_caching": "True",
+        "temperature": "0",
+    })
+    logging.basicConfig(format='%(levelname)-8s %(message)s', level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    from LLMHelper import LLMHelper
+    llm = LLMHelper(logger)
+
+    context = " ".join(f"document{i}" for i in range(args.context_words))
+    system_prompt = f"Answer the question using these documents:\n\n{context}"
+    history = []
+    for turn in range(args.turns):
+        logger.info(f"Turn {turn + 1}")
+        (response, thread) = llm.generate_response(
+            system_prompt if turn == 0 else None,
+            f"Question number {turn + 1}?",
+            history
+        )
+        history = thread + [{"role": "assistant", "content": response}]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Retrieval quality versus latency, per pipeline configuration.
+
+Runs every query of a labeled query set through RAGHelper.fetch_documents (HyDE, hybrid
+retrieval, reranking and the rewrite loop, as configured) once per configuration and
+reports recall@k, MRR and nDCG@k next to the p50/p95 latency and the number of LLM calls,
+so the cheapest configuration that keeps the quality can be picked from measurements.
+
+The query set is a JSON list or JSONL file of labeled queries:
+    {"query": "...", "datasets": ["..."], "relevant_sources": ["dataset/file.pdf"], "relevant_chunks": ["<chunk id>"]}
+datasets, relevant_sources and relevant_chunks are optional, but every query needs at least
+one relevant source or chunk. Sources are matched relative to the data directory.
+
+Configurations are a JSON object of name -> settings overriding the environment, e.g.
+    {"rrf-k20": {"use_rrf": "True", "vector_store_k": "20"}, "rrf-k20+rerank": {"use_rrf": "True", "vector_store_k": "20", "rerank": "True"}}
+Without --configs, min-max and RRF fusion are compared with and without reranking, HyDE
+and the rewrite loop.
+
+Runs against the configured database and models (.env), from the server directory:
+    python -m benchmarks.retrieval_eval --queries eval.jsonl --k 1,5,10 --output eval.json
+
+Disable the LLM response cache (llm_cache_types=) to measure the real cost of HyDE and the
+rewrite loop.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+from collections import Counter
+
+DEFAULT_CONFIGURATIONS = {
+    "minmax": {"use_rrf": "False", "rerank": "False", "use_hyde": "False", "use_rewrite_loop": "False"},
+    "rrf": {"use_rrf": "True", "rerank": "False", "use_hyde": "False", "use_rewrite_loop": "False"},
+    "minmax+rerank": {"use_rrf": "False", "rerank": "True", "use_hyde": "False", "use_rewrite_loop": "False"},
+    "rrf+rerank": {"use_rrf": "True", "rerank": "True", "use_hyde": "False", "use_rewrite_loop": "False"},
+    "rrf+rerank+hyde": {"use_rrf": "True", "rerank": "True", "use_hyde": "True", "use_rewrite_loop": "False"},
+    "rrf+rerank+rewrite": {"use_rrf": "True", "rerank": "True", "use_hyde": "False", "use_rewrite_loop": "True"},
+}
+
+class CallCounter:
+    """Wraps the LLM helper to count its calls by call type."""
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def _count(self, call_type):
+        with self.lock:
+            self.calls[call_type] += 1
+
+    def generate_response(self, system_prompt, prompt, history, call_type="answer"):
+        self._count(call_type)
+        return self.llm.generate_response(system_prompt, prompt, history, call_type=call_type)
+
+    def generate_response_stream(self, system_prompt, prompt, history, call_type="answer"):
+        self._count(call_type)
+        return self.llm.generate_response_stream(system_prompt, prompt, history, call_type=call_type)
+
+    def reset(self):
+        with self.lock:
+            calls = dict(self.calls)
+            self.calls.clear()
+        return calls
+
+def load_queries(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        queries = json.loads(text)
+    else:
+        queries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    for (index, query) in enumerate(queries):
+        if not query.get("relevant_sources") and not query.get("relevant_chunks"):
+            raise ValueError(f"Query {index} ({query.get('query')!r}) has no relevant_sources or relevant_chunks.")
+    return queries
+
+def normalize_source(source):
+    data_directory = (os.getenv("data_directory") or "").rstrip("/")
+    source = source.replace("\\", "/")
+    if data_directory and source.startswith(f"{data_directory}/"):
+        source = source[len(data_directory) + 1:]
+    return source
+
+def relevant_items(document, labels):
+    """The labeled items (("chunk", id) or ("source", path)) the retrieved document matches."""
+    items = set()
+    if document.get("id") in labels["chunks"]:
+        items.add(("chunk", document["id"]))
+    source = normalize_source(document.get("metadata", {}).get("source", ""))
+    for relevant in labels["sources"]:
+        if source == relevant or source.endswith(f"/{relevant}"):
+            items.add(("source", relevant))
+    return items
+
+def score(documents, labels, ks):
+    """recall@k and nDCG@k for every k, and the reciprocal rank of the first relevant document."""
+    total = len(labels["chunks"]) + len(labels["sources"])
+    found = set()
+    reciprocal_rank = 0.0
+    gains = []
+    for (rank, document) in enumerate(documents[:max(ks)]):
+        items = relevant_items(document, labels)
+        if items and reciprocal_rank == 0.0:
+            reciprocal_rank = 1.0 / (rank + 1)
+        # A document only counts for the relevant items no earlier document matched
+        new = items - found
+        found |= new
+        gains.append((1.0 if new else 0.0, len(found)))
+
+    result = {"mrr": reciprocal_rank}
+    for k in ks:
+        dcg = sum(gain / math.log2(rank + 2) for (rank, (gain, _)) in enumerate(gains[:k]))
+        ideal = sum(1.0 / math.log2(rank + 2) for rank in range(min(k, total)))
+        matched = gains[:k][-1][1] if len(gains[:k]) > 0 else 0
+        result[f"recall@{k}"] = matched / total
+        result[f"ndcg@{k}"] = dcg / ideal if ideal > 0 else 0.0
+    return result
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def evaluate(raghelper, counter, queries, ks, warmup):
+    """Run the queries through the retrieval pipeline with the current settings."""
+    from settings import snapshot
+
+    snapshot()
+    for query in queries[:warmup]:
+        raghelper.fetch_documents(query["query"], query.get("datasets", []))
+    counter.reset()
+
+    scores = []
+    latencies = []
+    for query in queries:
+        labels = {
+            "chunks": set(query.get("relevant_chunks", [])),
+            "sources": {normalize_source(source) for source in query.get("relevant_sources", [])},
+        }
+        start = time.perf_counter()
+        (_, _, documents, _) = raghelper.fetch_documents(query["query"], query.get("datasets", []))
+        latencies.append(time.perf_counter() - start)
+        scores.append(score(documents or [], labels, ks))
+    calls = counter.reset()
+
+    result = {metric: statistics.mean(entry[metric] for entry in scores) for metric in scores[0]}
+    result.update({
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "llm_calls_per_query": sum(calls.values()) / len(queries),
+        "llm_calls": calls,
+    })
+    return result
+
+def cheapest(results, ks, tolerance):
+    """The fastest configuration (then the one with the fewest LLM calls) within tolerance of the best recall."""
+    metric = f"recall@{max(ks)}"
+    best = max(result[metric] for result in results.values())
+    candidates = [name for (name, result) in results.items() if result[metric] >= best - tolerance]
+    return min(candidates, key=lambda name: (results[name]["p50_ms"], results[name]["llm_calls_per_query"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval quality versus latency per pipeline configuration.")
+    parser.add_argument("--queries", required=True, help="Labeled query set (JSON list or JSONL).")
+    parser.add_argument("--configs", default=None, help="JSON file of configuration name -> settings overrides.")
+    parser.add_argument("--k", default="1,3,5,10", help="Comma-separated cutoffs for recall@k and nDCG@k.")
+    parser.add_argument("--warmup", type=int, default=3, help="Queries run (and not measured) before every configuration.")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Recall a cheaper configuration may give up.")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv(override=True)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)-8s %(message)s')
+    logger = logging.getLogger(__name__)
+
+    ks = sorted(int(k) for k in args.k.split(","))
+    queries = load_queries(args.queries)
+    configurations = DEFAULT_CONFIGURATIONS
+    if args.configs:
+        with open(args.configs, "r", encoding="utf-8") as f:
+            configurations = json.load(f)
+
+    from ConnectionPool import ConnectionPool
+    from RAGHelper import RAGHelper
+    from settings import load_settings
+
+    # The models a configuration needs must be loaded up front
+    base_environment = dict(os.environ)
+    if any(settings.get("rerank") == "True" for settings in configurations.values()):
+        os.environ["rerank"] = "True"
+    raghelper = RAGHelper(logger, ConnectionPool.from_env())
+    os.environ.clear()
+    os.environ.update(base_environment)
+    counter = CallCounter(raghelper.llm)
+    raghelper.llm = counter
+
+    results = {}
+    try:
+        for (name, overrides) in configurations.items():
+            load_settings({**base_environment, **{key: str(value) for (key, value) in overrides.items()}})
+            results[name] = evaluate(raghelper, counter, queries, ks, args.warmup)
+            print(f"Evaluated {name}.")
+    finally:
+        load_settings(base_environment)
+
+    columns = [f"recall@{k}" for k in ks] + ["mrr", f"ndcg@{max(ks)}"]
+    print(f"\n{'configuration':<24}" + "".join(f"{column:>11}" for column in columns) + f"{'p50 ms':>10}{'p95 ms':>10}{'LLM/q':>8}")
+    for (name, result) in results.items():
+        print(
+            f"{name:<24}" + "".join(f"{result[column]:11.3f}" for column in columns) +
+            f"{result['p50_ms']:10.1f}{result['p95_ms']:10.1f}{result['llm_calls_per_query']:8.2f}"
+        )
+    choice = cheapest(results, ks, args.tolerance)
+    print(f"\nCheapest configuration within {args.tolerance:.3f} recall@{max(ks)} of the best: {choice}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "queries": len(queries),
+                "k": ks,
+                "configurations": configurations,
+                "results": results,
+                "cheapest": choice,
+            }, f, indent=2)
+        print(f"Wrote the results to {args.output}.")
+
+if __name__ == "__main__":
+    main()
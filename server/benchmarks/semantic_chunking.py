@@ -0,0 +1,168 @@
+"""
+Ingestion time and retrieval quality of the SemanticChunker's chunk embeddings.
+
+Chunks deterministic synthetic documents and embeds the chunks three ways:
+    per-chunk   embed every chunk on its own after chunking, as ingestion used to
+    batched     embed the chunks again, in batches (chunk_embeddings=batched)
+    pooled      pool the embeddings of the chunks' sentences (chunk_embeddings=pooled), which
+                reuses the embeddings computed for chunking with --buffer-size 0
+and reports the ingestion time, the texts (and characters) run through the model, the
+cosine similarity of the pooled embeddings to the embeddings of the chunk text and
+recall@k and MRR of retrieving the chunk a query was drawn from, among all chunks.
+
+Runs offline on the hashed bag-of-words stand-in, or on an embedding model with --model.
+Run from the server directory:
+    python -m benchmarks.semantic_chunking --documents 20
+    python -m benchmarks.semantic_chunking --model avsolatorio/GIST-small-Embedding-v0 --output semantic.json
+"""
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+
+from SemanticChunker import SemanticChunker
+from benchmarks.synthetic import SyntheticCorpus, StubEmbedder
+
+class CountingModel:
+    """Wraps the embedding model to count the calls, texts and characters it embeds."""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+        self.texts = 0
+        self.characters = 0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        self.calls += 1
+        batch = [texts] if isinstance(texts, str) else texts
+        self.texts += len(batch)
+        self.characters += sum(len(text) for text in batch)
+        return self.model.encode(texts, batch_size=batch_size, **kwargs)
+
+    def reset(self):
+        counts = (self.calls, self.texts, self.characters)
+        (self.calls, self.texts, self.characters) = (0, 0, 0)
+        return counts
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def ingest(chunker, model, documents, mode):
+    """Chunk and embed every document, returning the chunks, their embeddings and the seconds per document."""
+    chunks = []
+    embeddings = []
+    durations = []
+    for document in documents:
+        start = time.perf_counter()
+        if mode == "per-chunk":
+            document_chunks = chunker.split_text(document)
+            document_embeddings = [model.encode(chunk) for chunk in document_chunks]
+        else:
+            (document_chunks, document_embeddings) = chunker.split_text_with_embeddings(document)
+        durations.append(time.perf_counter() - start)
+        chunks.extend(document_chunks)
+        embeddings.extend(document_embeddings)
+    return (chunks, np.asarray(embeddings, dtype=np.float32), durations)
+
+def retrieval_quality(model, chunks, embeddings, queries, ks):
+    """recall@k and MRR of finding the chunk every query was drawn from."""
+    query_embeddings = normalize(np.asarray(model.encode([query for (query, _) in queries]), dtype=np.float32))
+    similarities = query_embeddings @ normalize(embeddings).T
+    ranks = []
+    for (row, (_, target)) in zip(similarities, queries):
+        # The rank of the target is the number of chunks scoring strictly higher
+        ranks.append(int(np.sum(row > row[target])))
+    result = {"mrr": statistics.mean(1.0 / (rank + 1) for rank in ranks)}
+    for k in ks:
+        result[f"recall@{k}"] = sum(1 for rank in ranks if rank < k) / len(ranks)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion time and retrieval quality of pooled and batched semantic chunk embeddings.")
+    parser.add_argument("--documents", type=int, default=20, help="Number of synthetic documents.")
+    parser.add_argument("--paragraphs", type=int, default=20, help="Paragraphs per document, roughly.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", default="1,5,10", help="Comma-separated cutoffs for recall@k.")
+    parser.add_argument("--model", default=None, help="SentenceTransformer model to embed with instead of the offline stand-in.")
+    parser.add_argument("--breakpoint-threshold-type", default="percentile")
+    parser.add_argument("--buffer-size", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+        base_model = SentenceTransformer(args.model)
+    else:
+        base_model = StubEmbedder()
+    model = CountingModel(base_model)
+    ks = sorted(int(k) for k in args.k.split(","))
+
+    corpus = SyntheticCorpus(seed=args.seed)
+    documents = [corpus.text(index, paragraphs=args.paragraphs) for index in range(args.documents)]
+    # Warm up the model (and the stand-in's word vectors) outside the measurements
+    model.encode(documents[:1])
+    model.reset()
+
+    results = {}
+    reference = None
+    for mode in ["per-chunk", "batched", "pooled"]:
+        chunker = SemanticChunker(
+            model,
+            breakpoint_threshold_type=args.breakpoint_threshold_type,
+            buffer_size=args.buffer_size,
+            chunk_embeddings="batched" if mode == "per-chunk" else mode,
+            batch_size=args.batch_size,
+        )
+        (chunks, embeddings, durations) = ingest(chunker, model, documents, mode)
+        (calls, texts, characters) = model.reset()
+
+        if reference is None:
+            # Chunking is deterministic, so every mode sees the same chunks and queries
+            reference = (chunks, normalize(embeddings))
+            queries = corpus.queries(args.queries, [{"content": chunk} for chunk in chunks])
+            targets = {chunk: index for (index, chunk) in enumerate(chunks)}
+            labeled = []
+            for query in queries:
+                # The first chunk containing the query counts as its source
+                target = next((targets[chunk] for chunk in chunks if query in chunk), None)
+                if target is not None:
+                    labeled.append((query, target))
+
+        similarity = np.einsum("ij,ij->i", normalize(embeddings), reference[1])
+        results[mode] = {
+            "chunks": len(chunks),
+            "seconds": sum(durations),
+            "ms_per_document": statistics.median(durations) * 1000,
+            "model_calls": calls,
+            "texts_embedded": texts,
+            "characters_embedded": characters,
+            "similarity_mean": float(np.mean(similarity)),
+            "similarity_min": float(np.min(similarity)),
+            **retrieval_quality(base_model, chunks, embeddings, labeled, ks),
+        }
+
+    columns = [f"recall@{k}" for k in ks] + ["mrr"]
+    print(f"{len(documents)} documents, {results['pooled']['chunks']} chunks, {len(labeled)} queries\n")
+    print(f"{'mode':<12}{'seconds':>9}{'ms/doc':>9}{'calls':>8}{'texts':>8}{'kchars':>9}{'cos mean':>10}{'cos min':>9}" + "".join(f"{column:>11}" for column in columns))
+    for (mode, result) in results.items():
+        print(
+            f"{mode:<12}{result['seconds']:9.2f}{result['ms_per_document']:9.1f}{result['model_calls']:8d}{result['texts_embedded']:8d}{result['characters_embedded'] / 1000:9.1f}"
+            f"{result['similarity_mean']:10.3f}{result['similarity_min']:9.3f}" + "".join(f"{result[column]:11.3f}" for column in columns)
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"documents": len(documents), "queries": len(labeled), "model": args.model or "stub", "results": results}, f, indent=2)
+        print(f"\nWrote the results to {args.output}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Concurrent-stream load test for /chat_stream.
+
+Opens increasing numbers of simultaneous /chat_stream requests and reports, per level, how
+many streams completed, the time to first token and, most importantly, the peak number of
+streams that were receiving tokens at the same time. With the threaded WSGI server that
+peak is capped by the worker threads; with the ASGI server it should follow the level.
+
+Run the server against the mock LLM (use_openai=True, OPENAI_BASE_URL=http://127.0.0.1:8765/v1,
+OPENAI_API_KEY=mock, use_async_llm=True) and compare both entry points, from the server directory:
+    python -m benchmarks.mock_llm_server --port 8765 --ttft-ms 200 --tokens 200 --token-interval-ms 20
+    gunicorn --bind 0.0.0.0:5000 --workers 1 --threads 4 --worker-class gthread server:app
+    python -m benchmarks.stream_load --url http://127.0.0.1:5000 --levels 4,16,64
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+    python -m benchmarks.stream_load --url http://127.0.0.1:5000 --levels 4,16,64
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+class StreamCounter:
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    def started(self):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+
+    def finished(self):
+        self.active -= 1
+
+async def run_stream(client, url, prompt, counter, timeout):
+    """Run one /chat_stream request, returns (ttft, total) in seconds or None on failure."""
+    start = time.perf_counter()
+    ttft = None
+    try:
+        async with client.stream("POST", f"{url}/chat_stream", json={"prompt": prompt, "history": [], "docs": [], "datasets": []}, timeout=timeout) as response:
+            if response.status_code != 200:
+                return None
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif event == "token" and ttft is None:
+                    ttft = time.perf_counter() - start
+                    counter.started()
+                elif event == "error":
+                    return None
+                elif event == "done":
+                    break
+    except httpx.HTTPError:
+        return None
+    finally:
+        if ttft is not None:
+            counter.finished()
+    if ttft is None:
+        return None
+    return (ttft, time.perf_counter() - start)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+async def run_level(url, prompt, concurrency, timeout):
+    counter = StreamCounter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[run_stream(client, url, prompt, counter, timeout) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    completed = [result for result in results if result is not None]
+    ttfts = [ttft for (ttft, _) in completed]
+    print(
+        f"{concurrency:>6} {len(completed):>9} {concurrency - len(completed):>6} {counter.peak:>11} "
+        f"{statistics.median(ttfts) if ttfts else float('nan'):>10.2f} "
+        f"{percentile(ttfts, 0.95) if ttfts else float('nan'):>10.2f} {elapsed:>9.2f}"
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure concurrent /chat_stream capacity.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--levels", default="1,4,16,64", help="Comma-separated numbers of concurrent streams.")
+    parser.add_argument("--prompt", default="What is this document collection about?")
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    print(f"{'level':>6} {'completed':>9} {'failed':>6} {'peak active':>11} {'p50 ttft':>10} {'p95 ttft':>10} {'wall (s)':>9}")
+    for level in [int(level) for level in args.levels.split(",")]:
+        await run_level(args.url, args.prompt, level, args.timeout)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,208 @@
+"""
+Deterministic synthetic data and offline stand-ins for the models and the database, shared
+by the benchmarks. Everything is generated from a seed, so two runs (or two branches)
+measure exactly the same work.
+"""
+import hashlib
+import random
+import zlib
+
+import numpy as np
+
+class SyntheticCorpus:
+    """
+    Generates documents of paragraphs of sentences over a fixed random vocabulary (with
+    some accented words and punctuation, like real text), spread over a few datasets.
+    """
+
+    def __init__(self, seed=42, vocabulary_size=5000):
+        self.seed = seed
+        rng = random.Random(seed)
+        letters = "abcdefghijklmnopqrstuvwxyz" * 4 + "éèàöüñç"
+        self.vocabulary = [
+            "".join(rng.choice(letters) for _ in range(rng.randint(2, 10)))
+            for _ in range(vocabulary_size)
+        ]
+
+    def _rng(self, *key):
+        return random.Random(f"{self.seed}:{':'.join(str(part) for part in key)}")
+
+    def sentence(self, rng, min_words=6, max_words=24):
+        words = rng.choices(self.vocabulary, k=rng.randint(min_words, max_words))
+        words[0] = words[0].capitalize()
+        if len(words) > 8 and rng.random() < 0.3:
+            words[len(words) // 2] += ","
+        return " ".join(words) + rng.choice([".", ".", ".", "?", "!"])
+
+    def paragraph(self, rng, min_sentences=2, max_sentences=8):
+        return " ".join(self.sentence(rng) for _ in range(rng.randint(min_sentences, max_sentences)))
+
+    def text(self, index, paragraphs=20):
+        """The text of document index, with roughly the given number of paragraphs."""
+        rng = self._rng("text", index)
+        count = max(1, rng.randint(paragraphs // 2, paragraphs * 3 // 2))
+        return "\n\n".join(self.paragraph(rng) for _ in range(count))
+
+    def chunks(self, count, datasets=3):
+        """count chunk dicts (id, content, metadata with source and dataset), as stored by the retriever."""
+        chunks = []
+        for index in range(count):
+            rng = self._rng("chunk", index)
+            content = self.paragraph(rng, 3, 10)
+            dataset = f"dataset{index % datasets}"
+            chunks.append({
+                "id": hashlib.md5(content.encode()).hexdigest(),
+                "content": content,
+                "metadata": {"source": f"data/{dataset}/document{index // 10}.txt", "dataset": dataset},
+            })
+        return chunks
+
+    def queries(self, count, chunks=None):
+        """count short queries, drawn from the given chunks (so they have answers) or from the vocabulary."""
+        queries = []
+        for index in range(count):
+            rng = self._rng("query", index)
+            if chunks:
+                words = rng.choice(chunks)["content"].rstrip(".?!").split()
+                start = rng.randint(0, max(0, len(words) - 6))
+                queries.append(" ".join(words[start:start + rng.randint(3, 6)]).strip(","))
+            else:
+                queries.append(" ".join(rng.choices(self.vocabulary, k=rng.randint(3, 8))))
+        return queries
+
+class StubEmbedder:
+    """
+    Offline stand-in for the SentenceTransformer: a hashed bag-of-words embedding, so
+    texts that share words are similar, at a tiny fraction of the cost of a real model.
+    """
+
+    def __init__(self, dimension=384):
+        self.dimension = dimension
+        self.word_vectors = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def _word_vector(self, word):
+        vector = self.word_vectors.get(word)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(word.encode()))
+            vector = rng.standard_normal(self.dimension).astype(np.float32)
+            self.word_vectors[word] = vector
+        return vector
+
+    def _encode_one(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in text.lower().split():
+            vector += self._word_vector(word.strip(".,?!"))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.stack([self._encode_one(text) for text in texts]) if len(texts) > 0 else np.zeros((0, self.dimension), dtype=np.float32)
+
+class StubLLM:
+    """Offline stand-in for LLMHelper that answers instantly with a canned reply."""
+
+    backend = "stub"
+    model_name = "stub"
+
+    def __init__(self, reply="yes"):
+        self.reply = reply
+
+    def generate_response(self, system_prompt, prompt, history, call_type="answer"):
+        thread = history + [{"role": "user", "content": prompt}]
+        return (self.reply, thread + [{"role": "assistant", "content": self.reply}])
+
+    def generate_response_stream(self, system_prompt, prompt, history, call_type="answer"):
+        thread = history + [{"role": "user", "content": prompt}]
+        return (iter(self.reply.split(" ")), thread)
+
+class StubRanker:
+    """Offline stand-in for a flashrank Ranker, scoring passages by their word overlap with the query."""
+
+    def rerank(self, request):
+        query_words = set(request.query.lower().split())
+        results = []
+        for passage in request.passages:
+            words = passage["text"].lower().split()
+            score = sum(1 for word in words if word in query_words) / (len(words) or 1)
+            results.append({**passage, "score": score})
+        return results
+
+class StubCursor:
+    def __init__(self, pool):
+        self.pool = pool
+        self.rows = []
+
+    def execute(self, query, params=()):
+        # The LIMIT is the last parameter of every retrieval query
+        limit = params[-1] if len(params) > 0 and isinstance(params[-1], int) else len(self.pool.chunks)
+        if "hybrid_score" in query:
+            self.rows = self.pool.hybrid_rows[:limit]
+        elif "paradedb.score" in query:
+            self.rows = self.pool.bm25_rows[:limit]
+        elif "<=>" in query:
+            self.rows = self.pool.vector_rows[:limit]
+        else:
+            self.rows = []
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if len(self.rows) > 0 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+class StubConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        return StubCursor(self.pool)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class StubConnectionPool:
+    """
+    Offline stand-in for the Postgres connection pool, answering the retriever's BM25,
+    vector and hybrid queries with precomputed rows over the given chunks. Benchmarks on
+    top of it measure the retriever's own work (query preparation, fusion, result shaping).
+    """
+
+    def __init__(self, chunks, seed=42):
+        self.chunks = chunks
+        rng = random.Random(seed)
+        bm25_order = list(range(len(chunks)))
+        vector_order = list(range(len(chunks)))
+        rng.shuffle(bm25_order)
+        rng.shuffle(vector_order)
+        self.bm25_rows = [(chunks[i]["id"], chunks[i]["content"], chunks[i]["metadata"]) for i in bm25_order]
+        self.vector_rows = [
+            (chunks[i]["id"], chunks[i]["content"], chunks[i]["metadata"], 0.2 + rank / len(chunks))
+            for (rank, i) in enumerate(vector_order)
+        ]
+        self.hybrid_rows = [
+            (chunks[i]["id"], chunks[i]["content"], chunks[i]["metadata"], 10.0 - rank / len(chunks), 0.2 + rank / len(chunks), "bm25,vector", 1.0 - rank / len(chunks))
+            for (rank, i) in enumerate(bm25_order)
+        ]
+
+    def getconn(self, timeout=None):
+        return StubConnection(self)
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def closeall(self):
+        pass
@@ -20,11 +20,5 @@ if [ -f /ragmeup/.env.mounted ]; then
   sed -i "s|^embedding_cpu=.*|embedding_cpu=True|" /ragmeup/.env
 fi
 
-exec gunicorn \
-  --bind 0.0.0.0:5000 \
-  --workers 1 \
-  --threads 4 \
-  --worker-class gthread \
-  --timeout 600 \
-  --graceful-timeout 300 \
-  server:app
+# Worker processes, threads and SERVER_MODE (wsgi or asgi) are configured in gunicorn.conf.py
+exec gunicorn -c gunicorn.conf.py
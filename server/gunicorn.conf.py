@@ -0,0 +1,97 @@
+"""
+Gunicorn configuration for running the server with several worker processes.
+
+With several workers the application is preloaded in the master process: the embedding
+and provenance models are loaded, and the database setup and ingestion run, exactly once.
+Workers are then forked and share the loaded weights copy-on-write, each opening its own
+database connection pool and LLM clients (server.init_worker). Thread pools do not survive
+a fork (a worker forked from a master with a running OpenMP or ONNX Runtime pool can
+deadlock), so the master runs torch single-threaded, drops its flashrank (ONNX Runtime)
+sessions before forking and leaves the model warm-up to the workers, which restore the
+thread count and recreate the reranker. A single worker loads everything in the
+background while already answering /healthz and /readyz.
+
+Run from the server directory with:
+    gunicorn -c gunicorn.conf.py
+
+Settings (from .env or the environment):
+    server_workers       Number of worker processes (default 1)
+    server_threads       Threads per worker for the threaded WSGI worker (default 4)
+    server_timeout       Worker timeout in seconds (default 600)
+    SERVER_MODE          "wsgi" (default) or "asgi" to serve asgi:app with uvicorn workers
+
+Multiple workers only share models on CPU: CUDA cannot be used in a process forked after
+it was initialized, so run GPU deployments with a single worker (embedding_cpu=False).
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+workers = int(os.getenv("server_workers", "1"))
+threads = int(os.getenv("server_threads", "4"))
+timeout = int(os.getenv("server_timeout", "600"))
+graceful_timeout = 300
+bind = "0.0.0.0:5000"
+
+if os.getenv("SERVER_MODE", "wsgi") == "asgi":
+    wsgi_app = "asgi:app"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "server:app"
+    worker_class = "gthread"
+
+# Load the models, set up the database and ingest the data once, in the master. The
+# master cannot serve /readyz meanwhile, so this is done synchronously (a single worker
+# starts up in the background instead, see background_warmup).
+preload_app = workers > 1
+if preload_app:
+    os.environ["RAGMEUP_PRELOAD"] = "True"
+    # Inference in the master (ingestion) must not start thread pools the workers inherit
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    import torch
+    os.environ["RAGMEUP_TORCH_THREADS"] = str(torch.get_num_threads())
+    torch.set_num_threads(1)
+
+# With several workers the Prometheus metrics are collected per process in files and
+# aggregated by /metrics. This must be set before prometheus_client is imported.
+if workers > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="ragmeup-metrics-")
+
+def when_ready(arbiter):
+    if not preload_app:
+        return
+    import server as application
+
+    if workers > 1 and os.getenv("embedding_cpu") != "True":
+        arbiter.log.warning("Running several workers without embedding_cpu=True, CUDA cannot be shared with forked workers.")
+
+    # The master's connections and ONNX Runtime sessions must not be shared with the workers
+    application.db_pool.closeall()
+    application.raghelper.before_fork()
+    # Keep the loaded objects out of the garbage collector, so collections in the workers
+    # do not write to (and thereby copy) the shared memory pages
+    gc.freeze()
+
+def post_fork(arbiter, worker):
+    if not preload_app:
+        return
+    # Each worker gets its own intra-op thread pool, started after the fork
+    import torch
+    torch.set_num_threads(int(os.getenv("RAGMEUP_TORCH_THREADS", "1")))
+    import server as application
+    application.init_worker()
+
+def child_exit(arbiter, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+def on_exit(arbiter):
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory and os.path.basename(directory).startswith("ragmeup-metrics-"):
+        shutil.rmtree(directory, ignore_errors=True)
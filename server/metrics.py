@@ -0,0 +1,168 @@
+"""
+Prometheus metrics shared by the RAG server components. Everything is registered
+on the default prometheus_client registry and exposed through /metrics.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+# Reranking
+RERANK_STAGE_SECONDS = Histogram(
+    "ragmeup_rerank_stage_seconds",
+    "Time spent in each reranking stage.",
+    ["stage"],
+)
+RERANK_DOCUMENTS = Counter(
+    "ragmeup_rerank_documents_total",
+    "Number of documents scored by each reranking stage.",
+    ["stage"],
+)
+RERANK_EARLY_EXITS = Counter(
+    "ragmeup_rerank_early_exits_total",
+    "Cascaded reranks that skipped the second stage.",
+)
+
+# Speculative retrieval
+SPECULATIVE_RETRIEVALS = Counter(
+    "ragmeup_speculative_retrievals_total",
+    "Speculative retrievals started alongside the fetch decision, by outcome.",
+    ["outcome"],
+)
+SPECULATIVE_SAVED_SECONDS = Histogram(
+    "ragmeup_speculative_saved_seconds",
+    "Latency saved by using a speculative retrieval.",
+)
+
+# LLM response cache
+LLM_CACHE_REQUESTS = Counter(
+    "ragmeup_llm_cache_requests_total",
+    "LLM cache lookups per call type, by result (hit or miss).",
+    ["call_type", "result"],
+)
+
+# LLM usage
+LLM_PROMPT_TOKENS = Counter(
+    "ragmeup_llm_prompt_tokens_total",
+    "Prompt tokens reported by the LLM provider: total, served from the prefix cache (cached) and written to it (cache_write).",
+    ["backend", "kind"],
+)
+
+# Query embedding micro-batching
+EMBEDDING_QUEUE_DEPTH = Histogram(
+    "ragmeup_embedding_queue_depth",
+    "Number of queries already waiting when a query is queued for embedding.",
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128),
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "ragmeup_embedding_batch_size",
+    "Number of queries encoded per batched encode call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+# Multi-backend LLM routing
+LLM_ROUTED_CALLS = Counter(
+    "ragmeup_llm_routed_calls_total",
+    "LLM calls per first-choice backend and call type.",
+    ["backend", "call_type"],
+)
+LLM_HEDGED_CALLS = Counter(
+    "ragmeup_llm_hedged_calls_total",
+    "LLM calls hedged to a second backend, by primary backend and winning backend.",
+    ["primary", "winner"],
+)
+LLM_FALLBACKS = Counter(
+    "ragmeup_llm_fallbacks_total",
+    "LLM calls that fell back to another backend after an error.",
+    ["backend"],
+)
+
+# Local embedding-based decisions
+LOCAL_DECISIONS = Counter(
+    "ragmeup_local_decisions_total",
+    "Fetch and rewrite decisions by who made them: local (embedding similarity) or llm (uncertain band).",
+    ["decision", "decided_by"],
+)
+LOCAL_DECISION_AGREEMENT = Counter(
+    "ragmeup_local_decision_agreement_total",
+    "Audited local decisions by whether the LLM agreed.",
+    ["decision", "agreed"],
+)
+LOCAL_DECISION_SIMILARITY = Histogram(
+    "ragmeup_local_decision_similarity",
+    "Embedding similarity at the time of a decision, by the LLM's answer where it was asked.",
+    ["decision", "llm_answer"],
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+
+# Per-request pipeline tracing
+PIPELINE_STAGE_SECONDS = Histogram(
+    "ragmeup_pipeline_stage_seconds",
+    "Time spent per pipeline stage, by LLM backend.",
+    ["stage", "backend"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "ragmeup_llm_time_to_first_token_seconds",
+    "Time from requesting the streamed answer to its first token, by LLM backend.",
+    ["backend"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16),
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "ragmeup_llm_tokens_per_second",
+    "Streamed answer throughput after the first token, by LLM backend.",
+    ["backend"],
+    buckets=(5, 10, 20, 40, 60, 80, 120, 160, 240, 400),
+)
+
+# Postgres connection pool (gauges are summed over worker processes in multiprocess mode)
+DB_POOL_CONNECTIONS = Gauge(
+    "ragmeup_db_pool_connections",
+    "Open connections in the Postgres connection pool.",
+    multiprocess_mode="livesum",
+)
+DB_POOL_IN_USE = Gauge(
+    "ragmeup_db_pool_in_use",
+    "Connections currently checked out of the Postgres connection pool.",
+    multiprocess_mode="livesum",
+)
+DB_POOL_WAITING = Gauge(
+    "ragmeup_db_pool_waiting",
+    "Callers waiting for a connection from the Postgres connection pool.",
+    multiprocess_mode="livesum",
+)
+DB_POOL_ACQUIRE_SECONDS = Histogram(
+    "ragmeup_db_pool_acquire_seconds",
+    "Time to check out a (validated) connection from the Postgres connection pool.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+DB_POOL_TIMEOUTS = Counter(
+    "ragmeup_db_pool_timeouts_total",
+    "Checkouts from the Postgres connection pool that timed out.",
+)
+DB_POOL_REPLACED = Counter(
+    "ragmeup_db_pool_replaced_connections_total",
+    "Broken connections replaced on checkout from the Postgres connection pool.",
+)
+
+# Admission control (gauges are summed over worker processes in multiprocess mode)
+ADMISSION_ACTIVE = Gauge(
+    "ragmeup_admission_active",
+    "Calls currently running a concurrency-limited stage.",
+    ["stage"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUED = Gauge(
+    "ragmeup_admission_queued",
+    "Calls waiting for a slot in a concurrency-limited stage.",
+    ["stage"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "ragmeup_admission_wait_seconds",
+    "Time admitted calls waited for a slot in a concurrency-limited stage.",
+    ["stage"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+ADMISSION_REJECTED = Counter(
+    "ragmeup_admission_rejected_total",
+    "Calls refused by admission control, because the wait queue was full or the wait timed out.",
+    ["stage", "reason"],
+)
@@ -3,8 +3,10 @@ import json
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 
+from settings import get_settings
+
 def compute_rerank_provenance(reranker, query, documents, answer):
-    if os.getenv("attribute_include_query") == "True":
+    if get_settings().get("attribute_include_query") == "True":
         full_text = query + "\n" + answer
     else:
         full_text = answer
@@ -14,18 +16,19 @@ def compute_rerank_provenance(reranker, query, documents, answer):
     return scored_documents
 
 def compute_llm_provenance(llm, query, context, answer):
-    prompt = os.getenv("provenance_llm_prompt")
+    settings = get_settings()
+    prompt = settings.get("provenance_llm_prompt")
     # Go over all documents in the context
     provenance_scores = []
     for doc in context:
         # Create the thread to ask the LLM to assign a score to this document for provenance
         new_doc = doc
         new_doc['content'] = new_doc['content'].replace("{", "{{").replace("}", "}}")
-        if os.getenv("attribute_include_query") == "False":
+        if settings.get("attribute_include_query") == "False":
             input_chat = prompt.format_map({"query": f"The user asked {query}" , "context": new_doc, "answer": answer})
         else:
             input_chat = prompt.format_map({"query": "", "context": new_doc, "answer": answer})
-        (response, _) = llm.generate_response(None, input_chat, [])
+        (response, _) = llm.generate_response(None, input_chat, [], call_type="provenance")
         score = response
         provenance_scores.append(score)
     
@@ -40,7 +43,7 @@ class DocumentSimilarityAttribution:
 
     def compute_similarity(self, query, context, answer):
         include_query=True
-        if os.getenv("attribute_include_query") == "False":
+        if get_settings().get("attribute_include_query") == "False":
             include_query=False
             
         # Encode the answer, query, and context documents
@@ -1,12 +1,19 @@
-from flask import Flask, request, jsonify, send_file, Response
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 import logging
 from dotenv import load_dotenv, dotenv_values
 import os
+import threading
 import json
 import numpy as np
 from decimal import Decimal
 from RAGHelper import RAGHelper
-from psycopg2 import pool
+from startup import StartupTracker
+from SessionStore import SessionStore
+from ConnectionPool import ConnectionPool
+from settings import Settings, load_settings, get_settings, snapshot, release
+from tracing import end_trace
+from admission import Overloaded, reload_limiters
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, multiprocess
 
 class SafeJSONEncoder(json.JSONEncoder):
     """JSON encoder that handles numpy types, Decimals, and other edge cases."""
@@ -46,16 +53,103 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S')
 logger = logging.getLogger(__name__)
 
-# Set up a connection pool
-db_pool = pool.SimpleConnectionPool(
-    minconn=1,
-    maxconn=10,
-    dsn=os.getenv("postgres_uri")
-)
+# Validate the settings once, a misconfigured server should not start
+load_settings()
+
+def create_db_pool():
+    return ConnectionPool.from_env()
+
+# The connection pool and RAG helper are set up by initialize(), in the background unless
+# background_warmup=False or the app is preloaded by gunicorn.conf.py for forked workers
+startup = StartupTracker(logger)
+db_pool = None
+raghelper = None
+session_store = None
+
+def initialize():
+    """Connect to the database and instantiate the RAG helper (loading models and data)."""
+    global db_pool, raghelper, session_store
+    with startup.phase("database connection"):
+        db_pool = create_db_pool()
+        session_store = SessionStore.from_env(logger, db_pool)
+    logger.info("Instantiating RAG helper.")
+    raghelper = RAGHelper(logger, db_pool, startup=startup)
+    startup.ready()
+
+def initialize_in_background():
+    try:
+        initialize()
+    except Exception as e:
+        startup.failed(e)
+
+if os.getenv("background_warmup", "True") == "True" and not os.getenv("RAGMEUP_PRELOAD"):
+    threading.Thread(target=initialize_in_background, name="warm-up", daemon=True).start()
+else:
+    initialize()
 
-# Instantiate the RAG Helper class
-logger.info("Instantiating RAG helper.")
-raghelper = RAGHelper(logger, db_pool)
+def init_worker():
+    """
+    Called in every worker forked from a preloaded master (see gunicorn.conf.py): the models
+    loaded above are shared, the database connections and LLM clients are per worker.
+    """
+    global db_pool, session_store
+    db_pool = create_db_pool()
+    session_store = SessionStore.from_env(logger, db_pool)
+    raghelper.after_fork(db_pool)
+    logger.info(f"Initialized worker process {os.getpid()}.")
+
+# Routes that are served while the server is still starting up
+STARTUP_ROUTES = {"/healthz", "/readyz", "/metrics"}
+
+@app.before_request
+def require_ready():
+    """Answer 503 until the models are loaded and the data is ingested."""
+    if request.path in STARTUP_ROUTES or startup.is_ready():
+        return None
+    response = jsonify({"error": "The server is starting up, try again shortly.", "startup": startup.to_dict()})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+@app.errorhandler(Overloaded)
+def overloaded(error):
+    """A saturated stage answers fast (429 when its queue is full, 503 after waiting) instead of piling up."""
+    response = jsonify({"error": str(error), "stage": error.stage})
+    response.status_code = error.status
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+def stream_error_event(error):
+    """The error event ending a stream, with the status and retry delay if the server is overloaded."""
+    data = {"error": str(error)}
+    if isinstance(error, Overloaded):
+        data.update({"status": error.status, "stage": error.stage, "retry_after": error.retry_after})
+    return f"event: error\ndata: {safe_json_dumps(data)}\n\n"
+
+@app.before_request
+def pin_settings():
+    """Every request works with one settings snapshot, even if /config changes them meanwhile."""
+    # Worker threads are reused, a trace left behind by an earlier request must not collect this one's stages
+    end_trace()
+    snapshot()
+
+@app.teardown_request
+def unpin_settings(error=None):
+    """Clear the request's settings and trace from the (reused) worker thread."""
+    release()
+    end_trace()
+
+@app.route("/healthz", methods=['GET'])
+def healthz():
+    """Liveness: the process is up, unless startup failed and it needs a restart."""
+    if startup.status == "failed":
+        return jsonify(startup.to_dict()), 500
+    return jsonify({"status": "ok"}), 200
+
+@app.route("/readyz", methods=['GET'])
+def readyz():
+    """Readiness: the models are loaded, the data is ingested and the models are warmed up."""
+    return jsonify(startup.to_dict()), 200 if startup.is_ready() else 503
 
 @app.route("/create_title", methods=['POST'])
 def create_title():
@@ -65,12 +159,65 @@ def create_title():
     (response, _) = raghelper.llm.generate_response(
         None,
         f"Write a succinct title (few words) for a chat that has the question: {question}\n\nYou NEVER give explanations, only the title and you are forced to always start and end with an emoji (two distinct ones!). You also stick to the language of the question.",
-        []
+        [],
+        call_type="title"
     )
     logger.info(f"Title for question {question}: {response}")
 
     return jsonify({"title": response}), 200
 
+# ---- Server-side sessions ----
+
+def load_conversation(json_data):
+    """
+    Resolve the history and documents of a chat request. When sessions are enabled and the
+    client sends a conversation_id, they come from the session store instead of the request
+    (a new or expired conversation starts from whatever the client sent).
+
+    Returns:
+        (conversation_id or None if sessions are not used, history, docs)
+    """
+    history = json_data.get('history', [])
+    docs = json_data.get('docs', [])
+    conversation_id = json_data.get('conversation_id')
+    if not conversation_id or session_store is None:
+        return (None, history, docs)
+    session = session_store.get(conversation_id)
+    if session is not None:
+        history = session["history"]
+        docs = session["documents"]
+    return (conversation_id, history, docs)
+
+def session_delta(conversation_id, response_dict):
+    """
+    Store the turn in the session and strip the response down to what the client does not
+    have yet: the full history stays on the server, documents are referenced by chunk id and
+    only sent in full when new ones were fetched.
+    """
+    session_store.save(conversation_id, response_dict["history"], response_dict["documents"])
+    delta = {key: value for (key, value) in response_dict.items() if key not in ["history", "documents"]}
+    delta["conversation_id"] = conversation_id
+    delta["history_length"] = len(response_dict["history"])
+    delta["document_ids"] = [document.get("id") for document in response_dict["documents"] or []]
+    if response_dict["fetched_new_documents"]:
+        delta["documents"] = response_dict["documents"]
+    return delta
+
+@app.route("/sessions/<conversation_id>", methods=['GET'])
+def get_session(conversation_id):
+    """Return the full server-side history and documents of a conversation, e.g. to restore a client."""
+    session = session_store.get(conversation_id) if session_store is not None else None
+    if session is None:
+        return jsonify({"error": "Unknown conversation."}), 404
+    return jsonify({"conversation_id": conversation_id, **session}), 200
+
+@app.route("/sessions/<conversation_id>", methods=['DELETE'])
+def delete_session(conversation_id):
+    if session_store is None:
+        return jsonify({"error": "Sessions are not enabled."}), 404
+    session_store.delete(conversation_id)
+    return jsonify({"status": "ok"}), 200
+
 @app.route("/chat", methods=['POST'])
 def chat():
     """
@@ -84,13 +231,12 @@ def chat():
     """
     json_data = request.get_json()
     prompt = json_data.get('prompt')
-    history = json_data.get('history', [])
-    original_docs = json_data.get('docs', [])
+    (conversation_id, history, original_docs) = load_conversation(json_data)
     datasets = json_data.get('datasets', [])
     docs = original_docs
 
     # Get the LLM response
-    (response, documents, fetched_new_documents, rewritten, new_history, provenance_scores) = raghelper.handle_user_interaction(prompt, history, datasets)
+    (response, documents, fetched_new_documents, rewritten, new_history, provenance_scores) = raghelper.handle_user_interaction(prompt, history, datasets, docs=original_docs)
     if not fetched_new_documents:
         documents = docs
 
@@ -105,8 +251,42 @@ def chat():
     if provenance_scores is not None:
         for i, doc in enumerate(response_dict["documents"]):
             response_dict["documents"][i]["provenance"] = provenance_scores[i]["score"]
+    if conversation_id:
+        response_dict = session_delta(conversation_id, response_dict)
     return jsonify(response_dict)
 
+def format_stream_event(event_type, event_data, prompt, original_docs, conversation_id=None):
+    """
+    Format a pipeline event from handle_user_interaction_stream as a Server-Sent Event. With a
+    conversation id, the done event is stored in the session and only carries the delta.
+    """
+    if event_type == "step":
+        return f"event: step\ndata: {safe_json_dumps({'step': event_data})}\n\n"
+    elif event_type == "token":
+        return f"event: token\ndata: {safe_json_dumps({'token': event_data})}\n\n"
+    elif event_type == "documents":
+        return f"event: documents\ndata: {safe_json_dumps({'documents': event_data})}\n\n"
+    elif event_type == "done":
+        metadata = event_data
+        documents = metadata.get("documents") or original_docs
+        provenance_scores = metadata.get("provenance_scores")
+        if provenance_scores is not None and documents:
+            for i, doc in enumerate(documents):
+                if i < len(provenance_scores):
+                    documents[i]["provenance"] = provenance_scores[i]["score"]
+        done_data = {
+            "reply": metadata["reply"],
+            "history": metadata["history"],
+            "documents": documents,
+            "rewritten": metadata["rewritten"],
+            "question": prompt,
+            "fetched_new_documents": metadata["fetched_new_documents"],
+            "timings": metadata["timings"],
+        }
+        if conversation_id:
+            done_data = session_delta(conversation_id, done_data)
+        return f"event: done\ndata: {safe_json_dumps(done_data)}\n\n"
+
 @app.route("/chat_stream", methods=['POST'])
 def chat_stream():
     """
@@ -115,52 +295,101 @@ def chat_stream():
     """
     json_data = request.get_json()
     prompt = json_data.get('prompt')
-    history = json_data.get('history', [])
-    original_docs = json_data.get('docs', [])
+    (conversation_id, history, original_docs) = load_conversation(json_data)
     datasets = json_data.get('datasets', [])
 
     def generate():
         try:
-            for event_type, event_data in raghelper.handle_user_interaction_stream(prompt, history, datasets):
-                if event_type == "step":
-                    yield f"event: step\ndata: {safe_json_dumps({'step': event_data})}\n\n"
-                elif event_type == "token":
-                    yield f"event: token\ndata: {safe_json_dumps({'token': event_data})}\n\n"
-                elif event_type == "documents":
-                    yield f"event: documents\ndata: {safe_json_dumps({'documents': event_data})}\n\n"
-                elif event_type == "done":
-                    metadata = event_data
-                    documents = metadata.get("documents") or original_docs
-                    provenance_scores = metadata.get("provenance_scores")
-                    if provenance_scores is not None and documents:
-                        for i, doc in enumerate(documents):
-                            if i < len(provenance_scores):
-                                documents[i]["provenance"] = provenance_scores[i]["score"]
-                    done_data = {
-                        "reply": metadata["reply"],
-                        "history": metadata["history"],
-                        "documents": documents,
-                        "rewritten": metadata["rewritten"],
-                        "question": prompt,
-                        "fetched_new_documents": metadata["fetched_new_documents"],
-                    }
-                    yield f"event: done\ndata: {safe_json_dumps(done_data)}\n\n"
+            for event_type, event_data in raghelper.handle_user_interaction_stream(prompt, history, datasets, docs=original_docs):
+                yield format_stream_event(event_type, event_data, prompt, original_docs, conversation_id)
+        except Overloaded as e:
+            logger.warning(f"Streaming request refused: {e}")
+            yield stream_error_event(e)
         except Exception as e:
             logger.error(f"Streaming error: {e}", exc_info=True)
-            yield f"event: error\ndata: {safe_json_dumps({'error': str(e)})}\n\n"
+            yield stream_error_event(e)
 
-    return Response(generate(), mimetype='text/event-stream', headers={
+    # Streamed within the request, so its settings and trace are only cleared once the stream ends
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
         'Cache-Control': 'no-cache',
         'X-Accel-Buffering': 'no',
         'Connection': 'keep-alive',
     })
 
+@app.route("/retrieve_batch", methods=['POST'])
+def retrieve_batch():
+    """
+    Retrieve (and optionally rerank) the documents for many queries at once, without calling
+    the LLM, for evaluations and bulk jobs. The results are streamed as NDJSON, one line per
+    query in the order of the request.
+
+    Request body:
+        queries: list of query strings or {"query": ..., "datasets": [...]} objects
+        datasets: datasets to search for queries that do not specify their own (optional)
+        rerank: whether to rerank, defaults to the rerank setting (optional)
+        top_k: number of documents to return per query (optional)
+    """
+    json_data = request.get_json()
+    queries = json_data.get('queries', [])
+    if not queries:
+        return jsonify({"error": "No queries provided"}), 400
+    datasets = json_data.get('datasets', [])
+    rerank = json_data.get('rerank')
+    top_k = json_data.get('top_k')
+    if rerank is not None and not isinstance(rerank, bool):
+        return jsonify({"error": "rerank must be true or false"}), 400
+    if (get_settings().rerank if rerank is None else rerank) and getattr(raghelper, "reranker", None) is None:
+        return jsonify({"error": "Reranking was requested but no reranker is loaded (set rerank=True and reinitialize)"}), 400
+    if top_k is not None and (isinstance(top_k, bool) or not isinstance(top_k, int) or top_k <= 0):
+        return jsonify({"error": "top_k must be a positive integer"}), 400
+
+    def generate():
+        try:
+            for result in raghelper.retrieve_batch(queries, datasets, rerank=rerank, top_k=top_k):
+                yield f"{safe_json_dumps(result)}\n"
+        except Exception as e:
+            logger.error(f"Batch retrieval error: {e}", exc_info=True)
+            yield f"{safe_json_dumps({'error': str(e)})}\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route("/get_documents", methods=['GET'])
 def get_documents():
-    # Query the database for all documents
-    files = raghelper.retriever.get_all_document_names()
-    return jsonify(files)
-
+    """
+    List the ingested documents with their dataset, chunk count, size and ingestion time.
+    Optional query parameters: limit and offset to page through them, dataset to filter on.
+    The total number of (matching) documents is returned in the X-Total-Count header.
+    """
+    try:
+        limit = request.args.get('limit')
+        limit = None if limit is None else int(limit)
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    if limit is not None and limit < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    if offset < 0:
+        return jsonify({"error": "offset must be a non-negative integer"}), 400
+    dataset = request.args.get('dataset')
+
+    files = raghelper.retriever.get_all_document_names(offset=offset, limit=limit, dataset=dataset)
+    response = jsonify(files)
+    total = raghelper.retriever.count_documents(dataset=dataset)
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
+    return response
+
+
+def _data_file_path(filename):
+    """The path of a file in the data directory, or None if the name points outside of it."""
+    data_dir = os.getenv('data_directory')
+    if not isinstance(filename, str) or filename == "":
+        return None
+    file_path = os.path.join(data_dir, filename)
+    root = os.path.realpath(data_dir)
+    if os.path.commonpath([root, os.path.realpath(file_path)]) != root:
+        return None
+    return file_path
 
 @app.route("/get_document", methods=['POST'])
 def get_document():
@@ -176,8 +405,9 @@ def get_document():
     """
     json_data = request.get_json()
     filename = json_data.get('filename')
-    data_dir = os.getenv('data_directory')
-    file_path = os.path.join(data_dir, filename)
+    file_path = _data_file_path(filename)
+    if file_path is None:
+        return jsonify({"error": "Invalid filename"}), 400
 
     if not os.path.exists(file_path):
         return jsonify({"error": "File not found"}), 404
@@ -191,27 +421,55 @@ def get_document():
 @app.route("/delete", methods=['POST'])
 def delete_document():
     """
-    Delete a specific document from the data directory and the Milvus vector store.
+    Delete documents from the data directory and the vector store.
+
+    This endpoint expects a JSON payload with either the filename of a single document,
+    a list of filenames, or a dataset to delete all of its documents. Chunks are deleted
+    in throttled batches (delete_batch_size, delete_batch_pause_ms), so large deletions
+    do not hold up concurrent searches.
 
-    This endpoint expects a JSON payload containing the filename of the document to delete.
-    It removes the document from the Milvus collection and the filesystem.
+    Filenames that point outside of the data directory are rejected.
 
     Returns:
-        JSON response with the count of deleted documents.
+        JSON response with the count of deleted chunks (and, for bulk deletions, of the files
+        removed and the files that did not exist).
     """
     json_data = request.get_json()
-    filename = json_data.get('filename')
-    data_dir = os.getenv('data_directory')
-    file_path = os.path.join(data_dir, filename)
 
-    if not os.path.exists(file_path):
-        return jsonify({"error": "File not found"}), 404
-
-    # Remove the file from the filesystem
-    os.remove(file_path)
+    if json_data.get('dataset'):
+        file_paths = raghelper.retriever.get_sources(json_data['dataset'])
+        if len(file_paths) == 0:
+            return jsonify({"error": "Dataset not found"}), 404
+    elif json_data.get('filenames'):
+        filenames = json_data['filenames']
+        if not isinstance(filenames, list):
+            return jsonify({"error": "filenames must be a list"}), 400
+        file_paths = [_data_file_path(filename) for filename in filenames]
+        invalid = [filename for (filename, file_path) in zip(filenames, file_paths) if file_path is None]
+        if len(invalid) > 0:
+            return jsonify({"error": f"Invalid filenames: {', '.join(map(str, invalid))}"}), 400
+    else:
+        file_path = _data_file_path(json_data.get('filename'))
+        if file_path is None:
+            return jsonify({"error": "Invalid filename"}), 400
+        if not os.path.exists(file_path):
+            return jsonify({"error": "File not found"}), 404
+        file_paths = [file_path]
+
+    # Remove the files from the filesystem
+    removed = 0
+    missing = []
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            removed += 1
+        else:
+            missing.append(os.path.relpath(file_path, os.getenv('data_directory')))
 
-    delete_count = raghelper.retriever.delete([file_path])
+    delete_count = raghelper.retriever.delete(file_paths)
 
+    if json_data.get('dataset') or json_data.get('filenames'):
+        return jsonify({"count": delete_count, "files": removed, "missing": missing})
     return jsonify({"count": delete_count})
 
 @app.route("/add_document", methods=['POST'])
@@ -244,6 +502,16 @@ def get_datasets():
     datasets = raghelper.retriever.get_datasets()
     return jsonify(datasets)
 
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """Expose the Prometheus metrics collected by the RAG pipeline."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Aggregate over all worker processes
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
 # ---- Configuration endpoints ----
 
 def _env_file_path():
@@ -273,6 +541,12 @@ def update_config():
     if not new_values:
         return jsonify({"error": "No config values provided"}), 400
 
+    # Reject invalid values before they end up in the .env file
+    try:
+        Settings.from_mapping({**os.environ, **{key: str(value) for (key, value) in new_values.items()}})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     env_path = _env_file_path()
 
     # Read existing .env preserving order
@@ -308,6 +582,11 @@ def update_config():
 
     # Reload env vars into os.environ
     load_dotenv(env_path, override=True)
+    # Swap in the new settings, requests already running keep their snapshot while the
+    # rest of this one applies the new settings
+    load_settings()
+    snapshot()
+    reload_limiters()
 
     # Optionally reinitialise the LLM / reranker
     if should_reinitialize:
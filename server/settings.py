@@ -0,0 +1,197 @@
+import contextvars
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+_REQUIRED = object()
+
+def _bool(value):
+    # Flags are only on when set to exactly "True", as everywhere in the .env file
+    return value == "True"
+
+def _optional_float(value):
+    return None if value in ("", "None") else float(value)
+
+def _positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise ValueError(f"{value} is not positive")
+    return number
+
+def _non_negative_int(value):
+    number = int(value)
+    if number < 0:
+        raise ValueError(f"{value} is negative")
+    return number
+
+def _positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise ValueError(f"{value} is not positive")
+    return number
+
+def _non_negative_float(value):
+    number = float(value)
+    if number < 0:
+        raise ValueError(f"{value} is negative")
+    return number
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Immutable snapshot of the configuration. The values used on every request are parsed
+    and validated once when the snapshot is created, all other keys (prompt templates and
+    the like) are available as strings through get().
+    """
+    values: Mapping[str, str]
+
+    # Retrieval
+    vector_store_k: int
+    use_rrf: bool
+    rrf_k: int
+    use_re2: bool
+    re2_prompt: Optional[str]
+
+    # Reranking
+    rerank: bool
+    rerank_k: Optional[int]
+    rerank_cascade: bool
+    rerank_cascade_model: str
+    rerank_cascade_k: Optional[int]
+    rerank_cascade_threshold: Optional[float]
+
+    # Pipeline steps
+    use_hyde: bool
+    use_rewrite_loop: bool
+    use_speculative_retrieval: bool
+    use_summarization: bool
+    summarization_threshold: Optional[int]
+    summarization_background: bool
+    provenance_method: str
+
+    # LLM calls
+    temperature: float
+    use_prompt_caching: bool
+    anthropic_max_tokens: int
+
+    # Bulk operations
+    retrieve_batch_workers: int
+    retrieve_batch_chunk_size: int
+    delete_batch_size: int
+    delete_batch_pause_ms: float
+
+    # Admission control, admission_concurrency maps a stage (or "llm" for all LLM backends)
+    # to its admission_<stage>_concurrency, 0 leaving it unlimited
+    use_admission_control: bool
+    admission_concurrency: Mapping[str, int]
+    admission_queue_size: int
+    admission_queue_timeout: float
+    admission_retry_after: int
+
+    # Async LLM client connection pool
+    llm_max_connections: int
+    llm_max_keepalive_connections: int
+    llm_keepalive_expiry: float
+    llm_timeout: float
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    @classmethod
+    def from_mapping(cls, environ):
+        """
+        Parse and validate the settings from a mapping of environment variables.
+
+        Raises:
+            ValueError listing every missing or malformed setting.
+        """
+        values = MappingProxyType(dict(environ))
+        errors = []
+
+        def parse(key, parser, default=None):
+            raw = values.get(key)
+            if raw is None or raw == "":
+                if default is _REQUIRED:
+                    errors.append(f"{key} is not set")
+                    return None
+                return default
+            try:
+                return parser(raw)
+            except ValueError:
+                errors.append(f"{key}={raw!r} is not a valid {parser.__name__.strip('_')}")
+                return None
+
+        rerank = parse("rerank", _bool, False)
+        use_summarization = parse("use_summarization", _bool, False)
+        settings = cls(
+            values=values,
+            vector_store_k=parse("vector_store_k", int, _REQUIRED),
+            use_rrf=parse("use_rrf", _bool, False),
+            rrf_k=parse("rrf_k", int, 60),
+            use_re2=parse("use_re2", _bool, False),
+            re2_prompt=values.get("re2_prompt"),
+            rerank=rerank,
+            rerank_k=parse("rerank_k", int, _REQUIRED if rerank else None),
+            rerank_cascade=parse("rerank_cascade", _bool, False),
+            rerank_cascade_model=values.get("rerank_cascade_model") or "score",
+            rerank_cascade_k=parse("rerank_cascade_k", int),
+            rerank_cascade_threshold=parse("rerank_cascade_threshold", _optional_float),
+            use_hyde=parse("use_hyde", _bool, False),
+            use_rewrite_loop=parse("use_rewrite_loop", _bool, False),
+            use_speculative_retrieval=parse("use_speculative_retrieval", _bool, False),
+            use_summarization=use_summarization,
+            summarization_threshold=parse("summarization_threshold", int, _REQUIRED if use_summarization else None),
+            summarization_background=parse("summarization_background", _bool, False),
+            provenance_method=values.get("provenance_method", "none"),
+            temperature=parse("temperature", float, 0.0),
+            use_prompt_caching=parse("use_prompt_caching", _bool, False),
+            anthropic_max_tokens=parse("anthropic_max_tokens", int, 4096),
+            retrieve_batch_workers=parse("retrieve_batch_workers", _positive_int, 4),
+            retrieve_batch_chunk_size=parse("retrieve_batch_chunk_size", _positive_int, 256),
+            delete_batch_size=parse("delete_batch_size", _positive_int, 1000),
+            delete_batch_pause_ms=parse("delete_batch_pause_ms", _non_negative_float, 50.0),
+            use_admission_control=parse("use_admission_control", _bool, False),
+            admission_concurrency=MappingProxyType({
+                key[len("admission_"):-len("_concurrency")]: parse(key, _non_negative_int, 0)
+                for key in values if key.startswith("admission_") and key.endswith("_concurrency")
+            }),
+            admission_queue_size=parse("admission_queue_size", _non_negative_int, 32),
+            admission_queue_timeout=parse("admission_queue_timeout", _non_negative_float, 30.0),
+            admission_retry_after=parse("admission_retry_after", _non_negative_int, 5),
+            llm_max_connections=parse("llm_max_connections", _positive_int, 100),
+            llm_max_keepalive_connections=parse("llm_max_keepalive_connections", _non_negative_int, 20),
+            llm_keepalive_expiry=parse("llm_keepalive_expiry", _non_negative_float, 60.0),
+            llm_timeout=parse("llm_timeout", _positive_float, 600.0),
+        )
+        if len(errors) > 0:
+            raise ValueError(f"Invalid settings: {'; '.join(errors)}")
+        return settings
+
+# The latest validated settings, replaced as a whole when the configuration changes
+_current = None
+# The snapshot a request pinned, so it sees the same values from start to finish
+_request_settings = contextvars.ContextVar("ragmeup_settings", default=None)
+
+def load_settings(environ=None):
+    """Validate the settings from the environment and make them the current ones."""
+    global _current
+    _current = Settings.from_mapping(os.environ if environ is None else environ)
+    return _current
+
+def get_settings():
+    """The settings pinned by the current request, or the current settings outside of a request."""
+    settings = _request_settings.get()
+    if settings is not None:
+        return settings
+    return _current if _current is not None else load_settings()
+
+def release():
+    """Unpin the settings of the request that ran on this thread."""
+    _request_settings.set(None)
+
+def snapshot():
+    """Pin the current settings for the rest of the request (and work it hands to other threads)."""
+    settings = _current if _current is not None else load_settings()
+    _request_settings.set(settings)
+    return settings
@@ -0,0 +1,58 @@
+import threading
+import time
+from contextlib import contextmanager
+
+class StartupTracker:
+    """
+    Keeps track of the startup phases (model loading, database setup, ingestion, warm-up)
+    so their durations end up in the logs and /readyz can report progress.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.current_phase = None
+        self.status = "starting"
+        self.error = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        with self.lock:
+            self.current_phase = name
+        self.logger.info(f"Startup phase '{name}' started.")
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = round(seconds, 2)
+                self.current_phase = None
+            self.logger.info(f"Startup phase '{name}' took {seconds:.2f} s.")
+
+    def ready(self):
+        with self.lock:
+            self.status = "ready"
+        breakdown = ", ".join(f"{name} {seconds:.2f} s" for (name, seconds) in self.phases.items())
+        self.logger.info(f"Server ready after {time.perf_counter() - self.start:.2f} s ({breakdown}).")
+
+    def failed(self, error):
+        with self.lock:
+            self.status = "failed"
+            self.error = str(error)
+        self.logger.error(f"Startup failed during phase '{self.current_phase}': {error}", exc_info=error)
+
+    def is_ready(self):
+        return self.status == "ready"
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "status": self.status,
+                "phase": self.current_phase,
+                "elapsed_seconds": round(time.perf_counter() - self.start, 2),
+                "phases": dict(self.phases),
+                "error": self.error,
+            }
@@ -0,0 +1,122 @@
+"""
+Prompt-prefix caching against the local mock LLM provider: two turns of a conversation
+through LLMHelper.generate_response, checking the requests the provider receives and the
+cached token counts LLMHelper logs.
+"""
+import json
+import logging
+import re
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# LLMHelper imports the clients of every backend
+LLMHelper = pytest.importorskip("LLMHelper", reason="the LLM client libraries are not installed").LLMHelper
+
+import settings
+from benchmarks.mock_llm_server import MockLLMHandler
+
+@pytest.fixture
+def mock_llm():
+    """Run the mock provider on a free port, recording the requests and JSON responses."""
+    class RecordingHandler(MockLLMHandler):
+        ttft = 0
+        tokens = 5
+        token_interval = 0
+        prefix_cache = {}
+        requests = []
+        responses = []
+
+        def _read_json(self):
+            request = super()._read_json()
+            self.requests.append(request)
+            return request
+
+        def _send_json(self, payload, status=200):
+            self.responses.append(payload)
+            super()._send_json(payload, status)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordingHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield (RecordingHandler, f"http://127.0.0.1:{server.server_address[1]}")
+    server.shutdown()
+    server.server_close()
+
+def make_llm(monkeypatch, backend, base_url):
+    for key in ["use_openai", "use_gemini", "use_azure", "use_anthropic", "use_ollama", "use_admission_control"]:
+        monkeypatch.delenv(key, raising=False)
+    for (key, value) in {
+        f"use_{backend}": "True",
+        f"{backend}_model_name": "mock",
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "ANTHROPIC_API_KEY": "mock",
+        "ANTHROPIC_BASE_URL": base_url,
+        "use_prompt_caching": "True",
+        "temperature": "0",
+        "vector_store_k": "10",
+    }.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.setattr(settings, "_current", None)
+    settings.load_settings()
+    return LLMHelper(logging.getLogger("test_prompt_caching"))
+
+def converse(llm, turns=2):
+    """Follow-up turns without new documents: the system prompt and history are resent as they were."""
+    context = " ".join(f"document{i}" for i in range(2000))
+    system_prompt = f"Answer the question using these documents:\n\n{context}"
+    history = []
+    for turn in range(turns):
+        (response, thread) = llm.generate_response(
+            system_prompt if turn == 0 else None,
+            f"Question number {turn + 1}?",
+            history
+        )
+        history = thread + [{"role": "assistant", "content": response}]
+
+def logged_cached_tokens(caplog):
+    return [
+        int(match.group(1))
+        for match in (re.search(r"prompt tokens: \d+, cached: (\d+)", record.getMessage()) for record in caplog.records)
+        if match is not None
+    ]
+
+def test_anthropic_caches_system_prompt_and_history(monkeypatch, caplog, mock_llm):
+    (handler, base_url) = mock_llm
+    llm = make_llm(monkeypatch, "anthropic", base_url)
+    with caplog.at_level(logging.INFO, logger="test_prompt_caching"):
+        converse(llm)
+
+    (first, second) = handler.requests
+    assert second["system"][-1]["cache_control"] == {"type": "ephemeral"}
+    # The breakpoint is on the last history message, not on the new question
+    assert second["messages"][-2]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in second["messages"][-1]["content"][-1]
+
+    # The cached prefix is sent byte for byte the same on both turns
+    assert json.dumps(second["system"]) == json.dumps(first["system"])
+    assert json.dumps(second["messages"][0]) == json.dumps(first["messages"][0])
+
+    cached = logged_cached_tokens(caplog)
+    assert len(cached) == 2
+    assert cached[0] == 0
+    assert cached[1] > 0
+
+def test_openai_keeps_prefix_stable_and_parses_cached_tokens(monkeypatch, caplog, mock_llm):
+    (handler, base_url) = mock_llm
+    llm = make_llm(monkeypatch, "openai", base_url)
+    with caplog.at_level(logging.INFO, logger="test_prompt_caching"):
+        converse(llm)
+
+    (first, second) = handler.requests
+    assert json.dumps(second["messages"][:len(first["messages"])]) == json.dumps(first["messages"])
+
+    # The cached tokens come from usage.prompt_tokens_details
+    reported = [response["usage"]["prompt_tokens_details"]["cached_tokens"] for response in handler.responses]
+    cached = logged_cached_tokens(caplog)
+    assert cached == reported
+    assert cached[0] == 0
+    assert cached[1] > 0
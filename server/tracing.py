@@ -0,0 +1,111 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import PIPELINE_STAGE_SECONDS, LLM_TIME_TO_FIRST_TOKEN, LLM_TOKENS_PER_SECOND
+
+# The trace of the request being handled. Work handed to other threads keeps reporting
+# to it when submitted with contextvars.copy_context().run.
+_current_trace = contextvars.ContextVar("ragmeup_trace", default=None)
+
+class Trace:
+    """
+    Per-request timings of the pipeline stages (summarization, fetch decision, HyDE, query
+    embedding, BM25 and vector legs, fusion, rerank, rewrite, generation, provenance) and
+    of the answer stream. Every stage is also observed in the Prometheus histograms,
+    labelled with the LLM backend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.ttft = None
+        self.tokens = 0
+        self.tokens_per_second = None
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        # Stages that run more than once (e.g. retrieval after a rewrite) are summed up
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        PIPELINE_STAGE_SECONDS.labels(stage=name, backend=self.backend).observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def _stream_started(self):
+        self._stream_start = time.perf_counter()
+        self._first_token = None
+
+    def _stream_chunk(self):
+        if self._first_token is None:
+            self._first_token = time.perf_counter()
+            self.ttft = self._first_token - self._stream_start
+            LLM_TIME_TO_FIRST_TOKEN.labels(backend=self.backend).observe(self.ttft)
+        # Providers stream roughly one token per chunk
+        self.tokens += 1
+
+    def _stream_finished(self):
+        end = time.perf_counter()
+        self.add("generation", end - self._stream_start)
+        if self._first_token is not None and end > self._first_token:
+            self.tokens_per_second = self.tokens / (end - self._first_token)
+            LLM_TOKENS_PER_SECOND.labels(backend=self.backend).observe(self.tokens_per_second)
+
+    def timed_stream(self, stream):
+        """Pass through an LLM stream, recording time to first token and token throughput."""
+        self._stream_started()
+        for chunk in stream:
+            self._stream_chunk()
+            yield chunk
+        self._stream_finished()
+
+    async def atimed_stream(self, stream):
+        """Async version of timed_stream."""
+        self._stream_started()
+        async for chunk in stream:
+            self._stream_chunk()
+            yield chunk
+        self._stream_finished()
+
+    def to_dict(self):
+        with self.lock:
+            stages = {name: round(seconds * 1000, 1) for (name, seconds) in self.stages.items()}
+        return {
+            "backend": self.backend,
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "stages_ms": stages,
+            "ttft_ms": None if self.ttft is None else round(self.ttft * 1000, 1),
+            "tokens": self.tokens,
+            "tokens_per_second": None if self.tokens_per_second is None else round(self.tokens_per_second, 1),
+        }
+
+def start_trace(backend):
+    """Start tracing the current request."""
+    trace = Trace(backend)
+    _current_trace.set(trace)
+    return trace
+
+def end_trace():
+    """Stop tracing on this thread, so work done later for another request is not attributed to it."""
+    _current_trace.set(None)
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage of the current request, a no-op outside of a traced request."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield